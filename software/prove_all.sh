@@ -16,8 +16,11 @@ ${REPO}/software/hal/hal/STM32/obj/gnatprove \
 ${REPO}/software/hal/hal/obj/gnatprove"
 OBJ_ALL="$OBJ $OBJ_OTHER"
 COPY_FOLDERS=$OBJ_ALL
+HISTORY=${REPO}/obj/proof_history.db # statistics of every run are appended here
+INDEX=${REPO}/obj/proof_index.db # checks of the last run, see: tools/gnatprove_unitstats.py query --help
 
 # set the following to something non-empty, to analyze all sources individually instead of entire project
+# (to split the units into balanced batches for several machines, see tools/gnatprove_schedule.py)
 INDIVIDUAL=
 
 ##### SCRIPT STARTS HERE
@@ -61,7 +64,8 @@ get_project_units () {
 ###############
 # PROOF PARAMS
 ###############
-TIME="/usr/bin/time -v"
+# to tune TIMEOU, STEPS and PROVERS from a previous run, see: tools/gnatprove_unitstats.py budget --help
+TIME="/usr/bin/time -v" # its output goes into analysis.log, see: tools/gnatprove_unitstats.py --time-log
 PROVEOPTS="--pedantic -v" # warns if arithmetic operations could be reorderd, which may refute a proof
 if [ "`hostname`" == "rr-u1204-1" ]; then
 	# server
@@ -101,6 +105,7 @@ gprbuild -p -P $PRJ
 # clean (optional; it is necessary when above parameters have changed, but increases analysis time!)
 gnatprove -P $PRJ --clean
 
+# to watch the progress of a running analysis: tools/gnatprove_filestats.py -t --follow $OBJ/analysis.log --units=$TAR/_units
 if [ ! -z "$INDIVIDUAL" ]; then
     ##################
     # iterate files
@@ -110,7 +115,7 @@ if [ ! -z "$INDIVIDUAL" ]; then
     get_project_units
     for u in $UNITS; do        
         # prove
-        $TIME gnatprove $GPFLAGS -P $PRJ ${PROVEOPTS} -j${CORES} -k --mode=prove --report=statistics --prover=${PROVERS} --timeout=${TIMEOU} --proof=${PROOF} --steps=${STEPS} -u $u | tee -a $OBJ/analysis.log || true
+        $TIME gnatprove $GPFLAGS -P $PRJ ${PROVEOPTS} -j${CORES} -k --mode=prove --report=statistics --prover=${PROVERS} --timeout=${TIMEOU} --proof=${PROOF} --steps=${STEPS} -u $u 2>&1 | tee -a $OBJ/analysis.log || true
         #echo "Unit=${u}:" >> $OBJ/gnatprove_prove.out
         #cat $OBJ/gnatprove.out >> $OBJ/gnatprove_prove.out || true
         # reports accumulate in gnatprove.out, so we only need to copy once in the end
@@ -123,13 +128,14 @@ else
     # analyze project
     ##################
     mkdir -p $OBJ # because otherwise 'gprbuild --clean' has the target for our log deleted
+    get_project_units # only for the progress, see below
 
     # flow mode
     #$TIME gnatprove $GPFLAGS -P $PRJ ${PROVEOPTS} -j${CORES} -k --mode=flow --report=all --prover=${PROVERS} || true
     #cp $OBJ/gnatprove.out $OBJ/gnatprove_flow.out || true
 
     # prove mode
-    $TIME gnatprove $GPFLAGS -P $PRJ ${PROVEOPTS} -j${CORES} -k --mode=prove --report=statistics --prover=${PROVERS} --timeout=${TIMEOU} --proof=${PROOF} --steps=${STEPS} | tee $OBJ/analysis.log || true
+    $TIME gnatprove $GPFLAGS -P $PRJ ${PROVEOPTS} -j${CORES} -k --mode=prove --report=statistics --prover=${PROVERS} --timeout=${TIMEOU} --proof=${PROOF} --steps=${STEPS} 2>&1 | tee $OBJ/analysis.log || true
     cp $OBJ/gnatprove.out $OBJ/gnatprove_prove.out || true
     
 fi
@@ -137,7 +143,8 @@ fi
 ##################
 # make statistics
 ##################
-${REPO}/tools/gnatprove_unitstats.py --sort=coverage,success,props --table $OBJ_ALL | tee $OBJ/unitstats.log || true
+# (when the folders are proven on several hosts, write --partial=<file> on each and combine them with: tools/gnatprove_unitstats.py merge --help)
+${REPO}/tools/gnatprove_unitstats.py --sort=coverage,success,props --table --history=$HISTORY --index=$INDEX --tag="$PREFIX" --time-log=$OBJ/analysis.log $OBJ_ALL | tee $OBJ/unitstats.log || true
 #${REPO}/tools/gnatprove_filestats.py --sort=coverage,success,props --table $OBJ/gnatprove_prove.out $OBJ/analysis.log | tee $OBJ/filestats.log || true
 
 ############
@@ -146,6 +153,8 @@ ${REPO}/tools/gnatprove_unitstats.py --sort=coverage,success,props --table $OBJ_
 if [ ! "$TAR" == "$OBJ" ]; then
     # copy all folders to target
     mkdir -p $TAR/$PREFIX
+    # proof settings of this run; only runs with the same settings are compared by: gnatprove_unitstats.py flaky
+    echo "$GPFLAGS $PROVEOPTS --prover=${PROVERS} --timeout=${TIMEOU} --proof=${PROOF} --steps=${STEPS}" > $TAR/${PREFIX}/_settings
     cnt=0
     echo "copy_folders=$COPY_FOLDERS"
     for o in $COPY_FOLDERS; do
@@ -153,7 +162,8 @@ if [ ! "$TAR" == "$OBJ" ]; then
         cnt=$((cnt+1))
         cp -R $o $TAR/${PREFIX}/gnatprove_${cnt} || true        
     done    
-    # save space: remove some files
+    # save space: remove some files. To save more, the gnatprove_* folders can be packed into tar.gz/tar.bz2/tar.xz
+    # archives (e.g., tar czf gnatprove_1.tar.gz gnatprove_1); the tools read those in place, without extracting
     if [ ! -z "$TAR" ]; then
         find $TAR/${PREFIX} -type f -name \*.mlw -exec rm -f {} \;
         find $TAR/${PREFIX} -type f -name \*.dot -exec rm -f {} \;
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+
+# This script generates synthetic GNATprove output trees (*.spark and *.ali
+# files) or reports (gnatprove.out and build log) and times the statistics
+# scripts on them.
+#
+# (C) 2017 TU Muenchen, RCS, Martin Becker <becker@rcs.ei.tum.de>
+
+import sys, getopt, os, time, json, random, subprocess, shutil, tempfile
+
+#######################################
+#     GLOBAL CONSTANTS
+#######################################
+UNITSTATS = os.path.join(os.path.dirname(os.path.realpath(__file__)), "gnatprove_unitstats.py")
+FILESTATS = os.path.join(os.path.dirname(os.path.realpath(__file__)), "gnatprove_filestats.py")
+PROOF_RULES = ("VC_OVERFLOW_CHECK", "VC_RANGE_CHECK", "VC_INDEX_CHECK", "VC_DIVISION_CHECK",
+               "VC_PRECONDITION", "VC_POSTCONDITION", "VC_DISCRIMINANT_CHECK", "VC_ASSERT")
+FLOW_RULES = ("UNINITIALIZED", "DEPENDS_WRONG", "GLOBAL_WRONG", "INEFFECTIVE")
+PROVERS = ("CVC4", "Z3", "altergo")
+
+#######################################
+#     FUNCTION DEFINITIONS
+#######################################
+
+def make_check_tree(rnd, proven):
+    """
+    one goal with an attempt of every prover, sometimes split into subgoals
+    """
+    def goal():
+        attempts = {}
+        for p in PROVERS:
+            valid = proven and rnd.random() < 0.7
+            attempts[p] = {"result": "Valid" if valid else "Unknown",
+                           "steps": rnd.randint(1, 5000),
+                           "time": round(rnd.expovariate(5.0), 3)}
+        return {"proof_attempts": attempts, "transformations": {}}
+    tree = goal()
+    if rnd.random() < 0.1:
+        tree["transformations"] = {"split_goal_wp": [goal() for _ in range(rnd.randint(2, 4))]}
+    return [tree]
+
+def make_unit(rnd, filebase, n_subs, n_vcs, withs=()):
+    """
+    contents of the .spark and .ali file of one synthetic unit, which depends
+    on the specs of the units (file bases) in withs
+    """
+    name = filebase.replace("-", ".").title()
+    spark = [{"name": name, "sloc": [{"file": filebase + ".ads", "line": 1}], "spark": "all"}]
+    ali = ["V \"GNAT Lib v2017\"", "P SS", "",
+           "U " + filebase.replace("-", ".") + "%b\t\t" + filebase + ".adb\t\t%08x NE OO PK" % rnd.getrandbits(32),
+           "U " + filebase.replace("-", ".") + "%s\t\t" + filebase + ".ads\t\t00000000 EE NE OO PK",
+           "", "D " + filebase + ".ads\t\t20170801120000 %08x" % rnd.getrandbits(32),
+           "D " + filebase + ".adb\t\t20170801120000 %08x" % rnd.getrandbits(32)]
+    ali += ["D " + w + ".ads\t\t20170801120000 00000000" for w in withs]
+    ali += ["",
+           "X 1 " + filebase + ".ads", "1K9*" + name + " 40e8 2|1b14"]
+    for s in range(n_subs):
+        subname = name + ".Sub_" + str(s)
+        mode = rnd.choice(("all", "all", "all", "spec", "no"))
+        spark.append({"name": subname, "sloc": [{"file": filebase + ".ads", "line": 3 + s}], "spark": mode})
+        ali.append("%d%s%d*Sub_%d 2|%db14" % (3 + s, rnd.choice("VU"), 14, s, 10 + s))
+    ali.append("X 2 " + filebase + ".adb")
+    ali.append("1K14*" + name + " 1|1K9")
+
+    proof = []
+    for v in range(n_vcs):
+        proven = rnd.random() < 0.85
+        vc = {"file": filebase + ".adb", "line": 10 + v, "col": rnd.randint(1, 80),
+              "rule": rnd.choice(PROOF_RULES),
+              "severity": "info" if proven else rnd.choice(("medium", "high", "low")),
+              "entity": {"name": name + ".Sub_" + str(v % max(n_subs, 1)),
+                         "sloc": [{"file": filebase + ".ads", "line": 3}]},
+              "tracefile": "", "msg_id": v, "how_proved": "prover",
+              "check_tree": make_check_tree(rnd, proven),
+              "cntexmp": {} if proven else {filebase + ".adb": {"current": {str(10 + v): [{"name": "X", "value": "0", "kind": "variable"}]}}}}
+        if not proven and rnd.random() < 0.05:
+            vc["suppressed"] = "justified by review"
+        proof.append(vc)
+    flow = []
+    for v in range(max(1, n_vcs / 10)):
+        flow.append({"file": filebase + ".adb", "line": 10 + v, "col": 4, "rule": rnd.choice(FLOW_RULES),
+                     "severity": "info" if rnd.random() < 0.95 else "medium",
+                     "entity": {"name": name, "sloc": [{"file": filebase + ".ads", "line": 1}]},
+                     "tracefile": "", "msg_id": v, "how_proved": "flow", "check_tree": {}})
+    contents = {"spark": spark, "flow": flow, "proof": proof,
+                "assumptions": [{"assumptions": [], "claim": {"predicate": "CLAIM_AORTE", "arg": {"name": name}}}]}
+    return contents, "\n".join(ali) + "\n"
+
+def make_tree(target, n_units, n_vcs, n_folders=1, seed=42):
+    """
+    write a synthetic gnatprove tree with n_units units spread over n_folders
+    folders. Returns the list of folders.
+    """
+    rnd = random.Random(seed)
+    rnd_deps = random.Random(seed + 1) # separate, so that the rest does not change
+    folders = [os.path.join(target, "gnatprove_" + str(k + 1)) for k in range(n_folders)]
+    for fld in folders:
+        if not os.path.isdir(fld): os.makedirs(fld)
+    filebases = []
+    for u in range(n_units):
+        depth = rnd.randint(0, 2)
+        filebase = "-".join(["pkg" + str(u)] + ["child" + str(d) for d in range(depth)])
+        # each unit withs a few of the units before it
+        withs = rnd_deps.sample(filebases, min(len(filebases), rnd_deps.randint(0, 4)))
+        filebases.append(filebase)
+        contents, ali = make_unit(rnd, filebase, rnd.randint(1, 30), rnd.randint(0, 2 * n_vcs), withs)
+        fld = folders[u % n_folders]
+        with open(os.path.join(fld, filebase + ".spark"), 'w') as f:
+            json.dump(contents, f)
+        with open(os.path.join(fld, filebase + ".ali"), 'w') as f:
+            f.write(ali)
+    return folders
+
+def make_report(target, n_lines, seed=42):
+    """
+    write a synthetic report (gnatprove.out) and build log (stdout of
+    gnatprove) with about n_lines lines each into target. Some units come
+    twice, as with flow and proof output. Returns both file names.
+    """
+    rnd = random.Random(seed)
+    if not os.path.isdir(target): os.makedirs(target)
+    report = os.path.join(target, "gnatprove.out")
+    log = os.path.join(target, "analysis.log")
+    with open(report, 'w') as rep, open(log, 'w') as lg:
+        rep.write("Summary of SPARK analysis\n=========================\n\n")
+        lg.write("Phase 1 of 2: generation of Global contracts ...\nPhase 2 of 2: flow analysis and proof ...\n")
+        lines = log_lines = 0
+        u = 0
+        while lines < n_lines or log_lines < n_lines:
+            filebase = "pkg" + str(rnd.randint(0, u) if rnd.random() < 0.05 else u)
+            u += 1
+            name = filebase.title()
+            n_subs = rnd.randint(1, 40)
+            buf = ["in unit " + filebase + ", " + str(n_subs) + " subprograms and packages out of " +
+                   str(n_subs + 2) + " analyzed"]
+            out = []
+            for sub in range(n_subs):
+                where = "  " + name + ".Sub_" + str(sub) + " at " + filebase + ".ads:" + str(3 + sub)
+                r = rnd.random()
+                if r < 0.1:
+                    buf.append(where + " skipped")
+                    continue
+                total = rnd.randint(0, 30)
+                good = total if r < 0.7 else rnd.randint(0, total)
+                if good == total:
+                    buf.append(where + " flow analyzed (0 errors and 0 warnings) and proved (" + str(total) + " checks)")
+                else:
+                    buf.append(where + " flow analyzed (0 errors and 0 warnings) and not proved, " +
+                               str(good) + " checks out of " + str(total) + " proved")
+                for c in range(total):
+                    loc = filebase + ".adb:" + str(10 + sub * 40 + c) + ":" + str(rnd.randint(1, 80)) + ": "
+                    if c < good:
+                        out.append(loc + "info: overflow check proved")
+                    else:
+                        out.append(loc + rnd.choice(("medium", "high", "low")) + ": range check might fail")
+            # the log grows faster; each file stops at its number of lines
+            if lines < n_lines:
+                rep.write("\n".join(buf) + "\n")
+                lines += len(buf)
+            if log_lines < n_lines and out:
+                lg.write("\n".join(out) + "\n")
+                log_lines += len(out)
+    return report, log
+
+def bench_filestats(files, scripts):
+    """
+    time and peak RSS of different versions of gnatprove_filestats.py, which
+    must all print the same
+    """
+    outputs = []
+    for script in scripts:
+        secs, rss, out = run_measured([sys.executable, script] + files)
+        outputs.append(out)
+        print "%-40s %8.2f s %8.1f MB" % (os.path.basename(script)[-40:], secs, rss)
+    same = all(o == outputs[0] for o in outputs)
+    print "identical:       " + str(same)
+    return same
+
+def run_measured(cmd):
+    """
+    run command, return (seconds, peak RSS in MB, stdout). The peak RSS
+    is that of the command itself, not of its worker processes.
+    """
+    with tempfile.TemporaryFile() as out:
+        t0 = time.time()
+        proc = subprocess.Popen(cmd, stdout=out)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        secs = time.time() - t0
+        if status != 0:
+            raise subprocess.CalledProcessError(status, cmd)
+        out.seek(0)
+        return secs, rusage.ru_maxrss / 1024.0, out.read()
+
+def bench_jobs(folders, jobs):
+    """
+    compare serial and parallel ingestion of gnatprove_unitstats.py
+    """
+    base = [sys.executable, UNITSTATS, "--no-cache", "--sort=coverage,success,props"]
+    t_ser, rss_ser, out_ser = run_measured(base + ["-j1"] + folders)
+    t_par, rss_par, out_par = run_measured(base + ["-j" + str(jobs)] + folders)
+    print "serial:          %8.2f s %8.1f MB" % (t_ser, rss_ser)
+    print "parallel (-j%d): %8.2f s %8.1f MB" % (jobs, t_par, rss_par)
+    print "speedup:         %8.2f" % (t_ser / t_par if t_par > 0 else 0)
+    print "identical:       " + str(out_ser == out_par)
+    return out_ser == out_par
+
+def bench_memory(folders, scripts, details):
+    """
+    time and peak RSS of different versions of gnatprove_unitstats.py. Other
+    versions are run with their default options.
+    """
+    for script in scripts:
+        cmd = [sys.executable, script] + (["--details"] if details else []) + folders
+        if script == UNITSTATS: cmd[2:2] = ["-j1", "--no-cache"]
+        secs, rss, _ = run_measured(cmd)
+        print "%-40s %8.2f s %8.1f MB" % (os.path.basename(script)[-40:], secs, rss)
+
+def print_usage():
+    print __file__ + " [OPTION] <target folder>"
+    print ''
+    print 'OPTIONS:'
+    print '   --units=N'
+    print '          number of synthetic units (default 500)'
+    print '   --vcs=N'
+    print '          average number of VCs per unit (default 200)'
+    print '   --folders=N'
+    print '          spread units over N gnatprove folders (default 5)'
+    print '   --jobs=N, -j N'
+    print '          number of workers for the parallel run (default: number of cores)'
+    print '   --keep, -k'
+    print '          keep the generated tree'
+    print '   --compare=<script>[,<script>]*'
+    print '          instead of -j1 against -jN, compare time and peak RSS against other'
+    print '          versions of gnatprove_unitstats.py (e.g., from git show <rev>:<path>)'
+    print '   --details, -d'
+    print '          with --compare: measure with --details'
+    print '   --report=N'
+    print '          instead, time gnatprove_filestats.py on a synthetic report and build log of'
+    print '          about N lines each, against the versions given with --compare'
+
+def main(argv):
+    import multiprocessing
+    n_units = 500
+    n_vcs = 200
+    n_folders = 5
+    jobs = multiprocessing.cpu_count()
+    keep = False
+    compare = []
+    details = False
+    report_lines = None
+
+    try:
+        opts, args = getopt.getopt(argv, "hj:kd", ["help","units=","vcs=","folders=","jobs=","keep","compare=","details","report="])
+    except getopt.GetoptError:
+        print_usage();
+        sys.exit(2)
+
+    if len(args) < 1:
+        print_usage();
+        sys.exit(0);
+
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage()
+            sys.exit()
+        elif opt == "--units":
+            n_units = int(arg)
+        elif opt == "--vcs":
+            n_vcs = int(arg)
+        elif opt == "--folders":
+            n_folders = int(arg)
+        elif opt in ('-j', "--jobs"):
+            jobs = int(arg)
+        elif opt in ('-k', "--keep"):
+            keep = True
+        elif opt == "--compare":
+            compare = [os.path.abspath(s) for s in arg.split(",")]
+        elif opt in ('-d', "--details"):
+            details = True
+        elif opt == "--report":
+            report_lines = int(arg)
+
+    target = args[0]
+    if report_lines:
+        print "generating a report of " + str(report_lines) + " lines into " + target + "..."
+        files = make_report(target, report_lines)
+        try:
+            ok = bench_filestats(list(files), compare + [FILESTATS])
+        finally:
+            if not keep: shutil.rmtree(target)
+        return 0 if ok else 1
+
+    print "generating " + str(n_units) + " units into " + target + "..."
+    folders = make_tree(target, n_units, n_vcs, n_folders)
+    try:
+        if compare:
+            bench_memory(folders, compare + [UNITSTATS], details)
+            ok = True
+        else:
+            ok = bench_jobs(folders, jobs)
+    finally:
+        if not keep: shutil.rmtree(target)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,460 @@
+#!/usr/bin/python
+
+# This script keeps a dependency graph of the units from their ALI files, and
+# finds the units whose proofs may have changed since a previous run, from the
+# hashes of the sources. CI can then prove only those with "gnatprove -u".
+#
+# (C) 2017 TU Muenchen, RCS, Martin Becker <becker@rcs.ei.tum.de>
+
+import sys, getopt, os, re, json, mmap, time, cPickle
+import gnatprove_unitstats
+
+#######################################
+#     GLOBAL CONSTANTS
+#######################################
+SNAPSHOT_VERSION = 1
+GRAPH_VERSION = 1
+GRAPH_SUFFIX = ".deps.cache" # hidden graph file .<folder><suffix> lives next to the first gnatprove folder
+SOURCE_EXTENSIONS = (".ads", ".adb")
+# ALI scanner. See lib-writ.ads
+ALI_UNIT = re.compile(r"^U [^\s]+\s+([^\s]+)", re.MULTILINE) # source of the unit's spec or body
+ALI_DEP = re.compile(r"^D ([^\s]+)", re.MULTILINE) # source which the unit depends on
+
+#######################################
+#     FUNCTION DEFINITIONS
+#######################################
+
+def parse_ali_deps(buf, filebase):
+    """
+    (own sources, sources it depends on) of the unit of one ALI file. Own
+    sources are those of the U lines, and the spec and body named after the
+    file base. The D lines list all sources the compilation of the unit has
+    read, i.e., including the specs of withed units, and bodies of inlined
+    subprograms and generics. Sources are identified by their file name.
+    """
+    own = set(ALI_UNIT.findall(buf))
+    own.update(filebase + ext for ext in SOURCE_EXTENSIONS)
+    return frozenset(own), frozenset(ALI_DEP.findall(buf))
+
+def read_dependencies(alifile, filebase):
+    """
+    (own sources, sources it depends on) of one ALI file, None if unreadable
+    """
+    try:
+        buf = gnatprove_unitstats.read_ali_file(alifile)
+    except (OSError, IOError) as e:
+        print >> sys.stderr, "WARNING: cannot read " + alifile + ": " + str(e)
+        return None
+    try:
+        return parse_ali_deps(buf, filebase)
+    finally:
+        if isinstance(buf, mmap.mmap): buf.close()
+
+def bits(b):
+    """
+    indices of the set bits of b, ascending
+    """
+    res = []
+    while b:
+        low = b & -b
+        res.append(low.bit_length() - 1)
+        b ^= low
+    return res
+
+def close_subset(succ, closure, nodes):
+    """
+    Recompute closure[v] (bitset of all nodes reachable from v in one or more
+    steps) for all v in nodes, in the graph given by the bitsets succ. The
+    closures of all other nodes must be up to date already.
+
+    Iterative version of Tarjan's algorithm: the strongly connected components
+    come out successors first, and all members of one get the same closure.
+    """
+    index = {}
+    low = {}
+    stack = []
+    onstack = set()
+    counter = 0
+    for root in nodes:
+        if root in index: continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        onstack.add(root)
+        work = [(root, iter(bits(succ[root])))]
+        while work:
+            v, it = work[-1]
+            for w in it:
+                if w not in nodes: continue
+                if w not in index:
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    onstack.add(w)
+                    work.append((w, iter(bits(succ[w]))))
+                    break
+                elif w in onstack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    low[u] = min(low[u], low[v])
+                if low[v] == index[v]:
+                    scc = []
+                    members = 0
+                    while True:
+                        w = stack.pop()
+                        onstack.discard(w)
+                        scc.append(w)
+                        members |= 1 << w
+                        if w == v: break
+                    c = 0
+                    for x in scc:
+                        c |= succ[x]
+                        for w in bits(succ[x] & ~members):
+                            c |= closure[w]
+                    for x in scc:
+                        closure[x] = c
+
+class DepGraph(object):
+    """
+    Persistent dependency graph of the units with an ALI file in the gnatprove
+    folders. A unit depends on another one if it reads one of its sources.
+
+    Units are numbered; edges and their transitive closure are kept as bitsets
+    (Python ints) per unit, forward (what a unit pulls in) and reverse (what
+    depends on it). Thus, a query is a single lookup.
+
+    update() only re-reads ALI files whose size or mtime has changed, and only
+    recomputes the closures which may have changed.
+    """
+    def __init__(self):
+        self.units = [] # index -> file base; None for removed units
+        self.index = {} # file base -> index
+        self.ali = {} # file base -> (ALI file, signature, own sources, used sources)
+        self.owner = {} # source -> file base
+        self.users = {} # source -> set of file bases which read it
+        self.fwd = []
+        self.rev = []
+        self.fwd_closure = []
+        self.rev_closure = []
+
+    @staticmethod
+    def graphfile(folder):
+        parent, name = os.path.split(os.path.abspath(folder))
+        return os.path.join(parent, "." + name + GRAPH_SUFFIX)
+
+    @staticmethod
+    def load(filename):
+        """
+        the graph stored in filename, or an empty one
+        """
+        if os.path.isfile(filename):
+            try:
+                with open(filename, 'rb') as f:
+                    data = cPickle.load(f)
+                if data.get("version") == GRAPH_VERSION:
+                    return data["graph"]
+            except Exception:
+                print >> sys.stderr, "WARNING: ignoring unreadable graph " + filename
+        return DepGraph()
+
+    def save(self, filename):
+        tmpfile = filename + ".tmp"
+        with open(tmpfile, 'wb') as f:
+            cPickle.dump({"version": GRAPH_VERSION, "graph": self}, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfile, filename)
+
+    def _add_unit(self, unit):
+        i = len(self.units)
+        self.units.append(unit)
+        self.index[unit] = i
+        for l in (self.fwd, self.rev, self.fwd_closure, self.rev_closure):
+            l.append(0)
+        return i
+
+    def update(self, folders):
+        """
+        bring the graph up to date with the ALI files in the folders. Returns
+        the units which were added, removed or whose ALI file has changed.
+        """
+        alifiles = gnatprove_unitstats.find_ali_files(folders)
+        dirty = {} # file base -> new (ALI file, signature, own, used), None if removed
+        for unit in self.ali:
+            if unit not in alifiles: dirty[unit] = None
+        for unit, alifile in alifiles.iteritems():
+            try:
+                sig = gnatprove_unitstats.file_signature(alifile)
+            except OSError:
+                continue
+            old = self.ali.get(unit)
+            if old and old[0] == alifile and old[1] == sig: continue
+            deps = read_dependencies(alifile, unit)
+            dirty[unit] = (alifile, sig) + deps if deps else None
+        if not dirty: return []
+
+        # units whose edges change: the dirty ones, and the users of all
+        # sources which have got another owner
+        relink = set(dirty)
+        for unit, new in dirty.iteritems():
+            old = self.ali.pop(unit, None)
+            if old:
+                for src in old[2]:
+                    if self.owner.get(src) == unit:
+                        del self.owner[src]
+                        relink.update(self.users.get(src, ()))
+                for src in old[3]:
+                    self.users[src].discard(unit)
+            if new:
+                self.ali[unit] = new
+                if unit not in self.index: self._add_unit(unit)
+        for unit, new in dirty.iteritems():
+            if not new: continue
+            for src in new[2]:
+                if self.owner.get(src) != unit:
+                    self.owner[src] = unit
+                    relink.update(self.users.get(src, ()))
+            for src in new[3]:
+                self.users.setdefault(src, set()).add(unit)
+
+        # new edges, and the closures which may change: forward closures of all
+        # which reached a changed unit, reverse ones of all it reached or reaches
+        changed = [self.index[u] for u in relink if u in self.index]
+        affected_fwd = set()
+        for i in changed:
+            unit = self.units[i]
+            new_fwd = 0
+            if unit in self.ali:
+                for src in self.ali[unit][3]:
+                    o = self.owner.get(src)
+                    if o is not None and o != unit: new_fwd |= 1 << self.index[o]
+            for j in bits(self.fwd[i] & ~new_fwd):
+                self.rev[j] &= ~(1 << i)
+            for j in bits(new_fwd & ~self.fwd[i]):
+                self.rev[j] |= 1 << i
+            self.fwd[i] = new_fwd
+            affected_fwd.add(i)
+            affected_fwd.update(bits(self.rev_closure[i]))
+        affected_rev = set(changed)
+        for i in changed:
+            affected_rev.update(bits(self.fwd_closure[i]))
+        close_subset(self.fwd, self.fwd_closure, affected_fwd)
+        for i in changed:
+            affected_rev.update(bits(self.fwd_closure[i]))
+        close_subset(self.rev, self.rev_closure, affected_rev)
+
+        for unit, new in dirty.iteritems():
+            if not new:
+                self.units[self.index.pop(unit)] = None
+        return sorted(dirty)
+
+    def lookup(self, unit):
+        """
+        index of a unit, given as file base or as GNAT unit name; None if unknown
+        """
+        return self.index.get(unit.lower().replace(".", "-"))
+
+    def names(self, b):
+        return [self.units[i] for i in bits(b)]
+
+def find_sources(srcdirs):
+    """
+    file name -> list of paths of all Ada sources below the given directories
+    """
+    sources = {}
+    for srcdir in srcdirs:
+        for root, dirs, files in os.walk(srcdir):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "obj"]
+            for fi in files:
+                if fi.endswith(SOURCE_EXTENSIONS):
+                    sources.setdefault(fi, []).append(os.path.join(root, fi))
+    return sources
+
+def hash_sources(sources):
+    """
+    file name -> SHA1 of its contents. If there are several sources with the
+    same name (e.g., for different boards), the hash covers all of them.
+    """
+    hashes = {}
+    for name, paths in sources.iteritems():
+        hashes[name] = ",".join(gnatprove_unitstats.file_hash(p) for p in sorted(paths))
+    return hashes
+
+def changed_sources(old, new):
+    """
+    names of sources which are new, removed or changed
+    """
+    return set(s for s in set(old) | set(new) if old.get(s) != new.get(s))
+
+def reproof_set(graph, changed):
+    """
+    units which own or read one of the changed sources, and all units which
+    depend on those, transitively
+    """
+    hit = 0
+    for src in changed:
+        units = set(graph.users.get(src, ()))
+        if src in graph.owner: units.add(graph.owner[src])
+        for u in units:
+            hit |= 1 << graph.index[u]
+    result = hit
+    for i in bits(hit):
+        result |= graph.rev_closure[i]
+    return graph.names(result)
+
+def load_snapshot(filename):
+    with open(filename) as f:
+        snapshot = json.load(f)
+    if snapshot.get("version") != SNAPSHOT_VERSION:
+        raise ValueError("unknown snapshot version")
+    return snapshot
+
+def save_snapshot(filename, hashes):
+    tmpfile = filename + ".tmp"
+    with open(tmpfile, 'w') as f:
+        json.dump({"version": SNAPSHOT_VERSION, "sources": hashes}, f)
+    os.rename(tmpfile, filename)
+
+def update_graph(graphfile, folders, rebuild=False, verbose=False):
+    """
+    load the graph, bring it up to date with the folders and save it if it
+    has changed
+    """
+    t0 = time.time()
+    graph = DepGraph() if rebuild else DepGraph.load(graphfile)
+    dirty = graph.update(folders)
+    if dirty:
+        try:
+            graph.save(graphfile)
+        except (IOError, OSError) as e:
+            print >> sys.stderr, "WARNING: cannot save graph " + graphfile + ": " + str(e)
+    if verbose:
+        print >> sys.stderr, "graph: %d units, %d updated in %.3f s" % (len(graph.index), len(dirty), time.time() - t0)
+    return graph
+
+def print_usage():
+    print __file__ + " snapshot --src=DIR[,DIR]* --snapshot=FILE"
+    print __file__ + " reproof --src=DIR[,DIR]* --snapshot=FILE [OPTION] (<gnatprove folder>)+"
+    print __file__ + " graph [OPTION] (<gnatprove folder>)+"
+    print __file__ + " deps|rdeps [OPTION] <unit> (<gnatprove folder>)+"
+    print ''
+    print 'snapshot: store the hashes of all Ada sources below the source directories in FILE.'
+    print 'reproof:  print the units (one file base per line, as for "gnatprove -u") whose proofs'
+    print '          may have changed since the snapshot: the units which read a changed source,'
+    print '          and everything that depends on them transitively, according to the ALI files.'
+    print 'graph:    bring the stored dependency graph up to date and print its size.'
+    print 'deps:     print the units which the unit pulls in (transitively).'
+    print 'rdeps:    print the units which depend on the unit (transitively).'
+    print ''
+    print 'The dependency graph is stored next to the first gnatprove folder and only the'
+    print 'ALI files which have changed since are read again. Units can be given as file'
+    print 'base (units-navigation) or as unit name (units.navigation).'
+    print ''
+    print 'OPTIONS:'
+    print '   --src=DIR[,DIR]*'
+    print '          directories with the Ada sources (searched recursively)'
+    print '   --snapshot=FILE'
+    print '          the snapshot to write or to compare against'
+    print '   --update'
+    print '          with reproof: afterwards store the current hashes in the snapshot'
+    print '   --graph=FILE'
+    print '          store the dependency graph in FILE'
+    print '   --rebuild'
+    print '          build the dependency graph from scratch'
+    print '   --direct'
+    print '          with deps/rdeps: only direct dependencies'
+    print '   --verbose, -v'
+    print '          also print the changed sources and graph updates (to stderr)'
+
+def main(argv):
+    if not argv or argv[0] not in ("snapshot", "reproof", "graph", "deps", "rdeps"):
+        print_usage();
+        sys.exit(2)
+    command = argv[0]
+    srcdirs = []
+    snapfile = None
+    graphfile = None
+    update = False
+    rebuild = False
+    direct = False
+    verbose = False
+
+    try:
+        opts, args = getopt.getopt(argv[1:], "hv", ["help","src=","snapshot=","update","graph=","rebuild","direct","verbose"])
+    except getopt.GetoptError:
+        print_usage();
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage()
+            sys.exit()
+        elif opt == "--src":
+            srcdirs.extend(d.strip() for d in arg.split(","))
+        elif opt == "--snapshot":
+            snapfile = arg
+        elif opt == "--update":
+            update = True
+        elif opt == "--graph":
+            graphfile = arg
+        elif opt == "--rebuild":
+            rebuild = True
+        elif opt == "--direct":
+            direct = True
+        elif opt in ('-v', "--verbose"):
+            verbose = True
+
+    if command in ("deps", "rdeps"):
+        if len(args) < 2:
+            print_usage();
+            sys.exit(2)
+        unit = args.pop(0)
+    if command in ("snapshot", "reproof") and (not srcdirs or not snapfile) or command != "snapshot" and not args:
+        print_usage();
+        sys.exit(2)
+    if args and not graphfile:
+        graphfile = DepGraph.graphfile(args[0])
+
+    if command in ("graph", "deps", "rdeps"):
+        graph = update_graph(graphfile, args, rebuild, verbose)
+        if command == "graph":
+            print "units: %d, edges: %d" % (len(graph.index), sum(bin(b).count("1") for b in graph.fwd))
+            return 0
+        i = graph.lookup(unit)
+        if i is None:
+            print >> sys.stderr, "ERROR: unknown unit " + unit
+            return 1
+        if command == "deps":
+            b = graph.fwd[i] if direct else graph.fwd_closure[i]
+        else:
+            b = graph.rev[i] if direct else graph.rev_closure[i]
+        for u in sorted(graph.names(b & ~(1 << i))):
+            print u
+        return 0
+
+    hashes = hash_sources(find_sources(srcdirs))
+    if command == "snapshot":
+        save_snapshot(snapfile, hashes)
+        return 0
+
+    try:
+        old = load_snapshot(snapfile)["sources"]
+    except (IOError, OSError, ValueError) as e:
+        print >> sys.stderr, "ERROR: cannot read snapshot " + snapfile + ": " + str(e)
+        return 1
+    changed = changed_sources(old, hashes)
+    if verbose:
+        for src in sorted(changed):
+            print >> sys.stderr, "changed: " + src
+    graph = update_graph(graphfile, args, rebuild, verbose)
+    for unit in sorted(reproof_set(graph, changed)):
+        print unit
+    if update:
+        save_snapshot(snapfile, hashes)
+    return 0
+
+if __name__ == "__main__":
+    # pickles of the graph must refer to the module, not to __main__
+    import gnatprove_deps
+    sys.exit(gnatprove_deps.main(sys.argv[1:]))
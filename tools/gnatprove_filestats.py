@@ -6,19 +6,32 @@
 # (C) 2016-2017 TU Muenchen, RCS, Martin Becker <becker@rcs.ei.tum.de>
 
 import sys, getopt, os, inspect, time, math, re, datetime, numpy;
-import pprint;
+import pprint, mmap, multiprocessing, errno;
 
 # use this if you want to include modules from a subfolder
 cmd_subfolder = os.path.realpath(os.path.abspath(os.path.join(os.path.split(inspect.getfile( inspect.currentframe() ))[0],"pytexttable")))
 if cmd_subfolder not in sys.path:
     sys.path.insert(0, cmd_subfolder)
 import texttable
+import gnatprove_unitstats # for reading compressed and archived files
 
 #######################################
 #     GLOBAL CONSTANTS
 #######################################
 
 KNOWN_SORT_CRITERIA = ('alpha', 'coverage', 'success', 'props', 'subs', 'skip');
+# line patterns of the report (gnatprove.out) and of the stdout of gnatprove
+REPORT_UNIT = re.compile(r'^in unit ([^\s:,]+)')
+REPORT_LOCATION = re.compile(r'^.*\s+([^\s:]+) at ([^\s:]+):(\d+)') # the last one in the line
+REPORT_LOCATION_ONCE = re.compile(r'\s([^\s:]+) at ([^\s:]+):(\d+)') # same, if " at " occurs only once
+REPORT_RESULT = re.compile(r' (\d+) checks out of (\d+) proved$| and proved \((\d+) checks\)$')
+STDOUT_LOCATION = re.compile(r'^([^\s:]+):(\d+):(\d+)')
+PARALLEL_MIN_SIZE = 1 << 24 # bytes; smaller files are always parsed serially
+CHUNKS_PER_JOB = 4
+REPORT_MEMBER = "gnatprove.out" # read from an archived gnatprove folder
+BUILDLOG_MEMBER = "analysis.log"
+FOLLOW_INTERVAL = 5 # seconds between polls of a followed log
+FOLLOW_WINDOW = 10 # minutes of the rolling rate
 
 #######################################
 #     FUNCTION DEFINITIONS
@@ -33,136 +46,414 @@ def file2unit(filename):
     return unitname.lower()
 
 
-def get_stdout_stats(inputfile):
+class StdoutParser(object):
     """
-    parse output of stdout from gnatprove
+    State machine over the lines of the stdout of gnatprove (build log). The
+    state is the current unit, which is switched by every message with a
+    source location. Messages count as proof: info counts as proven, low,
+    medium and high as unproven.
+
     XXX! output comes twice. First for flow analysis, then again for proof.
-    this parser keeps the lastest outputs, i.e., overwriting flow information.
-    """
-    if os.stat(inputfile).st_size == 0: return None
+    A unit which comes again starts over, i.e., the latest output overwrites
+    the flow information.
 
-    unit = ""
-    unit_pre = ""
-    units = {}
-    if True: #try:
-      with open(inputfile, 'r+') as f:
-        l = 0
-        for line in f:
-            l = l + 1
-                        
-            # new unit?
-            match = re.search(r'^([^\s:]+):(\d+):(\d+).*', line, re.MULTILINE)
-            if match:
+    Besides the units, the parser keeps the blocks: (unit, unitinfo) for each
+    run of lines of the same unit, in order (see merge_chunks).
+    """
+    FIELDS = ("props", "proven") # of unitinfo, in order of insertion
+
+    def __init__(self):
+        self.units = {}
+        self.blocks = []
+        self.unit = ""
+        self.unitinfo = None
+        self.subname = "" # unused
+        self.first_sub = None # unused
+
+    @staticmethod
+    def is_boundary(line):
+        """
+        whether a chunk can start at this line
+        """
+        return STDOUT_LOCATION.match(line) is not None
+
+    def feed(self, lines):
+        units = self.units
+        blocks = self.blocks
+        unit = self.unit
+        unitinfo = self.unitinfo
+        filename = None
+        location = STDOUT_LOCATION.match
+        for line in lines:
+            # every pattern needs a colon
+            if not ":" in line: continue
+            match = location(line)
+            if match and match.group(1) != filename:
                 filename = match.group(1)
-                srcline = match.group(2)
-                srccol = match.group(3)
-
-                unit = file2unit(filename)
-                if unit != unit_pre:
-                    unit_pre = unit
+                u = file2unit(filename)
+                if u != unit:
+                    unit = u
                     unitinfo = {"props":0, "proven":0}
-                    if unit: units[unit]=unitinfo
-
-            match = re.search(r'^.*: (medium|high|low): (.*)$', line, re.MULTILINE)
-            if match:                
+                    if unit:
+                        units[unit] = unitinfo
+                        blocks.append((unit, unitinfo))
+            if unitinfo is None: continue # nothing before the first location
+            if ": medium: " in line or ": high: " in line or ": low: " in line:
                 unitinfo["props"] = unitinfo["props"] + 1
-
-            match = re.search(r'^.*: info: .*$', line, re.MULTILINE)
-            if match:
+            if ": info: " in line:
                 unitinfo["props"] = unitinfo["props"] + 1
                 unitinfo["proven"] = unitinfo["proven"] + 1
-                                
-        if unit: units[unit]=unitinfo
-        return units
-    else: #except:
-        print "ERROR reading file " + inputfile
-        return None
-
-def get_report_stats(inputfile):
-    """
-    parse the report from gnatprove
+        self.unit = unit
+        self.unitinfo = unitinfo
+
+class ReportParser(object):
     """
-    if os.stat(inputfile).st_size == 0: return None
+    State machine over the lines of the report (gnatprove.out). The state is
+    the current unit, switched by the "in unit" lines, and the last subprogram.
+    Each other line is classified once by cheap substring tests, and only then
+    matched by the compiled pattern of its class. One line can name a
+    subprogram and carry its result at the same time:
 
-    unit_pre = ""
-    subname_pre =""
+    Estimator.check_stable_Time at estimator.ads:65 flow analyzed (0 errors and 0 warnings) and not proved, 15 checks out of 16 proved
+    Estimator.get_Baro_Height at estimator.ads:52 flow analyzed (0 errors and 0 warnings) and proved (0 checks)
 
-    units = {}
-    if True: #try:
-      with open(inputfile, 'r+') as f:
-        l = 0
-        for line in f:
-            l = l + 1
-            # new unit?
-            match = re.search(r'^in unit ([^\s:,]+)', line, re.MULTILINE)
-            if match:
-                unit = match.group(1).lower()
-                if unit != unit_pre:
-                    unit_pre = unit
-                    unitinfo = {"subs":0, "props":0, "proven":0, "skip":0}
-                    if unit: units[unit]=unitinfo
-            else:
-                proc = False
+    A unit which comes again (but not directly) starts over.
+    BULLOCKS: some properties are not listed in the log. Seems like the flow properties are missing
 
-                # location
-                match = re.search(r'^.*\s+([^\s:]+) at ([^\s:]+):(\d+)', line, re.MULTILINE)
+    Besides the units, the parser keeps the blocks as StdoutParser does, and
+    the first subprogram: (index of its block, its name).
+    """
+    FIELDS = ("subs", "props", "proven", "skip") # of unitinfo, in order of insertion
+
+    def __init__(self):
+        self.units = {}
+        self.blocks = []
+        self.unit = ""
+        self.unitinfo = None
+        self.subname = ""
+        self.first_sub = None
+
+    @staticmethod
+    def is_boundary(line):
+        """
+        whether a chunk can start at this line
+        """
+        return line.startswith("in unit ") and REPORT_UNIT.match(line) is not None
+
+    def feed(self, lines):
+        units = self.units
+        blocks = self.blocks
+        unit = self.unit
+        unitinfo = self.unitinfo
+        subname_pre = self.subname
+        first_sub = self.first_sub
+        unit_match = REPORT_UNIT.match
+        location = REPORT_LOCATION.match
+        location_once = REPORT_LOCATION_ONCE.search
+        result = REPORT_RESULT.search
+        for line in lines:
+            # new unit?
+            if line.startswith("in unit "):
+                match = unit_match(line)
                 if match:
-                    proc = True
-                    funcname = match.group(1)
-                    filename = match.group(2)
-                    srcline = match.group(3)
-                    subname = filename + ":" + funcname + ":" + srcline
+                    u = match.group(1).lower()
+                    if u != unit:
+                        unit = u
+                        unitinfo = {"subs":0, "props":0, "proven":0, "skip":0}
+                        units[unit] = unitinfo
+                        blocks.append((unit, unitinfo))
+                    continue
+            if unitinfo is None: continue # nothing before the first unit
+
+            # location. Searching from the left is much cheaper than backtracking
+            # from the right, and gives the same if there is only one candidate.
+            pos = 0
+            if " at " in line:
+                match = location_once(line) if line.count(" at ") == 1 else location(line)
+                if match:
+                    pos = match.end() # the result cannot start before
+                    subname = match.group(2) + ":" + match.group(1) + ":" + match.group(3)
+                    if first_sub is None: first_sub = (len(blocks) - 1, subname)
                     if subname != subname_pre:
                         subname_pre = subname
                         unitinfo["subs"] = unitinfo["subs"] + 1
 
-                
-                # some are proven         
-                match = re.search(r'^.* (\d+) checks out of (\d+) proved$', line, re.MULTILINE)
+            # some or all are proven
+            if "proved" in line:
+                match = result(line, pos)
                 if match:
-                    proc = True
-                    pgood = match.group(1)
-                    ptotal = match.group(2)
-                    try:
-                        succ = int(float(pgood) / float(ptotal) * 100)
-                    except:
-                        succ = 0.0
-                    #print "  " + funcname + ":" + srcline + " => " + pgood + " of " + ptotal + " proved (" + str(succ) + "%)"
+                    pgood, ptotal, pall = match.groups()
+                    if pall is not None: pgood = ptotal = pall
                     unitinfo["props"] = unitinfo["props"] + int(ptotal)
                     unitinfo["proven"] = unitinfo["proven"] + int(pgood)
 
-                # all are proven
-                match = re.search(r'^.* and proved \((\d+) checks\)$', line, re.MULTILINE)
-                if match:
-                    proc = True
-                    pgood = match.group(1)
-                    ptotal = pgood
-                    succ = 100
-                    unitinfo["props"] = unitinfo["props"] + int(ptotal)
-                    unitinfo["proven"] = unitinfo["proven"] + int(pgood)
-                    #print "  " + funcname + ":" + srcline + " => " + ptotal + " of " + ptotal + " proved (" + str(succ) + "%)"
+            # sub skipped
+            if " skipped" in line:
+                unitinfo["skip"] = unitinfo["skip"] + 1
+        self.unit = unit
+        self.unitinfo = unitinfo
+        self.subname = subname_pre
+        self.first_sub = first_sub
 
-                # sub skipped
-                match = re.search(r'^.* skipped', line, re.MULTILINE)
-                if match:
-                    proc = True
-                    #print "  " + funcname + ":" + srcline + " => SKIPPED"
-                    unitinfo["skip"] = unitinfo["skip"] + 1
+def split_chunks(buf, n_chunks, is_boundary):
+    """
+    (start, end) offsets of about n_chunks chunks of the memory-mapped file
+    buf. Each chunk but the first starts at a line where is_boundary holds.
+    """
+    size = len(buf)
+    starts = [0]
+    for k in range(1, n_chunks):
+        pos = max(k * size / n_chunks, starts[-1])
+        while pos < size:
+            pos = buf.find("\n", pos)
+            if pos < 0:
+                pos = size
+                break
+            pos += 1
+            eol = buf.find("\n", pos)
+            if is_boundary(buf[pos:eol if eol >= 0 else size]): break
+        if pos >= size: break
+        if pos > starts[-1]: starts.append(pos)
+    return zip(starts, starts[1:] + [size])
+
+def parse_chunk(task):
+    """
+    Worker: parse the lines between two offsets of a file with a fresh
+    parser. Returns its blocks with the counters as tuples (in the order of
+    FIELDS), its first and its last subprogram.
+    """
+    inputfile, start, end, parser_class = task
+    with open(inputfile, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            lines = buf[start:end].split("\n")
+        finally:
+            buf.close()
+    parser = parser_class()
+    parser.feed(lines)
+    blocks = [(u, tuple(info[k] for k in parser.FIELDS)) for u, info in parser.blocks]
+    return blocks, parser.first_sub, parser.subname
+
+def merge_chunks(results, fields):
+    """
+    Join the results of parse_chunk, in the order of the chunks, into the
+    units of a serial parse. A chunk which begins with the unit the previous
+    one ended with continues its last block. A subprogram was counted again
+    if it was the same as the last one of the previous chunks.
+    """
+    blocks = []
+    subname = ""
+    for chunk, first_sub, last_sub in results:
+        chunk = [(u, list(counts)) for u, counts in chunk]
+        if first_sub is not None and first_sub[1] == subname:
+            chunk[first_sub[0]][1][fields.index("subs")] -= 1
+        if chunk and blocks and chunk[0][0] == blocks[-1][0]:
+            u, counts = chunk.pop(0)
+            blocks[-1] = (u, [a + b for a, b in zip(blocks[-1][1], counts)])
+        blocks.extend(chunk)
+        if last_sub: subname = last_sub
+    # the last block of a unit counts, but units stay in order of their first
+    units = {}
+    for u, counts in blocks:
+        units[u] = dict(zip(fields, counts))
+    return units
+
+def is_stream(inputfile):
+    """
+    whether the file is compressed or in an archive, and can only be read as a stream
+    """
+    return gnatprove_unitstats.archive_member(inputfile) or gnatprove_unitstats.decompressor(inputfile) is not None
 
-                if not proc:
-                    #print "Unrecognized line " + str(l) + ": " + line
-                    pass
+def parse_file(inputfile, parser_class, jobs=1, min_size=PARALLEL_MIN_SIZE):
+    """
+    units of a file, parsed by parser_class. With jobs > 1, large files are
+    memory-mapped, split into chunks and parsed in a process pool; the result
+    is the same as that of a serial parse. Compressed files and members of
+    archives are parsed serially, as they are decompressed.
+    """
+    if is_stream(inputfile):
+        parser = parser_class()
+        with gnatprove_unitstats.open_file(inputfile) as f:
+            parser.feed(f)
+        return parser.units
+    if jobs <= 1 or os.stat(inputfile).st_size < min_size:
+        parser = parser_class()
+        with open(inputfile, 'r') as f:
+            parser.feed(f)
+        return parser.units
+    with open(inputfile, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            chunks = split_chunks(buf, jobs * CHUNKS_PER_JOB, parser_class.is_boundary)
+        finally:
+            buf.close()
+    pool = multiprocessing.Pool(min(jobs, len(chunks)))
+    try:
+        results = pool.map(parse_chunk, [(inputfile, start, end, parser_class) for start, end in chunks])
+    finally:
+        pool.close()
+        pool.join()
+    return merge_chunks(results, parser_class.FIELDS)
 
-                # BULLOCKS: some properties are not listed in the log. Seems like the flow properties are missing
+def get_stdout_stats(inputfile, jobs=1):
+    """
+    parse output of stdout from gnatprove, see StdoutParser
+    """
+    if not is_stream(inputfile) and os.stat(inputfile).st_size == 0: return None
+    return parse_file(inputfile, StdoutParser, jobs)
 
-                #Estimator.check_stable_Time at estimator.ads:65 flow analyzed (0 errors and 0 warnings) and not proved, 15 checks out of 16 proved
-                #Estimator.get_Baro_Height at estimator.ads:52 flow analyzed (0 errors and 0 warnings) and proved (0 checks)
+def get_report_stats(inputfile, jobs=1):
+    """
+    parse the report from gnatprove, see ReportParser
+    """
+    if not is_stream(inputfile) and os.stat(inputfile).st_size == 0: return None
+    return parse_file(inputfile, ReportParser, jobs)
 
-        if unit: units[unit]=unitinfo
-        return units
-    else: #except:
-        print "ERROR reading file " + inputfile
-        return None
+class LogFollower(object):
+    """
+    Tails a growing build log (the stdout of a running gnatprove), with the
+    rules of get_stdout_stats. Each poll parses the complete lines written
+    since the byte offset it has read up to. A unit is done when the log
+    switches to another one; the rate of done units over the last minutes
+    and the list of expected units (_units of prove_all.sh) give the ETA.
+    A log which is replaced or truncated (a new run) starts over.
+    """
+
+    def __init__(self, logfile, expected=None, window=FOLLOW_WINDOW):
+        self.logfile = logfile
+        self.expected = expected
+        self.window = window * 60.0
+        self.reset(None)
+
+    def reset(self, inode):
+        self.inode = inode
+        self.offset = 0
+        self.parser = StdoutParser()
+        self.start = None
+        self.finished = {} # unit -> time when the log switched away from it
+
+    def poll(self, now=None):
+        """
+        parse what was written since the last poll. Returns the units which
+        have been updated, in order, or None if the log does not exist (yet).
+        """
+        if now is None: now = time.time()
+        try:
+            st = os.stat(self.logfile)
+        except OSError as e:
+            if e.errno != errno.ENOENT: raise
+            return None
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            self.reset(st.st_ino)
+        if st.st_size == self.offset: return []
+        with open(self.logfile, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(st.st_size - self.offset)
+        end = data.rfind("\n") + 1 # an incomplete line is read again next time
+        if end == 0: return []
+        self.offset += end
+        if self.start is None: self.start = now
+
+        parser = self.parser
+        n = len(parser.blocks)
+        unit = parser.unit
+        last = dict(parser.unitinfo) if parser.unitinfo else None
+        parser.feed(data[:end].split("\n"))
+        updated = [u for u, _ in parser.blocks[n:]]
+        if last is not None and parser.blocks[n - 1][1] != last:
+            updated.insert(0, unit)
+        for u in [unit] + updated[:-1]:
+            if u and u != parser.unit and u not in self.finished:
+                self.finished[u] = now
+        return updated
+
+    def progress(self, now=None):
+        """
+        totals over the units so far, the rate of units per minute and the
+        estimated time until all expected units are done
+        """
+        if now is None: now = time.time()
+        units = self.parser.units
+        done = [u for u in self.finished if not self.expected or u in self.expected]
+        props = sum([v["props"] for v in units.itervalues()])
+        proven = sum([v["proven"] for v in units.itervalues()])
+        prog = {"units" : len(done), "props" : props, "proven" : proven,
+                "success" : (100*float(proven) / props) if props > 0 else 0,
+                "current" : self.parser.unit or None, "rate" : None, "eta" : None}
+        if self.expected:
+            prog["expected"] = len(self.expected)
+            prog["done"] = 100*float(len(done)) / len(self.expected)
+        if self.start is not None:
+            since = max(now - self.window, self.start)
+            recent = len([u for u in done if self.finished[u] > since])
+            if now > since and recent > 0:
+                prog["rate"] = 60.0 * recent / (now - since)
+                if self.expected:
+                    remaining = max(len(self.expected) - len(done), 0)
+                    prog["eta"] = str(datetime.timedelta(seconds=int(60 * remaining / prog["rate"])))
+        return prog
+
+def read_units(unitsfile):
+    """
+    unit names of a unit list as written by get_project_units in prove_all.sh
+    """
+    with open(unitsfile, 'r') as f:
+        return set(file2unit(l.strip()) for l in f if l.strip())
+
+def print_progress(prog, table):
+    if not table:
+        print "PROGRESS: " + str(prog)
+        return
+    line = time.strftime("%H:%M:%S") + " units " + str(prog["units"])
+    if "expected" in prog:
+        line += "/" + str(prog["expected"]) + " ({:.1f}%)".format(prog["done"])
+    line += ", proven {}/{} ({:.1f}%)".format(prog["proven"], prog["props"], prog["success"])
+    if prog["rate"] is not None:
+        line += ", {:.2f} units/min".format(prog["rate"])
+    if prog["eta"] is not None:
+        line += ", ETA " + prog["eta"]
+    if prog["current"]:
+        line += ", at " + prog["current"]
+    print line
+
+def follow_log(logfile, unitsfile, interval, window, exclude, table):
+    """
+    follow a build log until interrupted, printing the units as they are
+    updated, and the progress
+    """
+    expected = None
+    if unitsfile is None:
+        unitsfile = os.path.join(os.path.dirname(logfile), "_units")
+        if not os.path.exists(unitsfile): unitsfile = None
+    if unitsfile:
+        expected = read_units(unitsfile)
+        print "units file: " + unitsfile + " (" + str(len(expected)) + " units)"
+    else:
+        print "units file: none, no ETA"
+    print "following: " + logfile
+    follower = LogFollower(logfile, expected=expected, window=window)
+    waiting = False
+    try:
+        while True:
+            updated = follower.poll()
+            if updated is None and not waiting:
+                print "waiting for " + logfile
+            waiting = updated is None
+            if updated:
+                for u in updated:
+                    if any(substring in u for substring in exclude): continue
+                    uinfo = follower.parser.units[u]
+                    if not table:
+                        print u + " : " + str(uinfo)
+                    else:
+                        print "  {}: {}/{}".format(u, uinfo["proven"], uinfo["props"])
+                print_progress(follower.progress(), table)
+                sys.stdout.flush()
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    print_progress(follower.progress(), table)
+    return 0
 
 def get_totals(reportunits, buildunits, sorting, exclude):
     if not reportunits: return None
@@ -296,6 +587,30 @@ def print_usage():
     print '          print as human-readable table instead of JSON/dict'
     print '   --exclude=s[,s]*'
     print '          exclude units which contain any of the given strings'
+    print '   --jobs=N, -j N'
+    print '          parse large files in chunks with N processes (default: number of cores)'
+    print ''
+    print '   Both files can be compressed (' + ",".join(gnatprove_unitstats.COMPRESSED_SUFFIXES) + '), and instead of a file,'
+    print '   a tar archive of the gnatprove folder can be given (' + ",".join(gnatprove_unitstats.ARCHIVE_SUFFIXES) + '),'
+    print '   from which ' + REPORT_MEMBER + ' or ' + BUILDLOG_MEMBER + ' is read as a stream.'
+    print ''
+    print __file__ + " [OPTION] --follow <build.log>"
+    print ''
+    print '   follow the build log of a running gnatprove until interrupted, and print'
+    print '   the units as they are updated, the rate of units per minute and an ETA.'
+    print '   A unit is done when the log switches to the next one. When the entire'
+    print '   project is proven at once, the flow output comes first and runs ahead.'
+    print ''
+    print 'OPTIONS:'
+    print '   --units=FILE'
+    print '          list of the expected units (default: _units next to the log,'
+    print '          as written by prove_all.sh)'
+    print '   --interval=SEC'
+    print '          seconds between polls of the log (default: ' + str(FOLLOW_INTERVAL) + ')'
+    print '   --window=MIN'
+    print '          minutes over which the rate is taken (default: ' + str(FOLLOW_WINDOW) + ')'
+    print '   --table, -t / --exclude=s[,s]*'
+    print '          as above'
 
 def main(argv):
     inputfile = None
@@ -303,9 +618,15 @@ def main(argv):
     sorting = []
     exclude = []
     table = False
+    jobs = 0
+    followfile = None
+    unitsfile = None
+    interval = FOLLOW_INTERVAL
+    window = FOLLOW_WINDOW
 
     try:
-        opts, args = getopt.getopt(argv, "hs:te:", ["help","sort=","table","exclude="])
+        opts, args = getopt.getopt(argv, "hs:te:j:f:", ["help","sort=","table","exclude=","jobs=",
+                                                      "follow=","units=","interval=","window="])
     except getopt.GetoptError:
         print_usage();
         sys.exit(2)
@@ -336,7 +657,38 @@ def main(argv):
                 
         elif opt in ('-t', '--table'):
             table = True
+
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                print "Number of jobs '" + arg + "' invalid"
+
+        elif opt in ('-f', '--follow'):
+            followfile = arg
+
+        elif opt == '--units':
+            unitsfile = arg
+
+        elif opt in ('--interval', '--window'):
+            try:
+                value = float(arg)
+            except ValueError:
+                print "Value '" + arg + "' of " + opt + " invalid"
+                sys.exit(2)
+            if opt == '--interval':
+                interval = value
+            else:
+                window = value
+
+    if followfile:
+        if is_stream(followfile):
+            print "ERROR: cannot follow a compressed or archived file"
+            return 1
+        return follow_log(followfile, unitsfile, interval, window, exclude, table)
             
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
     if not sorting:
         sorting = KNOWN_SORT_CRITERIA
     print "sorting: " + ",".join(sorting)
@@ -346,15 +698,19 @@ def main(argv):
                     
     inputfile = args[0]
     if len(args) > 1: buildlogfile = args[1]
+    if gnatprove_unitstats.is_archive(inputfile):
+        inputfile = os.path.join(inputfile, REPORT_MEMBER)
+    if buildlogfile and gnatprove_unitstats.is_archive(buildlogfile):
+        buildlogfile = os.path.join(buildlogfile, BUILDLOG_MEMBER)
 
     print "report file: " + inputfile                
-    reportunits = get_report_stats(inputfile=inputfile)
+    reportunits = get_report_stats(inputfile=inputfile, jobs=jobs)
     if not reportunits: return 1
     #pprint.pprint (reportunits)
 
     if buildlogfile:
         print "build log file: " + buildlogfile
-        buildunits = get_stdout_stats(inputfile=buildlogfile)
+        buildunits = get_stdout_stats(inputfile=buildlogfile, jobs=jobs)
         if not buildunits: return 1
         #pprint.pprint (buildunits)
     else:
@@ -0,0 +1,180 @@
+#!/usr/bin/python
+
+# This script distributes the units of a project over K batches, such that
+# proving the batches in parallel (e.g., "gnatprove -u" on K machines or cores)
+# takes about the same time for each batch. The cost of each unit is taken
+# from a previous run: either from the prover times in the *.spark files, or
+# from the "/usr/bin/time -v" output in analysis.log of prove_all.sh.
+#
+# (C) 2017 TU Muenchen, RCS, Martin Becker <becker@rcs.ei.tum.de>
+
+import sys, getopt, os, json, heapq, multiprocessing
+import gnatprove_unitstats
+
+#######################################
+#     FUNCTION DEFINITIONS
+#######################################
+
+def unit2file(unit):
+    """
+    GNAT unit name to file base, as used by "gnatprove -u"
+    """
+    return unit.replace(".", "-")
+
+def read_time_log(logfile):
+    """
+    wall time of each "gnatprove -u <unit>" from the "/usr/bin/time -v" output
+    in the given log (INDIVIDUAL mode of prove_all.sh). Returns {file base: secs};
+    if a unit was proven several times, the last time counts. See
+    gnatprove_unitstats.parse_time_log.
+    """
+    units, blocks = gnatprove_unitstats.parse_time_log(logfile)
+    return dict((unit2file(u), b["wall_s"]) for u, b in units.iteritems() if b["wall_s"] is not None)
+
+def read_spark_costs(folders, jobs, use_cache=True):
+    """
+    summed up time of all proof attempts of each unit. Returns {file base: secs}
+    """
+    cache = gnatprove_unitstats.UnitCache(folders) if use_cache else None
+    units = gnatprove_unitstats.get_unit_data(folders, details=False, jobs=jobs, cache=cache,
+                                              extras=frozenset(["vcs"]))
+    costs = {}
+    for u, s in units.iteritems():
+        costs[unit2file(u)] = sum(a[2] for vc in s.vcs for a in gnatprove_unitstats.iter_attempts(vc[6]))
+    return costs
+
+def lpt_schedule(costs, k):
+    """
+    longest processing time first: take the units by decreasing cost, and
+    give each to the batch with the smallest total so far. Returns a list of
+    k (total cost, [units]); the makespan is at most 4/3 of the optimum.
+    """
+    batches = [[] for _ in range(k)]
+    heap = [(0.0, b) for b in range(k)]
+    for unit in sorted(costs, key=lambda u: (-costs[u], u)):
+        load, b = heapq.heappop(heap)
+        batches[b].append(unit)
+        heapq.heappush(heap, (load + costs[unit], b))
+    loads = dict((b, load) for load, b in heap)
+    return [(loads[b], batches[b]) for b in range(k)]
+
+def naive_makespan(costs, k):
+    """
+    makespan if the units are proven in alphabetical order (like the INDIVIDUAL
+    mode of prove_all.sh) on k workers, each taking the next unit when it is done
+    """
+    heap = [0.0] * k
+    for unit in sorted(costs):
+        heapq.heapreplace(heap, heap[0] + costs[unit])
+    return max(heap)
+
+def print_usage():
+    print __file__ + " [OPTION] (<gnatprove folder>)*"
+    print ''
+    print 'Distributes the units over K batches with balanced proof time, based on a previous run.'
+    print ''
+    print 'OPTIONS:'
+    print '   --batches=K, -k K'
+    print '          number of batches (default: number of cores)'
+    print '   --log=FILE'
+    print '          take the cost of units from the "/usr/bin/time -v" output in FILE (e.g., analysis.log'
+    print '          of prove_all.sh in INDIVIDUAL mode). Units not in FILE are taken from the *.spark files.'
+    print '   --units-file=FILE'
+    print '          schedule the units in FILE, one per line (e.g., the _units file of prove_all.sh).'
+    print '          Units without a known cost get the average cost. Default: all units with a cost.'
+    print '   --write=PREFIX'
+    print '          write the units of batch i to the file PREFIX<i>, one per line'
+    print '   --table, -t'
+    print '          print as human-readable text instead of JSON'
+    print '   --jobs=N, -j N'
+    print '          parse the *.spark files with N processes (default: number of cores)'
+    print '   --no-cache'
+    print '          neither read nor write the cache of gnatprove_unitstats.py'
+
+def main(argv):
+    k = multiprocessing.cpu_count()
+    logfile = None
+    unitsfile = None
+    prefix = None
+    table = False
+    jobs = 0
+    use_cache = True
+
+    try:
+        opts, args = getopt.getopt(argv, "hk:tj:", ["help","batches=","log=","units-file=","write=","table","jobs=","no-cache"])
+    except getopt.GetoptError:
+        print_usage();
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage()
+            sys.exit()
+        elif opt in ('-k', "--batches"):
+            k = int(arg)
+        elif opt == "--log":
+            logfile = arg
+        elif opt == "--units-file":
+            unitsfile = arg
+        elif opt == "--write":
+            prefix = arg
+        elif opt in ('-t', "--table"):
+            table = True
+        elif opt in ('-j', "--jobs"):
+            jobs = int(arg)
+        elif opt == "--no-cache":
+            use_cache = False
+
+    if not args and not logfile:
+        print_usage();
+        sys.exit(2)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    if k < 1:
+        print "ERROR: need at least one batch"
+        return 1
+
+    costs = read_spark_costs(args, jobs, use_cache) if args else {}
+    if logfile:
+        costs.update(read_time_log(logfile))
+    if unitsfile:
+        with open(unitsfile) as f:
+            wanted = [l.strip() for l in f if l.strip()]
+        known = [costs[u] for u in wanted if u in costs]
+        default = sum(known) / len(known) if known else 0.0
+        unknown = [u for u in wanted if u not in costs]
+        if unknown:
+            print "WARNING: no cost known for " + str(len(unknown)) + " units, assuming " + "%.1f" % default + " s each"
+        costs = dict((u, costs.get(u, default)) for u in wanted)
+    if not costs:
+        print "ERROR: no units found"
+        return 1
+
+    batches = lpt_schedule(costs, k)
+    total = sum(costs.itervalues())
+    result = {"batches": [{"cost": load, "units": units} for load, units in batches],
+              "makespan": max(load for load, units in batches),
+              "naive_makespan": naive_makespan(costs, k),
+              "lower_bound": max(total / k, max(costs.itervalues())),
+              "total": total}
+
+    if prefix:
+        for i, (load, units) in enumerate(batches):
+            with open(prefix + str(i), 'w') as f:
+                for u in units:
+                    f.write(u + "\n")
+    if table:
+        for i, (load, units) in enumerate(batches):
+            print "batch %d (%d units, %.1f s): %s" % (i, len(units), load, " ".join(units))
+        print ""
+        print "units:              %d" % len(costs)
+        print "total cost:         %.1f s" % total
+        print "makespan (LPT):     %.1f s" % result["makespan"]
+        print "makespan (naive):   %.1f s (alphabetical order)" % result["naive_makespan"]
+        print "lower bound:        %.1f s" % result["lower_bound"]
+    else:
+        print json.dumps(result)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
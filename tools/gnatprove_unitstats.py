@@ -6,444 +6,2729 @@
 # (C) 2017 TU Muenchen, RCS, Martin Becker <becker@rcs.ei.tum.de>
 
 import sys, getopt, os, inspect, time, math, re, datetime, numpy, glob, pprint
-import json, operator, subprocess, copy
+import json, operator, subprocess, copy, multiprocessing, itertools, hashlib, cPickle, mmap, collections, heapq
+import sqlite3, gzip, bz2, tarfile
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None # no *.xz then
+
+# use this if you want to include modules from a subfolder
+cmd_subfolder = os.path.realpath(os.path.abspath(os.path.join(os.path.split(inspect.getfile( inspect.currentframe() ))[0],"pytexttable")))
+if cmd_subfolder not in sys.path:
+    sys.path.insert(0, cmd_subfolder)
+import texttable
+
+#######################################
+#     GLOBAL CONSTANTS
+#######################################
+GNATINSPECT="gnatinspect"
+KNOWN_SORT_CRITERIA = ('alpha', 'coverage', 'success', 'props', 'ents', 'skip');
+CACHE_SUFFIX = ".unitstats.cache" # hidden cache file .<folder><suffix> lives next to the gnatprove folder
+CACHE_VERSION = 7 # bump whenever the unit summary changes
+WORST_FIRST = {'coverage': 1, 'success': 1, 'props': -1, 'ents': -1, 'skip': -1, 'wall_s': -1, 'max_rss_mb': -1} # sign, such that smaller is worse
+TOTAL_COUNTERS = ("ents", "props", "suppressed", "proven", "spec", "skip", "flows", "flows_proven", "flows_suppressed")
+RAW_ONLY_FIELDS = ("cntexmp", "tracefile", "msg_id", "entity") # of proof/flow entries; never used
+DETAILS_PROOF_KEYS = frozenset(('file','line','col','rule','severity','how_proved','check_tree'))
+DETAILS_FLOW_KEYS = frozenset(('file','line','col','rule','severity'))
+UNPACKED_KEYS = frozenset(("rule", "claim", "spark", "proof", "flow", "assumptions")) # see details_pairs_hook
+ENTITY_KEYS = ('name', 'file', 'line', 'col', 'type', 'type_orig') # order in which entities are printed
+DETAILS_FIELDS = ("how_proved", "check_tree") # of proof/flow entries; only used with --details
+EXTRA_FIELDS = frozenset(("checks", "vcs")) # optional UnitStats fields, only filled in on request
+CHECK_STATUS = ("proven", "suppressed", "failed") # status of a check record, see check_status
+SUMMARY_VERSION = 1 # of the run summaries written by --save
+PARTIAL_VERSION = 1 # of the partial summaries written by --partial
+SUMMARY_FIELDS = ("ents", "coverage", "coverage_spec", "props", "proven", "success", "flows", "flows_proven", "flows_success")
+HISTORY_UNIT_FIELDS = ("ents", "spec", "body", "skip", "coverage", "coverage_spec", "props", "proven", "success",
+                       "suppressed", "flows", "flows_proven", "flows_suppressed", "flows_success")
+HISTORY_LAST = 50 # default number of runs for history queries
+INDEX_COLUMNS = ("unit", "kind", "rule", "severity", "status", "file", "line", "col", "ordinal") # of the check index
+WATCH_INTERVAL = 10 # seconds between two polls with --watch
+PERCENTILES = (50, 90, 99) # of prover time and steps
+SLOWEST = 10 # default number of slowest VCs with --prover-stats
+BUDGET_PERCENTILES = (50, 75, 90, 95, 99, 100) # of valid attempts; default grid of the budget simulation
+BUDGET_CELLS = 1 << 22 # attempts x budgets evaluated at once by the budget simulation
+RESOURCE_FIELDS = ("wall_s", "user_s", "sys_s", "max_rss_mb", "ctx_voluntary", "ctx_involuntary") # see parse_time_log
+RESOURCE_SORT_CRITERIA = ("wall_s", "max_rss_mb")
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".xz")
+ARCHIVE_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz") # of gnatprove folders
+DIFF_FIELDS = ("ents", "coverage", "coverage_spec", "props", "success", "flows", "flows_success") # reported if changed
+
+#######################################
+#     GLOBAL VARIABLES
+#######################################
+# used to suppress output from subprocesses
+FNULL = open(os.devnull, 'w')
+
+#######################################
+#     FUNCTION DEFINITIONS
+#######################################
+
+def file2unit(filename):
+    """
+    transform file name into GNAT unit name
+    """
+    unitname = os.path.splitext(filename)[0]
+    unitname = unitname.replace("-",".")
+    return unitname.lower()
+
+class SubstringMatcher(object):
+    """
+    Aho-Corasick automaton: tells whether a string contains any of the given
+    substrings, in one pass over the string, no matter how many substrings
+    there are.
+    """
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.final = [False]
+        for pat in patterns:
+            state = 0
+            for ch in pat:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.final.append(False)
+                    self.goto[state][ch] = nxt
+                state = nxt
+            self.final[state] = True
+        # breadth-first: failure links, and inherit finality along them
+        queue = collections.deque(self.goto[0].itervalues())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].iteritems():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and not ch in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0) if state else 0
+                self.final[nxt] = self.final[nxt] or self.final[self.fail[nxt]]
+
+    def search(self, text):
+        if self.final[0]: return True # empty pattern
+        goto, fail, final = self.goto, self.fail, self.final
+        state = 0
+        for ch in text:
+            while state and not ch in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if final[state]: return True
+        return False
+
+class UnitFilter(object):
+    """
+    Decides from the unit name alone whether a unit is analyzed, so that
+    filtered units are never opened.
+
+    include: unit must match one of them exactly
+    exclude: unit must not contain any of them
+    Entries starting with "re:" are regular expressions instead, which must match
+    the entire unit name (include) or any part of it (exclude).
+    If both are given, only exclude is used.
+    """
+    def __init__(self, include, exclude):
+        self.exclude = bool(exclude)
+        pats = exclude if exclude else include
+        plain = [p for p in pats if not p.startswith("re:")]
+        regexes = [p[3:] for p in pats if p.startswith("re:")]
+        if self.exclude:
+            self.plain = SubstringMatcher(plain) if plain else None
+            self.regex = re.compile("|".join("(?:" + r + ")" for r in regexes)) if regexes else None
+        else:
+            self.plain = set(plain)
+            self.regex = re.compile("(?:" + "|".join("(?:" + r + ")" for r in regexes) + r")\Z") if regexes else None
+
+    def match(self, unit):
+        """
+        True if the unit shall be analyzed
+        """
+        if self.exclude:
+            hit = (self.plain is not None and self.plain.search(unit)) or \
+                  (self.regex is not None and self.regex.search(unit) is not None)
+            return not hit
+        return unit in self.plain or (self.regex is not None and self.regex.match(unit) is not None)
+
+# Compressed files and tar archives. A compressed file (*.gz, *.bz2, *.xz) is
+# read through a decompressing stream. A tar archive of a gnatprove folder
+# stands for that folder: its members are <archive>/<base name of member>.
+
+def decompressor(filename):
+    """
+    function opening the file for reading, depending on its suffix
+    """
+    if filename.endswith((".gz", ".tgz")): return gzip.open
+    if filename.endswith((".bz2", ".tbz2")): return bz2.BZ2File
+    if filename.endswith((".xz", ".txz")):
+        if lzma is None: raise IOError("*.xz needs the lzma module (Python 3 or backports.lzma)")
+        return lzma.LZMAFile
+    return None
+
+def is_archive(path):
+    return path.endswith(ARCHIVE_SUFFIXES) and os.path.isfile(path)
+
+def archive_member(filename):
+    """
+    whether the file is a member of an archive given as folder
+    """
+    return is_archive(os.path.dirname(filename))
+
+def file_base(filename):
+    """
+    file name without folder, compression suffix and extension
+    """
+    name = os.path.basename(filename)
+    if name.endswith(COMPRESSED_SUFFIXES): name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+class ArchiveMember(object):
+    """
+    file object of a member of a tar archive, read as a stream. Closing it
+    closes the archive.
+    """
+    def __init__(self, raw, tar, f):
+        self.raw, self.tar, self.f = raw, tar, f
+
+    def read(self, *args):
+        return self.f.read(*args)
+
+    def readline(self, *args):
+        return self.f.readline(*args)
+
+    def __iter__(self):
+        return iter(self.f.readline, "")
+
+    def close(self):
+        self.tar.close()
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def iter_archive(archive, suffixes=None):
+    """
+    Stream the members of a tar archive in one pass: yields (path, file object)
+    of the regular members whose names end with one of suffixes (all, if None).
+    The file object is only valid until the next one is yielded.
+    """
+    opener = decompressor(archive) or open
+    with opener(archive, 'rb') as raw:
+        tar = tarfile.open(fileobj=raw, mode="r|")
+        try:
+            for ti in tar:
+                if not ti.isfile(): continue
+                if suffixes and not ti.name.endswith(suffixes): continue
+                yield os.path.join(archive, os.path.basename(ti.name)), tar.extractfile(ti)
+        finally:
+            tar.close()
+
+_archive_listings = {} # (archive, size, mtime) -> paths of its members
+
+def list_archive(archive):
+    """
+    paths of the members of a tar archive. One pass per archive and run.
+    """
+    key = (archive,) + file_signature(archive)
+    if key not in _archive_listings:
+        _archive_listings[key] = [path for path, f in iter_archive(archive)]
+    return _archive_listings[key]
+
+def open_file(filename):
+    """
+    open a file for reading: plain, compressed or a member of an archive. The
+    latter is looked up by streaming the archive up to it; to read many of
+    them, rather use iter_archive.
+    """
+    if archive_member(filename):
+        archive = os.path.dirname(filename)
+        opener = decompressor(archive) or open
+        raw = opener(archive, 'rb')
+        try:
+            tar = tarfile.open(fileobj=raw, mode="r|")
+            for ti in tar:
+                if ti.isfile() and os.path.basename(ti.name) == os.path.basename(filename):
+                    return ArchiveMember(raw, tar, tar.extractfile(ti))
+        except:
+            raw.close()
+            raise
+        raw.close()
+        raise IOError("no such member: " + filename)
+    opener = decompressor(filename)
+    if opener: return opener(filename, 'rb')
+    return open(filename, 'rb')
+
+def find_files(folders, extension):
+    """
+    all files with the extension in the given folders (and archives), also
+    compressed ones, in the order in which they are ingested
+    """
+    files = []
+    for folder in folders:
+        if is_archive(folder):
+            try:
+                files.extend(fi for fi in list_archive(folder) if fi.endswith(extension))
+            except (IOError, tarfile.TarError) as e:
+                print "WARNING: cannot read " + folder + ": " + str(e)
+            continue
+        found = glob.glob(os.path.join(folder, '*' + extension))
+        for suffix in COMPRESSED_SUFFIXES:
+            compressed = glob.glob(os.path.join(folder, '*' + extension + suffix))
+            if compressed and suffix == ".xz" and lzma is None:
+                print "WARNING: skipping " + str(len(compressed)) + " *" + extension + suffix + " files in " + folder + ": needs the lzma module"
+                continue
+            found.extend(compressed)
+        files.extend(found)
+    return files
+
+def get_spark_files(folders):
+    """
+    List all *.spark files in the given folders, in the order in which
+    they are ingested
+    """
+    return find_files(folders, '.spark')
+
+def entity_anchor(entity):
+    """
+    (name, file) of the entity of a proof/flow entry, for the fingerprints of
+    the checks (see check_fingerprints). Also takes packed entities.
+    """
+    if type(entity) is tuple: entity = dict(entity)
+    if not entity: return None
+    sloc = entity.get("sloc") or [{}]
+    first = dict(sloc[0]) if type(sloc[0]) is tuple else sloc[0]
+    return entity.get("name"), first.get("file")
+
+def summary_object_hook(obj):
+    """
+    JSON object hook which reduces proof/flow entries while they are parsed.
+    Counterexamples, traces and proof trees are dropped as soon as their entry
+    is complete, and so are the assumptions. Thus the parsed file never holds
+    more than one of them at a time. Of the entity, only its anchor is kept.
+
+    Keys are popped in place, which does not change the order of the others.
+    """
+    if "rule" in obj and "severity" in obj:
+        obj["anchor"] = entity_anchor(obj.get("entity"))
+        for k in RAW_ONLY_FIELDS + DETAILS_FIELDS:
+            obj.pop(k, None)
+    elif "claim" in obj:
+        return None # one item of "assumptions"
+    return obj
+
+def details_pairs_hook(pairs):
+    """
+    Like summary_object_hook, but keeps the proof trees for --details.
+
+    Only the unit itself, the items of "spark" and the proof/flow entries become
+    dicts. All other objects are only carried over into the details, so they are
+    packed right away (see unpack_result), keeping their order from the file.
+    """
+    for k, _ in pairs:
+        if k in UNPACKED_KEYS: break
+    else:
+        return tuple(pairs)
+    obj = dict(pairs)
+    if "rule" in obj and "severity" in obj:
+        obj["anchor"] = entity_anchor(obj.get("entity"))
+        for k in RAW_ONLY_FIELDS:
+            obj.pop(k, None)
+        return obj
+    if "claim" in obj:
+        return None # one item of "assumptions"
+    if "spark" in obj or "proof" in obj or "flow" in obj or "assumptions" in obj:
+        return obj
+    return tuple(pairs)
+
+def compact_tree(tree):
+    """
+    Reduces the check_tree of a proof entry to what the prover statistics need:
+    a tuple of goals, all of which must be proven. Each goal is a tuple
+    (attempts, transformations), where attempts is a tuple of (prover, result,
+    time, steps), and transformations is a tuple of subgoal tuples. A goal is
+    proven if one of its attempts is valid, or all subgoals of one of its
+    transformations are proven. Also takes the packed check_tree of --details.
+    """
+    def obj(o):
+        return dict(o) if type(o) is tuple else (o or {})
+    def goals(g):
+        if isinstance(g, list): return tuple(goal(x) for x in g)
+        return (goal(g),) if g else ()
+    def goal(g):
+        g = obj(g)
+        attempts = []
+        for prover, a in obj(g.get("proof_attempts")).iteritems():
+            a = obj(a)
+            attempts.append((prover, a.get("result"), a.get("time") or 0.0, a.get("steps") or 0))
+        attempts.sort()
+        trans = [goals(sub) for name, sub in sorted(obj(g.get("transformations")).iteritems())]
+        return tuple(attempts), tuple(t for t in trans if t)
+    return goals(tree)
+
+def tree_object_hook(obj):
+    """
+    Like summary_object_hook, but reduces the proof trees with compact_tree
+    instead of dropping them, and keeps how_proved.
+    """
+    if "rule" in obj and "severity" in obj:
+        obj["vc_tree"] = compact_tree(obj.pop("check_tree", None))
+        obj["anchor"] = entity_anchor(obj.get("entity"))
+        for k in RAW_ONLY_FIELDS:
+            obj.pop(k, None)
+    elif "claim" in obj:
+        return None # one item of "assumptions"
+    return obj
+
+def load_spark_file(filename, details=True, trees=False, fileobj=None, strict=False):
+    """
+    Parses one *.spark file. Returns the unit name, the file base and the
+    JSON contents, reduced to what get_unit_statistics needs. With trees,
+    the proof entries keep their proof tree as "vc_tree" (see compact_tree).
+    The contents are read from fileobj, if given.
+    An unreadable file counts as empty, unless strict: then the error is raised.
+    """
+    prefix = "" # file2unit(folder)
+    if prefix: prefix = prefix + "."
+    filebase = file_base(filename)
+    unit = prefix + file2unit(filebase)
+    try:
+        f = fileobj or open_file(filename)
+        try:
+            if details:
+                contents = json.load(f, object_pairs_hook=details_pairs_hook)
+            elif trees:
+                contents = json.load(f, object_hook=tree_object_hook)
+            else:
+                contents = json.load(f, object_hook=summary_object_hook)
+        finally:
+            if fileobj is None: f.close()
+    except:
+        if strict: raise
+        contents = {}
+    if not isinstance(contents, dict): contents = {}
+
+    # we get three sections:
+    # 1) "spark" : that gives us the coverage. list of dicts.
+    #              each item has {"spark": <all|spec|no>, "name" : <name>, "sloc" : [{"file": .., "line": ..}]}.
+    #              If <name>=unit, then it's the package itself. Package with spark=spec means body not in SPARK mode
+    #
+    # 2) "flow" : flow analysis results. list of dicts.
+    #             each item has {"file": .., "line": .., "col": .., "rule": .., "severity": .., "entity": {"name": .., "sloc": [{}]}, "tracefile": .., "msg_id": .., "how_proved": ..}
+    #
+    # 3) "proof" : prover results. list of dicts
+    #             each item has the same as flow, but additionally {"cntexmp":{}, "suppressed" : <string>}. Here, rule=<VC_PRECONDITION|VC_DISCRIMINANT_CHECK|...>
+    #
+    # 4) "assumptions" : not interesting here. we remove it.
+    #
+    # Thus, coverage comes from "spark", success comes from "proof"
+
+    try:
+        contents.pop("assumptions", None)
+    except:
+        pass
+    contents["filebase"] = filebase
+    return unit, filebase, contents
+
+def decode_type(t):
+    """
+    verbose type from ALI symbol. See lib-xref.ads
+    Only handles those with would appear in *.spark files
+
+    Bodies of functions will not appear in SPARK, only specs.
+    Task types will not appear in SPARK, only objects
+    packages will appear
+    """
+    typ = None
+    if t == 'K':
+        typ = "package" # used also for generic instances
+    #elif t == 'T':
+    #    typ = "task type"
+    elif t == 't':
+        typ = "task object"
+    #elif t == 'W':
+    #    typ = "protected type"
+    #elif t == 'w':
+    #    typ = 'protected object'
+    #elif t == ' ':
+    #    typ = "subprogram type"
+    elif t == 'V':
+        typ = "function"
+    #elif t == 'v':
+    #    typ = "generic function" # becomes a function where used, does not appear in SPARK file
+    elif t == 'U':
+        typ = 'procedure'
+    #elif t == 'u':
+    #    typ = "generic procedure" # same here
+    elif t == 'y':
+        typ = "abstract function"
+    elif t == 'x':
+        typ = "abstract procedure"
+    return typ
+
+def find_ali_files(folders):
+    """
+    map file base -> path of its ALI file. When the same ALI file is in several
+    folders, the first folder wins.
+    """
+    alifiles = {}
+    for fi in find_files(folders, '.ali'):
+        alifiles.setdefault(file_base(fi), fi)
+    return alifiles
+
+# ALI scanner. See lib-xref.ads
+ALI_XREF_HEADER = re.compile(r"^X \d+ ([^\s]+)\.(ads|adb)", re.MULTILINE)
+ALI_XREF_ENTITY = re.compile(r"^(\d+)(\w)(\d+).(\w+)", re.MULTILINE)
+ALI_MMAP_SIZE = 1 << 20 # memory-map ALI files larger than this
+
+def read_ali_file(alifile):
+    """
+    contents of an ALI file, as a string or a read-only memory map for large files.
+    Caller must close the latter.
+    """
+    if archive_member(alifile) or decompressor(alifile):
+        with open_file(alifile) as f:
+            return f.read()
+    with open(alifile, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > ALI_MMAP_SIZE:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
+
+def parse_ali_entities(buf, filebase):
+    """
+    compile a list of entities in this unit from the cross-reference section of its ALI file
+
+    We wanted to use gnatinspect, but it does not give us what we need. We would have to
+    give all included project files to it, since flag --runtime does not work as intended.
+    Probably we should handover -Pp1.gpr,p2.gpr,... to this script, and then let
+    gprbuild or someone figure out object dirs. Then we could use the gpr files here
+
+    For now, we parse the ALI files, which are in our main project's object dir. Advantage
+    is, that there we find also the ALI files of included projects.
+
+    Not perfect, either. When a generic package is instantiated, then all functions which are not
+    public are in the ALI file of the instantiating unit, but those with spec are not.
+
+    Only the X sections of the unit's own spec and body are scanned; all others are skipped
+    without looking at their lines.
+    """
+    d=[]
+    headers = list(ALI_XREF_HEADER.finditer(buf))
+    for i, header in enumerate(headers):
+        if header.group(1) != filebase: continue
+        where = header.group(2)
+        filename = filebase + "." + where
+        endpos = headers[i+1].start() if i + 1 < len(headers) else len(buf)
+        # line type col level entity
+        for match in ALI_XREF_ENTITY.finditer(buf, header.end(), endpos):
+            ent_type = decode_type (match.group(2))
+            if ent_type:
+                d.append({'name':match.group(4), 'file':filename, 'line':int (match.group(1)), 'col':int (match.group(3)), 'type': ent_type, 'type_orig':match.group(2)})
+    return d
+
+def build_ali_index(alifiles, filebases=None):
+    """
+    One pass over the given ALI files (file base -> path, see find_ali_files),
+    yielding an index file base -> {"alifile": path, "entities": [...]}.
+    If filebases is given, only those are indexed. ALI files in archives are
+    read in one pass over each archive.
+    """
+    index = {}
+    archived = {} # archive -> {path: file base}
+    for filebase, alifile in alifiles.iteritems():
+        if filebases is not None and not filebase in filebases: continue
+        if archive_member(alifile):
+            archived.setdefault(os.path.dirname(alifile), {})[alifile] = filebase
+            continue
+        try:
+            buf = read_ali_file(alifile)
+        except (OSError, IOError) as e:
+            print "WARNING: cannot read " + alifile + ": " + str(e)
+            continue
+        try:
+            index[filebase] = {"alifile": alifile, "entities": parse_ali_entities(buf, filebase)}
+        finally:
+            if isinstance(buf, mmap.mmap): buf.close()
+    for archive, wanted in archived.iteritems():
+        try:
+            for alifile, f in iter_archive(archive, ('.ali',)):
+                filebase = wanted.get(alifile)
+                if filebase is None: continue
+                index[filebase] = {"alifile": alifile, "entities": parse_ali_entities(f.read(), filebase)}
+        except (OSError, IOError, tarfile.TarError) as e:
+            print "WARNING: cannot read " + archive + ": " + str(e)
+    return index
+
+class RuleStats(object):
+    """
+    How many checks of one rule a unit has, and how many of them are proven
+    """
+    __slots__ = ("rule", "cnt", "proven")
+
+    def __init__(self, rule, cnt=0, proven=0):
+        self.rule = rule
+        self.cnt = cnt
+        self.proven = proven
+
+    def __getstate__(self):
+        return (self.rule, self.cnt, self.proven)
+
+    def __setstate__(self, state):
+        self.rule, self.cnt, self.proven = state
+
+class UnitStats(object):
+    """
+    Abstract summary of one unit.
+
+    ents: number of entities
+    spec: number of entities where spec is in SPARK
+    body: number of entities where body is in SPARK
+    skip: number of entities where SPARK is off
+    coverage: number of entities where body in in SPARK divided by number of entities
+    coverage_spec: number of entities where at least spec in in SPARK divided by number of entities
+    props/proven/suppressed/success: proof checks
+    flows/flows_proven/flows_suppressed/flows_success: flow checks
+    rules: list of RuleStats, in order of first appearance (proofs, then flows)
+    details_proofs, details_flows, entities: only with --details, otherwise None.
+                  Packed, see unpack_result.
+    checks: only if requested (diff, --save, --index), otherwise None. List of
+            tuples (kind, rule, file, line, col, status, severity, fingerprint),
+            see CHECK_STATUS and check_fingerprints.
+    vcs: only if requested (prover statistics), otherwise None. List of tuples
+         (rule, file, line, col, status, how_proved, tree), see compact_tree.
+    wall_s, user_s, sys_s, max_rss_mb, ctx_voluntary, ctx_involuntary: resource
+         usage of the gnatprove invocation of this unit, only with --time-log and
+         if the unit was analyzed on its own, otherwise None. See parse_time_log.
+    """
+    __slots__ = ("ents", "spec", "body", "skip", "coverage", "coverage_spec",
+                 "props", "rules", "proven", "success", "suppressed",
+                 "flows", "flows_proven", "flows_suppressed", "flows_success",
+                 "details_proofs", "details_flows", "entities", "checks", "vcs",
+                 "wall_s", "user_s", "sys_s", "max_rss_mb", "ctx_voluntary", "ctx_involuntary")
+
+    def __init__(self):
+        for k in self.__slots__:
+            setattr(self, k, None)
+        self.rules = []
+
+    def __getstate__(self):
+        return tuple(getattr(self, k) for k in self.__slots__)
+
+    def __setstate__(self, state):
+        for k, v in itertools.izip(self.__slots__, state):
+            setattr(self, k, v)
+
+    def unpacked(self):
+        """
+        copy with the details turned into dicts, see unpack_result. The packed
+        original may live on in the cache.
+        """
+        cp = UnitStats()
+        cp.__setstate__(self.__getstate__())
+        for k in ("details_proofs", "details_flows", "entities"):
+            setattr(cp, k, unpack_result(getattr(self, k)))
+        return cp
+
+    def rules_dict(self):
+        return {r.rule: {"cnt": r.cnt, "proven": r.proven} for r in self.rules}
+
+    def to_dict(self):
+        """
+        the summary as we print it. Keys are inserted in the order in which they
+        were always inserted, so that the JSON output keeps its key order.
+        """
+        d = {}
+        d["ents"] = self.ents
+        d["spec"] = self.spec
+        d["body"] = self.body
+        d["skip"] = self.skip
+        d["coverage"] = self.coverage
+        d["coverage_spec"] = self.coverage_spec
+        if self.details_proofs is not None: d["details_proofs"] = self.details_proofs
+        d["props"] = self.props
+        d["rules"] = self.rules_dict()
+        d["proven"] = self.proven
+        d["success"] = self.success
+        d["suppressed"] = self.suppressed
+        if self.details_flows is not None: d["details_flows"] = self.details_flows
+        d["flows"] = self.flows
+        d["flows_proven"] = self.flows_proven
+        d["flows_suppressed"] = self.flows_suppressed
+        d["flows_success"] = self.flows_success
+        if self.entities is not None: d["entities"] = self.entities
+        if self.wall_s is not None:
+            for k in RESOURCE_FIELDS:
+                d[k] = getattr(self, k)
+        return d
+
+def check_status(check):
+    """
+    status of one proof/flow entry, see CHECK_STATUS
+    """
+    if "suppressed" in check: return "suppressed"
+    return "proven" if check["severity"] == "info" else "failed"
+
+def check_fingerprints(unit, checks, anchors):
+    """
+    Stable fingerprints (hex strings) of the check records of one unit. A check
+    is identified by unit, kind, rule, entity, file and column, and by its rank
+    in order of lines among the checks which have all of those in common. Unlike
+    the line itself, this does not change when lines are inserted or removed
+    elsewhere in the file.
+    """
+    groups = {}
+    for i, (c, a) in enumerate(itertools.izip(checks, anchors)):
+        key = (unit, c[0], c[1]) + tuple(a or (None, None)) + (c[2], c[4])
+        groups.setdefault(key, []).append((c[3], i))
+    fps = [None] * len(checks)
+    for key, members in groups.iteritems():
+        members.sort()
+        for n, (line, i) in enumerate(members):
+            ident = u"\0".join(unicode(k) for k in key + (n,))
+            fps[i] = hashlib.sha1(ident.encode("utf-8")).hexdigest()[:16]
+    return fps
+
+def get_unit_statistics(u, uinfo, details, messages, extras=()):
+    """
+    Turn the JSON data of one unit into its abstract summary (UnitStats).
+    extras are the optional fields to fill in (see EXTRA_FIELDS).
+    """
+    unitstats = UnitStats()
+    if "checks" in extras:
+        entries = [(kind, c) for kind in ("proof", "flow") for c in uinfo.get(kind, ())]
+        checks = [(kind, c["rule"], c["file"], c["line"], c["col"], check_status(c), c["severity"])
+                  for kind, c in entries]
+        fps = check_fingerprints(u, checks, [c.get("anchor") for kind, c in entries])
+        unitstats.checks = [c + (fp,) for c, fp in itertools.izip(checks, fps)]
+    if "vcs" in extras:
+        unitstats.vcs = [(c["rule"], c["file"], c["line"], c["col"], check_status(c), c.get("how_proved"),
+                          c["vc_tree"] if "vc_tree" in c else compact_tree(c.get("check_tree")))
+                         for c in uinfo.get("proof", ())]
+
+    # GET COVERAGE
+    c = 0 # entities covered
+    s = 0 # entities skipped (incl.
+    n_spark = 0 # entities total (including specs
+    n_ent = len(uinfo['entities'])
+    if "spark" in uinfo:
+        for sub in uinfo["spark"]:
+            is_covered = True if sub["spark"] == "all" else False
+            is_spec = True if sub["spark"] == "spec" else False
+            if is_covered: c = c + 1
+            if is_spec: s = s + 1 # that is half-way covered
+            n_spark = n_spark + 1
+    if not (n_spark <= n_ent):
+        messages.append("WARNING: Total number of entities in ALI file (" + str(n_ent) + ") is less than number of entities found by GNATprove (" + str(n_spark) + "); please check: " + u)
+        n_ent = n_spark
+    unitstats.ents = n_ent
+    unitstats.spec = s
+    unitstats.body = c
+    unitstats.skip = n_ent - c - s
+    unitstats.coverage = (100*float(c) / n_ent) if n_ent > 0 else 0
+    unitstats.coverage_spec = (100*float(c+s) / n_ent) if n_ent > 0 else 0
+
+    # rule -> RuleStats; proofs and flows share one table
+    rule_stats = {}
+    def get_rule_stats(rule):
+        rs = rule_stats.get(rule)
+        if rs is None:
+            rs = rule_stats[rule] = RuleStats(rule)
+            unitstats.rules.append(rs)
+        return rs
+
+    # GET SUCCESS of PROOF
+    p = 0
+    ig = 0
+    n = 0
+    if "proof" in uinfo:
+        n = len(uinfo["proof"])
+        for proof in uinfo["proof"]:
+            is_suppressed = True if "suppressed" in proof else False
+            is_verified = True if proof["severity"]=="info" else is_suppressed
+            if is_verified: p = p + 1
+            if is_suppressed : ig = ig + 1
+            rs = get_rule_stats(proof["rule"])
+            rs.cnt += 1
+            rs.proven += 1 if is_verified else 0
+            if details:
+                lid = tuple([(k,v) for k,v in proof.iteritems() if k in DETAILS_PROOF_KEYS])
+                if unitstats.details_proofs is None: unitstats.details_proofs = []
+                unitstats.details_proofs.append(lid)
+
+    unitstats.props = n
+    unitstats.proven = p
+    unitstats.success = (100*float(p) / n) if n > 0 else 100.0
+    unitstats.suppressed = ig
+
+    # GET SUCCESS of FLOW
+    f = 0
+    ig = 0
+    if "flow" in uinfo:
+        n = len(uinfo["flow"])
+        for flow in uinfo["flow"]:
+            is_suppressed = True if "suppressed" in flow else False
+            is_verified = True if flow["severity"]=="info" else is_suppressed
+            if is_verified: f = f + 1
+            if is_suppressed : ig = ig + 1
+            rs = get_rule_stats(flow["rule"])
+            rs.cnt += 1
+            rs.proven += 1 if is_verified else 0
+            if details:
+                lid = tuple([(k,v) for k,v in flow.iteritems() if k in DETAILS_FLOW_KEYS])
+                if unitstats.details_flows is None: unitstats.details_flows = []
+                unitstats.details_flows.append(lid)
+
+    unitstats.flows = n
+    unitstats.flows_proven = f
+    unitstats.flows_suppressed = ig
+    unitstats.flows_success = (100*float(f) / n) if n > 0 else 100.0
+
+    # carry over entities
+    if details:
+        unitstats.entities = [tuple((k, e[k]) for k in ENTITY_KEYS) for e in uinfo["entities"]]
+
+    ###########
+    # SORTING
+    ###########
+    location = operator.itemgetter('file','line','col','rule')
+    if unitstats.details_proofs:
+        unitstats.details_proofs.sort(key=lambda lid: location(dict(lid)))
+    if unitstats.details_flows:
+        unitstats.details_flows.sort(key=lambda lid: location(dict(lid)))
+    return unitstats
+
+def unpack_result(obj):
+    """
+    Dicts do not keep their key order when they are pickled between processes
+    or into the cache, which would make our output depend on the number of jobs.
+    Therefore the details are kept as tuples of (key, value) pairs, in the order
+    in which the keys were inserted, and only turned into dicts for printing.
+    Tuples do not occur in JSON data, so they are unambiguous.
+    """
+    t = type(obj)
+    if t is tuple:
+        return {k: (unpack_result(v) if type(v) in (tuple, list) else v) for k,v in obj}
+    if t is list:
+        return [(unpack_result(v) if type(v) in (tuple, list) else v) for v in obj]
+    return obj
+
+def reduce_spark_file(task, fileobj=None, strict=False):
+    """
+    Worker: parse one *.spark file and reduce it together with the entities
+    from its ALI file (None if there is none) to the abstract summary of the
+    unit. The raw JSON is dropped here, so that only the summary has to travel
+    back to the parent process.
+    """
+    filename, entities, details, extras = task
+    messages = []
+    unit, filebase, uinfo = load_spark_file(filename, details, trees="vcs" in extras, fileobj=fileobj, strict=strict)
+    if entities is None:
+        messages.append("WARNING: " + filebase + ".ali nowhere found")
+        entities = []
+    uinfo["entities"] = entities
+    unitstats = get_unit_statistics(unit, uinfo, details, messages, extras)
+    return unit, unitstats, messages
+
+def file_signature(filename):
+    """
+    (size, mtime) of a file, or of the archive of a member. Cheap, since the
+    file is not read.
+    """
+    if archive_member(filename): filename = os.path.dirname(filename)
+    st = os.stat(filename)
+    return st.st_size, st.st_mtime
+
+def file_hash(filename):
+    """
+    SHA1 of the file contents
+    """
+    h = hashlib.sha1()
+    with (open_file(filename) if archive_member(filename) else open(filename, 'rb')) as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            h.update(block)
+    return h.hexdigest()
+
+class UnitCache(object):
+    """
+    Persistent cache of unit summaries, so that only those *.spark files
+    are parsed which have changed since the last run.
+
+    There is one cache file per gnatprove folder, stored next to it (and
+    thus surviving "gnatprove --clean"). Entries are keyed by the path of
+    the *.spark file and store the size, mtime and SHA1 of the *.spark file
+    and the ALI file the entities came from, together with the summary
+    computed by get_unit_statistics. Size and mtime are checked first; only
+    if they differ, the contents are hashed.
+    """
+    def __init__(self, folders, rebuild=False):
+        self.hits = 0
+        self.misses = 0
+        self.caches = {} # cache file -> {spark file -> entry}
+        self.dirty = set()
+        for fld in folders:
+            cfile = self.cachefile(fld)
+            entries = {}
+            if not rebuild and os.path.isfile(cfile):
+                try:
+                    with open(cfile, 'rb') as f:
+                        data = cPickle.load(f)
+                    if data.get("version") == CACHE_VERSION:
+                        entries = data["entries"]
+                except Exception:
+                    print "WARNING: ignoring unreadable cache " + cfile
+            if rebuild: self.dirty.add(cfile)
+            self.caches[cfile] = entries
+
+    @staticmethod
+    def cachefile(folder):
+        parent, name = os.path.split(os.path.abspath(folder))
+        return os.path.join(parent, "." + name + CACHE_SUFFIX)
+
+    def _entries(self, filename):
+        return self.caches[self.cachefile(os.path.dirname(filename))]
+
+    @staticmethod
+    def _matches(sig, filename):
+        """
+        check stored [size, mtime, sha1] against the file. Updates size and
+        mtime, if only those have changed.
+        """
+        size, mtime = file_signature(filename)
+        if sig[0] == size and sig[1] == mtime: return True
+        if sig[0] != size or sig[2] != file_hash(filename): return False
+        sig[1] = mtime
+        return True
+
+    def lookup(self, filename, alifile, details, extras=frozenset()):
+        """
+        returns (unitstats, messages) or None on miss. An entry with
+        more extras also serves lookups which do not need them.
+        """
+        entries = self._entries(filename)
+        entry = entries.get(filename)
+        hit = False
+        if entry and entry["details"] == details and extras <= entry["extras"] \
+           and entry["alifile"] == alifile:
+            sigs = [s for s in (entry["spark"], entry["ali"]) if s]
+            mtimes = [s[1] for s in sigs]
+            try:
+                hit = self._matches(entry["spark"], filename) and \
+                      (not alifile or self._matches(entry["ali"], alifile))
+            except (OSError, IOError):
+                hit = False
+            if hit and mtimes != [s[1] for s in sigs]:
+                # only touched; remember the new mtime
+                self.dirty.add(self.cachefile(os.path.dirname(filename)))
+        if hit:
+            self.hits += 1
+            return entry["stats"], entry["messages"]
+        self.misses += 1
+        return None
+
+    def store(self, filename, alifile, details, extras, unitstats, messages):
+        def sig(fi):
+            if not fi: return None
+            size, mtime = file_signature(fi)
+            return [size, mtime, file_hash(fi)]
+        try:
+            entry = {"spark": sig(filename), "alifile": alifile, "ali": sig(alifile),
+                     "details": details, "extras": extras, "stats": unitstats, "messages": messages}
+        except (OSError, IOError):
+            return
+        self._entries(filename)[filename] = entry
+        self.dirty.add(self.cachefile(os.path.dirname(filename)))
+
+    def save(self, spark_files):
+        """
+        write back all modified caches. Entries of *.spark files which are
+        not in spark_files any more are dropped.
+        """
+        present = set(spark_files)
+        for cfile, entries in self.caches.iteritems():
+            stale = [fi for fi in entries if fi not in present]
+            for fi in stale:
+                del entries[fi]
+            if not stale and not cfile in self.dirty: continue
+            try:
+                tmpfile = cfile + ".tmp"
+                with open(tmpfile, 'wb') as f:
+                    cPickle.dump({"version": CACHE_VERSION, "entries": entries}, f, cPickle.HIGHEST_PROTOCOL)
+                os.rename(tmpfile, cfile)
+            except (OSError, IOError) as e:
+                print "WARNING: cannot write cache " + cfile + ": " + str(e)
+
+def get_unit_data(folders, details, jobs, cache=None, unitfilter=None, extras=frozenset()):
+    """
+    Parses all *.spark files in the given directories and reduces
+    each of them to its unit summary. extras is the set of optional
+    fields the summaries shall carry (see EXTRA_FIELDS).
+
+    With jobs > 1 the files are parsed in a process pool. Results are
+    collected in the same order as in the serial case, so the output does
+    not depend on the number of jobs.
+
+    If a cache is given, only files which have changed are parsed.
+    Units rejected by unitfilter are skipped before their files are opened.
+
+    Archives of gnatprove folders are streamed in one pass each and their
+    files are reduced in this process, one at a time; they are not cached.
+    """
+    all_spark_files = get_spark_files(folders)
+    spark_files = all_spark_files
+    if unitfilter:
+        spark_files = [fi for fi in spark_files if unitfilter.match(file2unit(file_base(fi)))]
+    filebases = [file_base(fi) for fi in spark_files]
+    archived = [archive_member(fi) for fi in spark_files]
+    results = [None] * len(spark_files)
+    alifiles = find_ali_files(folders)
+    if cache:
+        for i, filename in enumerate(spark_files):
+            if archived[i]: continue
+            cached = cache.lookup(filename, alifiles.get(filebases[i]), details, extras)
+            if cached:
+                results[i] = (file2unit(filebases[i]),) + cached
+    todo = [i for i, r in enumerate(results) if r is None]
+    ali_index = build_ali_index(alifiles, set(filebases[i] for i in todo))
+    for i, res in reduce_archived_files(spark_files, [i for i in todo if archived[i]], ali_index, details, extras):
+        results[i] = res
+    # map task index back to file index
+    todo = [i for i in todo if not archived[i]]
+    tasks = []
+    for i in todo:
+        ali = ali_index.get(filebases[i])
+        tasks.append((spark_files[i], ali["entities"] if ali else None, details, extras))
+
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        chunksize = max(1, len(tasks) / (4 * jobs))
+        computed = pool.imap(reduce_spark_file, tasks, chunksize)
+    else:
+        computed = itertools.imap(reduce_spark_file, tasks)
+
+    try:
+        for i, res in itertools.izip(todo, computed):
+            results[i] = res
+            if cache:
+                unit, unitstats, messages = res
+                cache.store(spark_files[i], alifiles.get(filebases[i]), details, extras, unitstats, messages)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    abstract_units = {}
+    for unit, unitstats, messages in results:
+        for m in messages:
+            print m
+        abstract_units[unit] = unitstats.unpacked()
+        for k in EXTRA_FIELDS - extras:
+            setattr(abstract_units[unit], k, None)
+    if cache: cache.save(all_spark_files)
+    return abstract_units
+
+def reduce_archived_files(spark_files, todo, ali_index, details, extras):
+    """
+    reduce the *.spark files with the given indices, which are members of
+    archives, in one pass over each archive. Yields (index, result of
+    reduce_spark_file).
+    """
+    archives = collections.OrderedDict() # archive -> {path: index}
+    for i in todo:
+        archives.setdefault(os.path.dirname(spark_files[i]), {})[spark_files[i]] = i
+    for archive, wanted in archives.iteritems():
+        for filename, f in iter_archive(archive, ('.spark',)):
+            i = wanted.pop(filename, None)
+            if i is None: continue
+            ali = ali_index.get(file_base(filename))
+            yield i, reduce_spark_file((filename, ali["entities"] if ali else None, details, extras), f)
+        for filename, i in wanted.iteritems(): # cannot happen, unless the archive changed meanwhile
+            yield i, reduce_spark_file((filename, None, details, extras))
+
+def get_statistics(abstract_units, sorting, top=None):
+    """
+    Compute totals of the unit summaries and sort them. Returns the
+    totals and a sorted list of (unit, UnitStats), see sort_units.
+    Totals always include all units.
+    """
+
+    ##########
+    # TOTALS
+    ##########
+    # ent_cov: number of entities with body in spark divided number of entities
+    # ent_cov_spec: number of entities with at least spec in spark divided number of entities
+    # unit_cov: deprecated. unweighted average of individual unit coverages. but unweighted is unfair.
+    units = abstract_units.items()
+    # one row of counters per unit, summed up in one go
+    counters = numpy.array([[getattr(s, k) for k in TOTAL_COUNTERS] for u,s in units], dtype=numpy.int64)
+    sums = dict(zip(TOTAL_COUNTERS, (int(v) for v in counters.sum(axis=0)))) if units else dict.fromkeys(TOTAL_COUNTERS, 0)
+    # merge down rules: intern rule names to ints, then sum with bincount.
+    # Rules are numbered in the order they appear in the units' rule dicts, which
+    # is the order in which they have always been printed.
+    rule_ids = {}
+    rule_names = []
+    ids = []
+    cnts = []
+    provens = []
+    for u,s in units:
+        for r,stat in s.rules_dict().iteritems():
+            rid = rule_ids.get(r)
+            if rid is None:
+                rid = rule_ids[r] = len(rule_names)
+                rule_names.append(r)
+            ids.append(rid)
+            cnts.append(stat["cnt"])
+            provens.append(stat["proven"])
+    ids = numpy.array(ids, dtype=numpy.intp)
+    rule_cnt = numpy.bincount(ids, weights=cnts, minlength=len(rule_names))
+    rule_proven = numpy.bincount(ids, weights=provens, minlength=len(rule_names))
+    total_rules = {}
+    for rid, r in enumerate(rule_names):
+        total_rules[r] = {"cnt": int(rule_cnt[rid]), "proven": int(rule_proven[rid])}
+    totals = make_totals(len(abstract_units), sums, total_rules)
+
+    #################
+    #  SORT
+    #################
+    sorted_abstract_units = sort_units(units, sorting, top)
+
+    return totals, sorted_abstract_units
+
+def make_totals(n_units, sums, total_rules):
+    """
+    totals dict from the number of units, the sums of TOTAL_COUNTERS over
+    all units and the summed up rule statistics
+    """
+    totals={}
+    totals["units"] = n_units
+    totals["ents"] = sums["ents"]
+    totals["props"] = sums["props"]
+    totals["suppressed"] = sums["suppressed"]
+    totals["proven"] = sums["proven"]
+    totals["spec"] = sums["spec"]
+    totals["skip"] = sums["skip"]
+    totals["ent_cov"] = (100*(float(totals["ents"] - totals["skip"] - totals["spec"])) / totals["ents"]) if totals["ents"] > 0 else 0
+    totals["ent_cov_spec"] = (100*(float(totals["ents"] - totals["skip"])) / totals["ents"]) if totals["ents"] > 0 else 0
+    totals["success"] = (100*(float(totals["proven"]) / totals["props"])) if totals["props"] > 0 else 0
+    totals["flows"] = sums["flows"]
+    totals["flows_proven"] = sums["flows_proven"]
+    totals["flows_suppressed"] = sums["flows_suppressed"]
+    totals["flows_success"] = (100*(float(totals["flows_proven"]) / totals["flows"])) if totals["flows"] > 0 else 0
+    totals["rules"] = total_rules
+    return totals
+
+def sort_units(units, sorting, top=None):
+    """
+    Sort list of (unit, UnitStats) by the given criteria, biggest first
+    (alphabetically, if "alpha" is among them). Ties keep their order.
+
+    With top=N, only the N worst units are returned, worst first: lowest
+    coverage/success, highest skip/props/ents. A heap is used, so the rest
+    is never sorted.
+    """
+    crit = [c for c in sorting if c != "alpha"]
+    if "alpha" in sorting or not crit:
+        if top is not None: return heapq.nsmallest(top, units, key=operator.itemgetter(0))
+        return sorted(units, key=operator.itemgetter(0))
+
+    if top is None:
+        # one key tuple per unit, compared in C
+        getter = operator.attrgetter(*crit)
+        return sorted(units, key=lambda (u,s): getter(s), reverse=True)
+
+    signs = [WORST_FIRST[c] for c in crit]
+    def worst_key((u,s)):
+        # units without resource usage sort as if they had none
+        return tuple(sign * (getattr(s, c) or 0) for sign, c in zip(signs, crit))
+    return heapq.nsmallest(top, units, key=worst_key)
+
+def print_table(units,filtercols):
+    """
+    Makes a nice ascii table from the list of (unit, UnitStats), only using keys=filtercols
+    """
+    if len (units) == 0: return
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_precision(1)
+
+    # first row is header
+    # columns in the same order as in the JSON output, then the resource usage
+    cols = [k for k in units[0][1].to_dict().iterkeys() if k in filtercols and k not in RESOURCE_FIELDS]
+    cols += [k for k in RESOURCE_FIELDS if k in filtercols]
+    header = ["unit"] + cols
+
+    num_datacols = (len(header)-1)
+    alignment = ["l"] + ["r"] * num_datacols
+    tab.set_cols_align(alignment);
+
+    data = [header]
+    maxlen = 0
+    for u,s in units:
+        if len(u) > maxlen: maxlen = len(u)
+        data.append([u] + [getattr(s, k) if getattr(s, k) is not None else "" for k in cols])
+    tab.add_rows(data)
+    tab.set_cols_width([maxlen] + [8]*num_datacols)
+
+    print tab.draw()
+
+#####################
+#  RESOURCE USAGE
+#####################
+
+def parse_duration(text):
+    """
+    "h:mm:ss" or "m:ss.ss" to seconds
+    """
+    secs = 0.0
+    for part in text.split(":"):
+        secs = 60 * secs + float(part)
+    return secs
+
+# lines of /usr/bin/time -v, which prove_all.sh wraps around gnatprove:
+# label -> (field, conversion)
+TIME_LABELS = {
+    "User time (seconds)": ("user_s", float),
+    "System time (seconds)": ("sys_s", float),
+    "Elapsed (wall clock) time (h:mm:ss or m:ss)": ("wall_s", parse_duration),
+    "Maximum resident set size (kbytes)": ("max_rss_mb", lambda v: int(v) / 1024.0),
+    "Voluntary context switches": ("ctx_voluntary", int),
+    "Involuntary context switches": ("ctx_involuntary", int),
+}
+
+def timed_units(command):
+    """
+    units given with -u in the command line of a gnatprove invocation
+    """
+    units = []
+    args = command.split()
+    for i, a in enumerate(args):
+        if a != "-u": continue
+        for f in args[i+1:]:
+            if f.startswith("-"): break
+            units.append(file2unit(os.path.basename(f)))
+    return units
+
+def parse_time_log(logfile):
+    """
+    Resource usage blocks of /usr/bin/time -v in a build log. Returns the
+    usage per unit and the list of all blocks (dicts with RESOURCE_FIELDS and
+    "command").
+
+    A block belongs to a unit if its command analyzed only this unit (-u <unit>,
+    as in the INDIVIDUAL mode of prove_all.sh). The usage of the whole project
+    at once cannot be split up; it only counts for the totals. A unit which has
+    been timed more than once keeps its last block. This is also where
+    gnatprove_schedule.py takes the costs of the units from.
+    """
+    blocks = []
+    block = None
+    with open_file(logfile) as f:
+        for line in f:
+            if not line.startswith(("\t", " ")): continue # time indents its lines
+            label, _, value = line.strip().partition(": ")
+            if label == "Command being timed":
+                block = dict.fromkeys(RESOURCE_FIELDS)
+                block["command"] = value.strip('"')
+                blocks.append(block)
+            elif block is not None and label in TIME_LABELS:
+                field, conv = TIME_LABELS[label]
+                try:
+                    block[field] = conv(value.strip())
+                except ValueError:
+                    pass
+    units = {}
+    for b in blocks:
+        u = timed_units(b["command"])
+        if len(u) == 1: units[u[0]] = b
+    return units, blocks
+
+def add_resources(abstract_units, units):
+    """
+    set the resource usage of the units (see parse_time_log). Returns the
+    timed units which are not among the given ones.
+    """
+    for u, b in units.iteritems():
+        s = abstract_units.get(u)
+        if s is None: continue
+        for k in RESOURCE_FIELDS:
+            setattr(s, k, b[k])
+    return sorted(u for u in units if u not in abstract_units)
+
+def resource_totals(blocks):
+    """
+    resource usage of all timed invocations: times and context switches
+    are summed up, the memory is the maximum
+    """
+    totals = {"invocations": len(blocks)}
+    for k in RESOURCE_FIELDS:
+        values = [b[k] for b in blocks if b[k] is not None]
+        totals[k] = (max(values) if k == "max_rss_mb" else sum(values)) if values else None
+    return totals
+
+#####################
+#  WATCH
+#####################
+
+class UnitWatcher(object):
+    """
+    Statistics of gnatprove folders which are still being written. Each poll
+    only parses the *.spark files which are new or have changed since the
+    last poll, and updates the running sums by taking out the old summary of
+    the unit and adding the new one.
+
+    expected: set of units which are going to be analyzed. If None, all
+              units with an ALI file in the folders are expected.
+    """
+    def __init__(self, folders, unitfilter=None, expected=None):
+        self.folders = folders
+        self.unitfilter = unitfilter
+        self.expected = expected
+        self.files = {} # spark file -> (signature, unit, UnitStats)
+        self.units = {} # unit -> UnitStats
+        self.sums = dict.fromkeys(TOTAL_COUNTERS, 0)
+        self.rules = {} # rule -> [cnt, proven]
+        self.start = None # (time, units done) at first poll, for the rate
+
+    def _account(self, s, sign):
+        for k in TOTAL_COUNTERS:
+            self.sums[k] += sign * getattr(s, k)
+        for r in s.rules:
+            rs = self.rules.setdefault(r.rule, [0, 0])
+            rs[0] += sign * r.cnt
+            rs[1] += sign * r.proven
+
+    def _remove(self, filename):
+        sig, unit, s = self.files.pop(filename)
+        self._account(s, -1)
+        if self.units.get(unit) is s: del self.units[unit]
+
+    def poll(self):
+        """
+        pick up new, changed and removed *.spark files. Returns the list of
+        units which have been updated. Files which cannot be parsed yet (because
+        gnatprove is still writing them) are tried again at the next poll.
+        """
+        present = set()
+        changed = []
+        for fi in get_spark_files(self.folders):
+            if self.unitfilter and not self.unitfilter.match(file2unit(file_base(fi))): continue
+            present.add(fi)
+            try:
+                sig = file_signature(fi)
+            except OSError:
+                continue
+            old = self.files.get(fi)
+            if not old or old[0] != sig: changed.append((fi, sig))
+        for fi in [fi for fi in self.files if fi not in present]:
+            self._remove(fi)
+
+        updated = []
+        if changed:
+            filebases = [file_base(fi) for fi, sig in changed]
+            ali_index = build_ali_index(find_ali_files(self.folders), set(filebases))
+            for (fi, sig), filebase in itertools.izip(changed, filebases):
+                ali = ali_index.get(filebase)
+                try:
+                    unit, s, messages = reduce_spark_file((fi, ali["entities"] if ali else None, False, frozenset()),
+                                                          strict=True)
+                except (ValueError, IOError, OSError):
+                    # still being written: the unit is pending until it parses
+                    if fi in self.files: self._remove(fi)
+                    continue
+                for m in messages:
+                    print m
+                if fi in self.files: self._remove(fi)
+                self.files[fi] = (sig, unit, s)
+                self.units[unit] = s
+                self._account(s, 1)
+                updated.append(unit)
+        if self.start is None: self.start = (time.time(), len(self.units))
+        return updated
+
+    def expected_units(self):
+        if self.expected is not None: return self.expected
+        units = set(file2unit(fb) for fb in find_ali_files(self.folders))
+        if self.unitfilter: units = set(u for u in units if self.unitfilter.match(u))
+        return units
+
+    def progress(self):
+        """
+        (units done, units remaining, units per second, ETA in seconds or None)
+        """
+        done = len(self.units)
+        remaining = len(self.expected_units() - set(self.units))
+        t0, done0 = self.start
+        elapsed = time.time() - t0
+        rate = (done - done0) / elapsed if elapsed > 0 else 0.0
+        eta = remaining / rate if rate > 0 else None
+        return done, remaining, rate, eta
+
+    def totals(self):
+        total_rules = {}
+        for r, (cnt, proven) in self.rules.iteritems():
+            if cnt > 0: total_rules[r] = {"cnt": cnt, "proven": proven}
+        return make_totals(len(self.units), self.sums, total_rules)
+
+def format_duration(secs):
+    if secs is None: return "unknown"
+    return str(datetime.timedelta(seconds=int(secs)))
+
+def watch(folders, unitfilter, expected, interval):
+    """
+    Poll the folders every interval seconds and print what has changed, until
+    all expected units are done or the user hits Ctrl-C. Returns the watcher.
+    """
+    watcher = UnitWatcher(folders, unitfilter, expected)
+    try:
+        while True:
+            updated = watcher.poll()
+            done, remaining, rate, eta = watcher.progress()
+            if updated or remaining == 0:
+                for u in updated:
+                    s = watcher.units[u]
+                    print "  %s: coverage %.1f%%, success %.1f%% (%d/%d)" % (u, s.coverage, s.success, s.proven, s.props)
+                totals = watcher.totals()
+                print "[%s] units done: %d, remaining: %d, rate: %.1f units/min, ETA: %s; ent_cov %.1f%%, success %.1f%%" % \
+                    (time.strftime("%H:%M:%S"), done, remaining, 60 * rate, format_duration(eta),
+                     totals["ent_cov"], totals["success"])
+                sys.stdout.flush()
+            if remaining == 0 and done > 0: break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    return watcher
+
+#####################
+#  PROVER STATISTICS
+#####################
+
+def iter_attempts(tree):
+    """
+    all proof attempts in a compact tree (see compact_tree)
+    """
+    stack = list(tree)
+    while stack:
+        attempts, trans = stack.pop()
+        for a in attempts:
+            yield a
+        for subgoals in trans:
+            stack.extend(subgoals)
+
+def group_percentiles(groups, values, n_groups):
+    """
+    Nearest-rank percentiles (PERCENTILES) and maximum of the values in each
+    group, without a loop over the groups: the values are sorted by group and
+    value once, and then each percentile is picked from all groups at once.
+    Returns an array n_groups x (len(PERCENTILES) + 1); empty groups are 0.
+    """
+    order = numpy.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = numpy.bincount(groups, minlength=n_groups)
+    starts = numpy.cumsum(counts) - counts
+    nonempty = counts > 0
+    res = numpy.zeros((n_groups, len(PERCENTILES) + 1))
+    for j, q in enumerate(PERCENTILES):
+        rank = numpy.maximum(numpy.ceil(q / 100.0 * counts).astype(numpy.intp) - 1, 0)
+        res[nonempty, j] = sorted_values[(starts + rank)[nonempty]]
+    res[nonempty, -1] = sorted_values[(starts + counts - 1)[nonempty]]
+    return res
+
+def prover_statistics(abstract_units, slowest=10):
+    """
+    Per prover, and per prover and rule: number of proof attempts, how many
+    of them were valid, and percentiles and maximum of their time and steps.
+    Also the slowest VCs, by the time of all their attempts together.
+    The units must have been read with the "vcs" extra.
+    """
+    prover_ids = {}
+    rule_ids = {}
+    a_prover = []
+    a_rule = []
+    a_time = []
+    a_steps = []
+    a_valid = []
+    vc_time = []
+    vc_steps = []
+    vc_refs = []
+    for u in sorted(abstract_units):
+        for vc in abstract_units[u].vcs:
+            rid = rule_ids.setdefault(vc[0], len(rule_ids))
+            t_vc = 0.0
+            s_vc = 0
+            for prover, result, t, steps in iter_attempts(vc[6]):
+                a_prover.append(prover_ids.setdefault(prover, len(prover_ids)))
+                a_rule.append(rid)
+                a_time.append(t)
+                a_steps.append(steps)
+                a_valid.append(result == "Valid")
+                t_vc += t
+                s_vc = max(s_vc, steps)
+            vc_time.append(t_vc)
+            vc_steps.append(s_vc)
+            vc_refs.append((u, vc))
+
+    n_p = len(prover_ids)
+    n_r = len(rule_ids)
+    a_prover = numpy.array(a_prover, dtype=numpy.intp)
+    a_rule = numpy.array(a_rule, dtype=numpy.intp)
+    a_time = numpy.array(a_time, dtype=numpy.float64)
+    a_steps = numpy.array(a_steps, dtype=numpy.float64)
+    a_valid = numpy.array(a_valid, dtype=numpy.float64)
+
+    def figures(groups, n_groups):
+        cnt = numpy.bincount(groups, minlength=n_groups)
+        valid = numpy.bincount(groups, weights=a_valid, minlength=n_groups)
+        return cnt, valid, group_percentiles(groups, a_time, n_groups), group_percentiles(groups, a_steps, n_groups)
+
+    def entry(figs, g):
+        cnt, valid, times, steps = figs
+        names = ["p" + str(q) for q in PERCENTILES] + ["max"]
+        return {"count": int(cnt[g]), "valid": int(valid[g]),
+                "time": dict(zip(names, (float(v) for v in times[g]))),
+                "steps": dict(zip(names, (int(v) for v in steps[g])))}
+
+    per_prover = figures(a_prover, n_p)
+    per_rule = figures(a_prover * n_r + a_rule, n_p * n_r)
+    provers = {}
+    for p, pid in prover_ids.iteritems():
+        provers[p] = {"all": entry(per_prover, pid),
+                      "rules": {r: entry(per_rule, pid * n_r + rid) for r, rid in rule_ids.iteritems()
+                                if per_rule[0][pid * n_r + rid] > 0}}
+
+    slow = []
+    if vc_refs:
+        for i in numpy.argsort(-numpy.array(vc_time), kind='mergesort')[:slowest]:
+            u, (rule, fi, line, col, status, how, tree) = vc_refs[i]
+            slow.append({"unit": u, "file": fi, "line": line, "col": col, "rule": rule, "status": status,
+                         "time": vc_time[i], "steps": vc_steps[i]})
+    return {"provers": provers, "slowest": slow}
+
+def print_prover_statistics(pstats):
+    """
+    human-readable version of the output of prover_statistics
+    """
+    names = ["p" + str(q) for q in PERCENTILES] + ["max"]
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_cols_dtype(['t', 't', 'i', 'i'] + ['f'] * len(names) + ['i'] * len(names))
+    tab.set_precision(2)
+    rows = [["prover", "rule", "count", "valid"] + ["time_" + n for n in names] + ["steps_" + n for n in names]]
+    for p in sorted(pstats["provers"]):
+        ps = pstats["provers"][p]
+        for r, e in [("(all)", ps["all"])] + sorted(ps["rules"].iteritems()):
+            rows.append([p, r, e["count"], e["valid"]] + [e["time"][n] for n in names] + [e["steps"][n] for n in names])
+    tab.set_cols_width([max(len(unicode(r[i])) for r in rows) for i in range(len(rows[0]))])
+    tab.add_rows(rows)
+    print tab.draw()
+
+    if not pstats["slowest"]: return
+    print ""
+    print "slowest VCs:"
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_cols_dtype(['t', 't', 't', 't', 'f', 'i'])
+    tab.set_precision(2)
+    rows = [["unit", "location", "rule", "status", "time", "steps"]]
+    for v in pstats["slowest"]:
+        rows.append([v["unit"], v["file"] + ":" + str(v["line"]), v["rule"], v["status"], v["time"], v["steps"]])
+    tab.set_cols_width([max(len(unicode(r[i])) for r in rows) for i in range(len(rows[0]))])
+    tab.add_rows(rows)
+    print tab.draw()
+
+#####################
+#  BUDGET SIMULATION
+#####################
+
+class ProofLevel(object):
+    """
+    The nodes at one depth of all proof trees (see flatten_trees). Children
+    of the same node are contiguous, so that they can be reduced with reduceat.
+
+    goal_parent: per goal, index of its VC (depth 0) or of its transformation one level up
+    att_goal, att_prover, att_time, att_steps, att_valid: per attempt, sorted by goal
+    att_first: per attempt, index of the first attempt of its goal
+    trans_goal: per transformation of these goals, index of its goal
+    """
+    __slots__ = ("goal_parent", "att_goal", "att_prover", "att_time", "att_steps", "att_valid",
+                 "att_first", "trans_goal")
+
+def flatten_trees(trees, provers):
+    """
+    Flatten the compact trees (see compact_tree) of a list of VCs into arrays,
+    breadth first, one ProofLevel per depth. Only attempts of the given
+    provers are kept, in the order of the list (the order in which they run).
+    """
+    rank = dict((p, i) for i, p in enumerate(provers))
+    levels = []
+    nodes = [(v, g) for v, tree in enumerate(trees) for g in tree]
+    while nodes:
+        lv = ProofLevel()
+        att = []
+        trans_goal = []
+        children = []
+        for gi, (parent, (attempts, transformations)) in enumerate(nodes):
+            first = len(att)
+            for prover, result, t, steps in sorted((a for a in attempts if a[0] in rank), key=lambda a: rank[a[0]]):
+                att.append((gi, rank[prover], t, steps, result == "Valid", first))
+            for subgoals in transformations:
+                children.extend((len(trans_goal), sub) for sub in subgoals)
+                trans_goal.append(gi)
+        lv.goal_parent = numpy.array([parent for parent, g in nodes], dtype=numpy.intp)
+        cols = zip(*att) if att else [()] * 6
+        lv.att_goal = numpy.array(cols[0], dtype=numpy.intp)
+        lv.att_prover = numpy.array(cols[1], dtype=numpy.intp)
+        lv.att_time = numpy.array(cols[2], dtype=numpy.float64)
+        lv.att_steps = numpy.array(cols[3], dtype=numpy.float64)
+        lv.att_valid = numpy.array(cols[4], dtype=bool)
+        lv.att_first = numpy.array(cols[5], dtype=numpy.intp)
+        lv.trans_goal = numpy.array(trans_goal, dtype=numpy.intp)
+        levels.append(lv)
+        nodes = children
+    return levels
+
+def reduce_groups(ufunc, values, groups, n_groups):
+    """
+    ufunc.reduce over the rows of values which belong to the same group, for
+    groups given as sorted index per row. Empty groups get the identity.
+    """
+    res = numpy.empty((n_groups,) + values.shape[1:], dtype=values.dtype)
+    res.fill(ufunc.identity)
+    if len(groups):
+        starts = numpy.flatnonzero(numpy.r_[True, groups[1:] != groups[:-1]])
+        res[groups[starts]] = ufunc.reduceat(values, starts, axis=0)
+    return res
+
+def simulate_budgets(levels, n_vcs, timeouts, steps, provermask):
+    """
+    For a set of budgets (timeout, steps, provers; one per column), evaluate
+    which VCs would have been proven and how much prover time they would have
+    cost, using the recorded attempts:
+     - an attempt runs if its prover is enabled and no earlier attempt of the
+       same goal has succeeded. It costs its time, cut off at the timeout, and
+       scaled down if it needed more steps than allowed.
+     - it succeeds if it was valid within the timeout and steps.
+     - a goal is proven if one of its attempts succeeds, or all subgoals of one
+       of its transformations are proven. Subgoals only run if the attempts fail.
+     - a VC is proven if all of its goals are.
+    Returns (proven, cost), both of shape n_vcs x number of budgets.
+    """
+    child_proven = child_cost = None
+    for d in reversed(range(len(levels))):
+        lv = levels[d]
+        n_goals = len(lv.goal_parent)
+        enabled = provermask[:, lv.att_prover].T
+        fits = (lv.att_time[:, None] <= timeouts) & (lv.att_steps[:, None] <= steps)
+        ok = enabled & fits & lv.att_valid[:, None]
+        # successes of earlier attempts of the same goal. The running sum may
+        # wrap around in uint8, but the difference within a goal cannot.
+        before = numpy.cumsum(ok, axis=0, dtype=numpy.uint8) - ok
+        before -= before[lv.att_first]
+        scale = numpy.where(lv.att_steps[:, None] > steps, steps / numpy.maximum(lv.att_steps[:, None], 1), 1.0)
+        cost = numpy.where(enabled & (before == 0), numpy.minimum(lv.att_time[:, None] * scale, timeouts), 0.0)
+        # a goal is proven by its attempts if its last one or an earlier one succeeds
+        last = numpy.flatnonzero(numpy.r_[lv.att_goal[1:] != lv.att_goal[:-1], True]) if len(lv.att_goal) else []
+        proven = numpy.zeros((n_goals, len(timeouts)), dtype=bool)
+        proven[lv.att_goal[last]] = (before[last] + ok[last]) > 0
+        goal_cost = reduce_groups(numpy.add, cost, lv.att_goal, n_goals)
+        if len(lv.trans_goal):
+            trans_proven = reduce_groups(numpy.logical_and, child_proven, levels[d + 1].goal_parent, len(lv.trans_goal))
+            trans_cost = reduce_groups(numpy.add, child_cost, levels[d + 1].goal_parent, len(lv.trans_goal))
+            by_trans = reduce_groups(numpy.logical_or, trans_proven, lv.trans_goal, n_goals)
+            goal_cost += numpy.where(proven, 0.0, reduce_groups(numpy.add, trans_cost, lv.trans_goal, n_goals))
+            proven |= by_trans
+        child_proven, child_cost = proven, goal_cost
+    if not levels:
+        return numpy.zeros((n_vcs, len(timeouts)), dtype=bool), numpy.zeros((n_vcs, len(timeouts)))
+    vc_proven = reduce_groups(numpy.logical_and, child_proven, levels[0].goal_parent, n_vcs)
+    vc_cost = reduce_groups(numpy.add, child_cost, levels[0].goal_parent, n_vcs)
+    return vc_proven, vc_cost
+
+def default_grid(values, integer=False):
+    """
+    BUDGET_PERCENTILES (nearest rank) of the given values
+    """
+    values = numpy.sort(values)
+    if not len(values): return [0]
+    ranks = [max(int(math.ceil(q / 100.0 * len(values))) - 1, 0) for q in BUDGET_PERCENTILES]
+    grid = sorted(set(values[r] for r in ranks))
+    return [int(v) for v in grid] if integer else [float(v) for v in grid]
+
+def budget_simulation(abstract_units, provers=None, timeouts=None, steps=None):
+    """
+    Sweep a grid of budgets (all combinations of timeouts, steps and non-empty
+    subsets of provers) over the recorded proof attempts. Grid values default
+    to percentiles of the valid attempts. The units must have been read with
+    the "vcs" extra. Returns (recorded, list of budget results).
+    """
+    vcs = [vc for u in sorted(abstract_units) for vc in abstract_units[u].vcs]
+    trees = [vc[6] for vc in vcs]
+    # VCs which are verified no matter which budget: suppressed, or proven without provers
+    always = numpy.array([vc[4] == "suppressed" or (vc[4] == "proven" and not vc[6]) for vc in vcs], dtype=bool)
+    seen = set()
+    recorded_time = 0.0
+    valid_time = []
+    valid_steps = []
+    for tree in trees:
+        for prover, result, t, s in iter_attempts(tree):
+            seen.add(prover)
+            recorded_time += t
+            if result == "Valid":
+                valid_time.append(t)
+                valid_steps.append(s)
+    recorded = {"vcs": len(vcs), "proven": sum(1 for vc in vcs if vc[4] != "failed"),
+                "time": recorded_time, "provers": ",".join(sorted(seen))}
+    if provers is None: provers = sorted(seen)
+    if timeouts is None: timeouts = default_grid(valid_time)
+    if steps is None: steps = default_grid(valid_steps, integer=True)
+    levels = flatten_trees(trees, provers)
+    subsets = [c for n in range(1, len(provers) + 1) for c in itertools.combinations(range(len(provers)), n)]
+    grid = list(itertools.product(subsets, timeouts, steps))
+
+    n_att = max(1, max([len(lv.att_goal) for lv in levels] + [len(trees)]))
+    chunk = max(1, BUDGET_CELLS / n_att)
+    results = []
+    for c0 in range(0, len(grid), chunk):
+        part = grid[c0:c0 + chunk]
+        mask = numpy.zeros((len(part), len(provers)), dtype=bool)
+        for b, (subset, t, s) in enumerate(part):
+            mask[b, list(subset)] = True
+        proven, cost = simulate_budgets(levels, len(trees),
+                                        numpy.array([t for _, t, _ in part], dtype=numpy.float64),
+                                        numpy.array([s for _, _, s in part], dtype=numpy.float64), mask)
+        n_proven = (proven | always[:, None]).sum(axis=0)
+        total = cost.sum(axis=0)
+        for b, (subset, t, s) in enumerate(part):
+            results.append({"provers": ",".join(provers[i] for i in subset), "timeout": t, "steps": s,
+                            "proven": int(n_proven[b]),
+                            "success": 100.0 * n_proven[b] / len(vcs) if vcs else 100.0,
+                            "time": float(total[b]), "saved": recorded_time - float(total[b])})
+    return recorded, results
+
+def prover_contribution(abstract_units):
+    """
+    Which prover carries which proofs, from the recorded attempts (unlimited
+    time and steps, see simulate_budgets). Per prover:
+     - proven: VCs which it discharges on its own
+     - only: VCs which are lost without it
+     - time: its total time
+     - redundant_time: its time on VCs which the other provers discharge as well
+     - proven_without, time_without: VCs proven and prover time without it
+    Also the number of VCs which several provers discharge on their own, and
+    how often each set of provers is able to discharge a VC.
+    The units must have been read with the "vcs" extra.
+    """
+    trees = [vc[6] for u in sorted(abstract_units) for vc in abstract_units[u].vcs if vc[6]]
+    provers = sorted(set(a[0] for tree in trees for a in iter_attempts(tree)))
+    n_p = len(provers)
+    pid = dict((p, i) for i, p in enumerate(provers))
+    idx = []
+    times = []
+    for v, tree in enumerate(trees):
+        for a in iter_attempts(tree):
+            idx.append(v * n_p + pid[a[0]])
+            times.append(a[2])
+    vc_time = numpy.bincount(numpy.array(idx, dtype=numpy.intp), weights=times,
+                             minlength=len(trees) * n_p).reshape(len(trees), n_p)
+
+    # budgets: each prover alone, all but one prover, all provers
+    mask = numpy.vstack((numpy.eye(n_p, dtype=bool), ~numpy.eye(n_p, dtype=bool), numpy.ones((1, n_p), dtype=bool)))
+    unlimited = numpy.empty(len(mask))
+    unlimited.fill(numpy.inf)
+    proven, cost = simulate_budgets(flatten_trees(trees, provers), len(trees), unlimited, unlimited, mask)
+    alone, without, everything = proven[:, :n_p], proven[:, n_p:2 * n_p], proven[:, -1]
+
+    contrib = {}
+    for i, p in enumerate(provers):
+        contrib[p] = {"proven": int(alone[:, i].sum()),
+                      "only": int((everything & ~without[:, i]).sum()),
+                      "time": float(vc_time[:, i].sum()),
+                      "redundant_time": float(vc_time[without[:, i], i].sum()),
+                      "proven_without": int(without[:, i].sum()),
+                      "time_without": float(cost[:, n_p + i].sum())}
+    combinations = collections.Counter(",".join(provers[i] for i in numpy.flatnonzero(row))
+                                       for row in alone if row.any())
+    return {"vcs": len(trees), "proven": int(everything.sum()), "time": float(cost[:, -1].sum()),
+            "provers": contrib, "several": int((alone.sum(axis=1) > 1).sum()),
+            "combinations": dict(combinations)}
+
+def print_prover_contribution(contrib):
+    """
+    human-readable version of the output of prover_contribution
+    """
+    print "%d VCs with proof attempts, %d proven by all provers together in %.1f s" % \
+        (contrib["vcs"], contrib["proven"], contrib["time"])
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_cols_dtype(['t', 'i', 'i', 'f', 'f', 'i', 'f'])
+    tab.set_precision(1)
+    cols = ["proven", "only", "time", "redundant_time", "proven_without", "time_without"]
+    rows = [["prover"] + cols]
+    for p in sorted(contrib["provers"]):
+        rows.append([p] + [contrib["provers"][p][c] for c in cols])
+    tab.set_cols_width([max(len(unicode(r[i])) for r in rows) + 2 for i in range(len(rows[0]))])
+    tab.add_rows(rows)
+    print tab.draw()
+    print ""
+    print "proven by several provers: " + str(contrib["several"])
+    for combi, n in sorted(contrib["combinations"].iteritems(), key=lambda (c, n): (-n, c)):
+        print "  %-30s %d" % (combi, n)
+
+def pareto_frontier(results):
+    """
+    budgets for which no other budget proves as many VCs or more in less time,
+    cheapest first
+    """
+    frontier = []
+    for r in sorted(results, key=lambda r: (r["time"], -r["proven"])):
+        if not frontier or r["proven"] > frontier[-1]["proven"]:
+            frontier.append(r)
+    return frontier
+
+def print_budgets(recorded, budgets):
+    print "recorded: %d VCs, %d proven (%.1f%%), prover time %.1f s with %s" % \
+        (recorded["vcs"], recorded["proven"], 100.0 * recorded["proven"] / recorded["vcs"] if recorded["vcs"] else 100.0,
+         recorded["time"], recorded["provers"])
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_cols_dtype(['t', 'f', 'i', 'i', 'f', 'f', 'f'])
+    tab.set_precision(2)
+    rows = [["provers", "timeout", "steps", "proven", "success", "time", "saved"]]
+    for r in budgets:
+        rows.append([r["provers"], r["timeout"], r["steps"], r["proven"], r["success"], r["time"], r["saved"]])
+    tab.set_cols_width([max(len(unicode(r[i])) for r in rows) + 2 for i in range(len(rows[0]))])
+    tab.add_rows(rows)
+    print tab.draw()
+
+def print_usage_budget():
+    print __file__ + " budget [OPTION] (<gnatprove folder>)+"
+    print ''
+    print 'Simulates which VCs would have been proven, and how much prover time it'
+    print 'would have cost, with other --timeout, --steps and --prover settings,'
+    print 'from the proof attempts recorded in the *.spark files. Prints the Pareto'
+    print 'frontier of proven VCs against prover time.'
+    print ''
+    print 'OPTIONS:'
+    print '   --timeouts=T[,T]*'
+    print '          timeouts to try in seconds (default: percentiles ' + \
+        ",".join(str(q) for q in BUDGET_PERCENTILES) + ' of the valid attempts)'
+    print '   --steps=S[,S]*'
+    print '          steps to try (default: percentiles of the valid attempts)'
+    print '   --provers=P[,P]*'
+    print '          provers in the order in which gnatprove runs them; all non-empty'
+    print '          subsets are tried (default: all recorded provers)'
+    print '   --all'
+    print '          print all budgets, not only the Pareto frontier'
+    print '   --table, -t'
+    print '          print as human-readable table instead of JSON'
+    print '   --jobs=N, -j N'
+    print '          parse the *.spark files with N processes (default: number of cores)'
+    print '   --no-cache'
+    print '          neither read nor write the cache'
+
+def main_budget(argv):
+    table = False
+    jobs = 0
+    use_cache = True
+    show_all = False
+    provers = timeouts = steps = None
+    try:
+        opts, args = getopt.getopt(argv, "htj:", ["help","table","jobs=","no-cache","all","provers=","timeouts=","steps="])
+    except getopt.GetoptError:
+        print_usage_budget();
+        sys.exit(2)
+
+    try:
+        for opt, arg in opts:
+            if opt in ('-h', "--help"):
+                print_usage_budget()
+                sys.exit()
+            elif opt in ('-t', '--table'):
+                table = True
+            elif opt in ('-j', '--jobs'):
+                jobs = int(arg)
+            elif opt == '--no-cache':
+                use_cache = False
+            elif opt == '--all':
+                show_all = True
+            elif opt == '--provers':
+                provers = [p.strip() for p in arg.split(",")]
+            elif opt == '--timeouts':
+                timeouts = [float(v) for v in arg.split(",")]
+            elif opt == '--steps':
+                steps = [int(v) for v in arg.split(",")]
+    except ValueError:
+        print "ERROR: invalid number in " + opt + "=" + arg
+        return 1
+
+    if not args:
+        print_usage_budget();
+        sys.exit(2)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+
+    cache = UnitCache(args) if use_cache else None
+    unitdata = get_unit_data(args, details=False, jobs=jobs, cache=cache, extras=frozenset(["vcs"]))
+    if not unitdata: return 1
+    recorded, results = budget_simulation(unitdata, provers, timeouts, steps)
+    budgets = results if show_all else pareto_frontier(results)
+    if table:
+        print_budgets(recorded, budgets)
+    else:
+        print json.dumps({"recorded": recorded, "budgets": budgets})
+    return 0
+
+#####################
+#  RUN SUMMARIES
+#####################
+
+def make_summary(abstract_units, folders):
+    """
+    Summary of a run as written by --save: the main figures and the check
+    records of each unit. The units must have been read with the "checks" extra.
+    """
+    units = {}
+    for u, s in abstract_units.iteritems():
+        rec = {k: getattr(s, k) for k in SUMMARY_FIELDS}
+        rec["checks"] = s.checks
+        units[u] = rec
+    return {"version": SUMMARY_VERSION, "folders": folders, "settings": run_settings(folders), "units": units}
+
+def run_settings(folders):
+    """
+    contents of the _settings file (the prover options of the run), which
+    prove_all.sh writes next to the gnatprove folders it archives, or None
+    """
+    for fld in folders:
+        fi = os.path.join(os.path.dirname(os.path.abspath(fld)), "_settings")
+        if os.path.isfile(fi):
+            with open(fi) as f:
+                return f.read().strip()
+    return None
+
+def save_summary(summary, filename):
+    with open(filename, 'w') as f:
+        json.dump(summary, f)
+
+def load_run(spec, jobs, use_cache=True):
+    """
+    Summary of a run, given either as file written by --save, as comma-separated
+    list of gnatprove folders (or their tar archives), or as directory with the
+    gnatprove_* folders archived by prove_all.sh. Returns None on error.
+    """
+    if os.path.isfile(spec) and not is_archive(spec):
+        try:
+            with open(spec) as f:
+                summary = json.load(f)
+        except ValueError:
+            summary = None
+        if not isinstance(summary, dict) or summary.get("version") != SUMMARY_VERSION:
+            print "ERROR: " + spec + " is not a summary written by --save"
+            return None
+        return summary
+    folders = spec.split(",")
+    if len(folders) == 1 and os.path.isdir(spec) and not glob.glob(os.path.join(spec, "*.spark")):
+        folders = sorted(glob.glob(os.path.join(spec, "gnatprove_*"))) or folders
+    missing = [fld for fld in folders if not os.path.isdir(fld) and not is_archive(fld)]
+    if missing:
+        print "ERROR: no such folder or summary: " + ",".join(missing)
+        return None
+    cache = UnitCache(folders) if use_cache else None
+    unitdata = get_unit_data(folders, details=False, jobs=jobs, cache=cache, extras=frozenset(["checks"]))
+    return make_summary(unitdata, folders)
+
+#####################
+#  PARTIAL SUMMARIES
+#####################
+
+def make_partial(abstract_units, folders):
+    """
+    Partial summary of one shard, as written by --partial: only what the totals
+    need, i.e., the sums of TOTAL_COUNTERS, the rule statistics (in order of
+    first appearance) and the names of the units.
+
+    Partial summaries of disjoint shards merge associatively (merge_partials),
+    and partial_totals of the merged one gives the same totals as a single run
+    over all folders.
+    """
+    sums = dict.fromkeys(TOTAL_COUNTERS, 0)
+    rules = collections.OrderedDict()
+    for u, s in sorted(abstract_units.iteritems()):
+        for k in TOTAL_COUNTERS:
+            sums[k] += getattr(s, k)
+        for r in s.rules:
+            cnt, proven = rules.get(r.rule, (0, 0))
+            rules[r.rule] = (cnt + r.cnt, proven + r.proven)
+    return {"version": PARTIAL_VERSION, "folders": list(folders), "units": sorted(abstract_units),
+            "sums": sums, "rules": [[r, cnt, proven] for r, (cnt, proven) in rules.iteritems()]}
 
-# use this if you want to include modules from a subfolder
-cmd_subfolder = os.path.realpath(os.path.abspath(os.path.join(os.path.split(inspect.getfile( inspect.currentframe() ))[0],"pytexttable")))
-if cmd_subfolder not in sys.path:
-    sys.path.insert(0, cmd_subfolder)
-import texttable
+def merge_partials(partials):
+    """
+    Merge partial summaries into one. Returns it together with the units which
+    occur in more than one of them; those are counted more than once.
+    """
+    sums = dict.fromkeys(TOTAL_COUNTERS, 0)
+    rules = collections.OrderedDict()
+    folders = []
+    units = set()
+    duplicates = set()
+    for p in partials:
+        folders.extend(p["folders"])
+        for u in p["units"]:
+            if u in units: duplicates.add(u)
+            units.add(u)
+        for k in TOTAL_COUNTERS:
+            sums[k] += p["sums"][k]
+        for r, cnt, proven in p["rules"]:
+            c, pr = rules.get(r, (0, 0))
+            rules[r] = (c + cnt, pr + proven)
+    merged = {"version": PARTIAL_VERSION, "folders": folders, "units": sorted(units),
+              "sums": sums, "rules": [[r, cnt, proven] for r, (cnt, proven) in rules.iteritems()]}
+    return merged, sorted(duplicates)
 
-#######################################
-#     GLOBAL CONSTANTS
-#######################################
-GNATINSPECT="gnatinspect"
-KNOWN_SORT_CRITERIA = ('alpha', 'coverage', 'success', 'props', 'ents', 'skip');
+def partial_totals(partial):
+    """
+    totals of a (merged) partial summary, as printed after TOTALS:
+    """
+    total_rules = {}
+    for r, cnt, proven in partial["rules"]:
+        total_rules[r] = {"cnt": cnt, "proven": proven}
+    return make_totals(len(partial["units"]), partial["sums"], total_rules)
 
-#######################################
-#     GLOBAL VARIABLES
-#######################################
-# used to suppress output from subprocesses
-FNULL = open(os.devnull, 'w')
+def load_partial(filename):
+    """
+    partial summary written by --partial or merge --output, None on error
+    """
+    try:
+        with open(filename) as f:
+            partial = json.load(f)
+    except (IOError, ValueError) as e:
+        print "ERROR: cannot read " + filename + ": " + str(e)
+        return None
+    if not isinstance(partial, dict) or partial.get("version") != PARTIAL_VERSION:
+        print "ERROR: " + filename + " is not a partial summary written by --partial"
+        return None
+    return partial
 
-#######################################
-#     FUNCTION DEFINITIONS
-#######################################
+def save_partial(partial, filename):
+    tmpfile = filename + ".tmp"
+    with open(tmpfile, 'w') as f:
+        json.dump(partial, f)
+    os.rename(tmpfile, filename)
 
-def file2unit(filename):
+def print_usage_merge():
+    print __file__ + " merge [OPTION] (<partial summary>)+"
+    print ''
+    print 'Merges the partial summaries written with --partial=<file> for several shards'
+    print '(e.g., the gnatprove folders of different build hosts) and prints their totals,'
+    print 'as a single run over all folders would. The shards must not share units.'
+    print ''
+    print 'OPTIONS:'
+    print '   --output=FILE'
+    print '          also write the merged partial summary to FILE, which can be merged again'
+    print '   --table, -t'
+    print '          print human-readable instead of JSON'
+
+def main_merge(argv):
+    table = False
+    outfile = None
+    try:
+        opts, args = getopt.getopt(argv, "ht", ["help","table","output="])
+    except getopt.GetoptError:
+        print_usage_merge();
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage_merge()
+            sys.exit()
+        elif opt in ('-t', '--table'):
+            table = True
+        elif opt == '--output':
+            outfile = arg
+
+    if not args:
+        print_usage_merge();
+        sys.exit(2)
+    partials = [load_partial(fi) for fi in args]
+    if None in partials: return 1
+    merged, duplicates = merge_partials(partials)
+    if duplicates:
+        print "WARNING: units in more than one shard are counted more than once: " + ",".join(duplicates)
+    if outfile:
+        save_partial(merged, outfile)
+    print "TOTALS:"
+    if table:
+        pprint.pprint(partial_totals(merged))
+    else:
+        print json.dumps(partial_totals(merged))
+    return 0
+
+#####################
+#  DIFF
+#####################
+
+def keyed_checks(checks):
     """
-    transform file name into GNAT unit name
+    yields (key, status) for each check record, where the key is its kind,
+    rule and location. Checks with the same key are numbered in order of
+    appearance, so that they can be joined one by one.
     """
-    unitname = os.path.splitext(filename)[0]
-    unitname = unitname.replace("-",".")
-    return unitname.lower()
+    seen = {}
+    for c in checks:
+        loc = tuple(c[:5])
+        n = seen.get(loc, 0)
+        seen[loc] = n + 1
+        yield loc + (n,), c[5]
+
+def diff_runs(old, new):
+    """
+    Compare two run summaries by a hash join of their checks on (unit, kind,
+    rule, location). Runs in time linear in the number of checks.
 
-def get_json_data(folders):
+    Reports units added/removed, checks which fail now but did not before
+    (including new ones), checks which failed before and are verified now,
+    and units whose figures (DIFF_FIELDS) changed.
     """
-    Parses all *.spark files in the given directory and
-    creates statistics for them
+    ou, nu = old["units"], new["units"]
+    diff = {"units_added": sorted(u for u in nu if u not in ou),
+            "units_removed": sorted(u for u in ou if u not in nu),
+            "newly_failing": [], "newly_proven": [], "changed": [],
+            "checks_added": 0, "checks_removed": 0}
+    for u in sorted(nu):
+        if u not in ou: continue
+        o, n = ou[u], nu[u]
+        changes = [(k, [o[k], n[k]]) for k in DIFF_FIELDS if o[k] != n[k]]
+        if changes:
+            diff["changed"].append(dict([("unit", u)] + changes))
+
+        before = dict(keyed_checks(o["checks"]))
+        for key, status in keyed_checks(n["checks"]):
+            was = before.pop(key, None)
+            if was is None:
+                diff["checks_added"] += 1
+                was = "absent"
+            if was == status: continue
+            rec = {"unit": u, "kind": key[0], "rule": key[1], "file": key[2],
+                   "line": key[3], "col": key[4], "was": was, "now": status}
+            if status == "failed":
+                diff["newly_failing"].append(rec)
+            elif was == "failed":
+                diff["newly_proven"].append(rec)
+        diff["checks_removed"] += len(before)
+    return diff
+
+def print_diff(diff):
     """
-    d={}
-    for folder in folders:
-        prefix = "" # file2unit(folder)
-        if prefix: prefix = prefix + "."
-        for filename in glob.glob(os.path.join(folder, '*.spark')):
-            filebase = os.path.splitext(os.path.basename(filename))[0]
-            unit = prefix + file2unit(filebase)
-            try:
-                with open(filename) as f:
-                    contents = json.load(f)
-            except:
-                contents = {}
-
-            # we get three sections:
-            # 1) "spark" : that gives us the coverage. list of dicts.
-            #              each item has {"spark": <all|spec|no>, "name" : <name>, "sloc" : [{"file": .., "line": ..}]}.
-            #              If <name>=unit, then it's the package itself. Package with spark=spec means body not in SPARK mode
-            #
-            # 2) "flow" : flow analysis results. list of dicts.
-            #             each item has {"file": .., "line": .., "col": .., "rule": .., "severity": .., "entity": {"name": .., "sloc": [{}]}, "tracefile": .., "msg_id": .., "how_proved": ..}
-            #
-            # 3) "proof" : prover results. list of dicts
-            #             each item has the same as flow, but additionally {"cntexmp":{}, "suppressed" : <string>}. Here, rule=<VC_PRECONDITION|VC_DISCRIMINANT_CHECK|...>
-            #
-            # 4) "assumptions" : not interesting here. we remove it.
-            #
-            # Thus, coverage comes from "spark", success comes from "proof"
+    human-readable version of the output of diff_runs
+    """
+    print "units added (" + str(len(diff["units_added"])) + "): " + ", ".join(diff["units_added"])
+    print "units removed (" + str(len(diff["units_removed"])) + "): " + ", ".join(diff["units_removed"])
+    print "checks added: " + str(diff["checks_added"]) + ", removed: " + str(diff["checks_removed"])
+    for what in ("newly_failing", "newly_proven"):
+        recs = diff[what]
+        print ""
+        print what.replace("_", " ") + " (" + str(len(recs)) + "):"
+        if not recs: continue
+        tab = texttable.Texttable()
+        tab.set_deco(texttable.Texttable.HEADER)
+        tab.set_cols_dtype(['t'] * 5)
+        tab.set_cols_width([max(len(r["unit"]) for r in recs), 30, 30, 10, 10])
+        tab.add_rows([["unit", "location", "rule", "was", "now"]] +
+                     [[r["unit"], r["file"] + ":" + str(r["line"]) + ":" + str(r["col"]),
+                       r["rule"], r["was"], r["now"]] for r in recs])
+        print tab.draw()
+    print ""
+    print "changed units (" + str(len(diff["changed"])) + "):"
+    if diff["changed"]:
+        tab = texttable.Texttable()
+        tab.set_deco(texttable.Texttable.HEADER)
+        tab.set_cols_dtype(['t'] * 4)
+        tab.set_cols_width([max(len(c["unit"]) for c in diff["changed"]), 15, 10, 10])
+        rows = [["unit", "figure", "old", "new"]]
+        for c in diff["changed"]:
+            for k in DIFF_FIELDS:
+                if k in c:
+                    old, new = c[k]
+                    rows.append([c["unit"], k, "%.1f" % old, "%.1f" % new])
+        tab.add_rows(rows)
+        print tab.draw()
+
+def print_usage_diff():
+    print __file__ + " diff [OPTION] <old run> <new run>"
+    print ''
+    print 'Compares two runs check by check. A run is either a summary written with'
+    print '--save=FILE, a comma-separated list of gnatprove folders, or a directory with'
+    print 'gnatprove_* folders as archived by prove_all.sh.'
+    print ''
+    print 'OPTIONS:'
+    print '   --table, -t'
+    print '          print as human-readable tables instead of JSON'
+    print '   --jobs=N, -j N'
+    print '          parse the *.spark files with N processes (default: number of cores)'
+    print '   --no-cache'
+    print '          neither read nor write the cache'
+
+def main_diff(argv):
+    table = False
+    jobs = 0
+    use_cache = True
+    try:
+        opts, args = getopt.getopt(argv, "htj:", ["help","table","jobs=","no-cache"])
+    except getopt.GetoptError:
+        print_usage_diff();
+        sys.exit(2)
 
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage_diff()
+            sys.exit()
+        elif opt in ('-t', '--table'):
+            table = True
+        elif opt in ('-j', '--jobs'):
             try:
-                contents.pop("assumptions", None)
-            except:
-                pass
-            d[unit] = contents
-            d[unit]["filebase"] = filebase
-    return d
+                jobs = int(arg)
+            except ValueError:
+                print "Number of jobs '" + arg + "' invalid"
+        elif opt == '--no-cache':
+            use_cache = False
+
+    if len(args) != 2:
+        print_usage_diff();
+        sys.exit(2)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+
+    runs = [load_run(spec, jobs, use_cache) for spec in args]
+    if None in runs: return 1
+    diff = diff_runs(runs[0], runs[1])
+    if table:
+        print_diff(diff)
+    else:
+        print json.dumps(diff)
+    return 0
 
+#####################
+#  FLAKY PROOFS
+#####################
 
-def add_unitentities(jsondata, prjfile, folders):
+def flaky_checks(runs, ignore_settings=False):
     """
-    For all units in the project, get list of entities.
+    Checks which are proven in some runs and fail in others with the same
+    settings. The runs of each settings group are joined on the fingerprints
+    of their checks through one hash table, in time linear in the number of
+    checks of all runs.
 
-    We wanted to use gnatinspect, but it does not give us what we need. We would have to
-    give all included project files to it, since flag --runtime does not work as intended.
-    Probably we should handover -Pp1.gpr,p2.gpr,... to this script, and then let 
-    gprbuild or someone figure out object dirs. Then we could use the gpr files here
+    Returns one record per flaky check, located as in the last run which has
+    it, with the status in each run of its group ("absent" if it has none).
+    """
+    groups = collections.OrderedDict()
+    for i, run in enumerate(runs):
+        groups.setdefault(None if ignore_settings else run.get("settings"), []).append(i)
+    flaky = []
+    for settings, members in groups.iteritems():
+        if len(members) < 2: continue
+        table = {} # fingerprint -> [status in each run, unit, check record]
+        for k, i in enumerate(members):
+            for u, rec in runs[i]["units"].iteritems():
+                for c in rec["checks"]:
+                    entry = table.get(c[7])
+                    if entry is None:
+                        entry = table[c[7]] = [["absent"] * len(members), u, c]
+                    entry[0][k] = c[5]
+                    entry[1] = u
+                    entry[2] = c
+        for fp, (statuses, u, c) in table.iteritems():
+            proven = statuses.count("proven")
+            failed = statuses.count("failed")
+            if proven and failed:
+                flaky.append({"fingerprint": fp, "unit": u, "kind": c[0], "rule": c[1], "file": c[2],
+                              "line": c[3], "col": c[4], "runs": [runs[i]["label"] for i in members],
+                              "status": statuses, "proven": proven, "failed": failed, "settings": settings})
+    flaky.sort(key=operator.itemgetter("unit", "file", "line", "col", "rule"))
+    return flaky
 
-    For now, we parse the ALI files, which are in our main project's object dir. Advantage
-    is, that there we find also the ALI files of included projects.
+def print_flaky(flaky):
+    """
+    human-readable version of the output of flaky_checks; one letter per run
+    (p=proven, f=failed, s=suppressed, -=absent)
     """
+    if not flaky:
+        print "no flaky checks"
+        return
+    tab = texttable.Texttable()
+    tab.set_deco(texttable.Texttable.HEADER)
+    tab.set_cols_dtype(['t'] * 5)
+    tab.set_cols_width([max(len("unit"), max(len(r["unit"]) for r in flaky)), 30, 25, 7,
+                        max(len("runs"), max(len(r["status"]) for r in flaky))])
+    tab.add_rows([["unit", "location", "rule", "proven", "runs"]] +
+                 [[r["unit"], r["file"] + ":" + str(r["line"]) + ":" + str(r["col"]), r["rule"],
+                   str(r["proven"]) + "/" + str(len(r["status"])),
+                   "".join("-" if st == "absent" else st[0] for st in r["status"])] for r in flaky])
+    print tab.draw()
+    print str(len(flaky)) + " flaky checks"
 
-    def get_entities_of_unit(filebase):
-        """
-        compile a list of entities in this unit
+def print_usage_flaky():
+    print __file__ + " flaky [OPTION] (<run>)+"
+    print ''
+    print 'Finds checks which are proven in some runs but not in others with the same settings,'
+    print 'i.e., nondeterministic proofs. Checks are matched by fingerprints built from unit,'
+    print 'rule, entity, file and column, and their rank among such checks, so that shifted'
+    print 'lines do not matter. A run is a summary written with --save=FILE, a comma-separated'
+    print 'list of gnatprove folders, or a directory with gnatprove_* folders as archived by'
+    print 'prove_all.sh. Runs are grouped by the _settings file which prove_all.sh writes there.'
+    print ''
+    print 'OPTIONS:'
+    print '   --ignore-settings'
+    print '          compare all runs with each other, regardless of their settings'
+    print '   --table, -t'
+    print '          print as human-readable table instead of JSON'
+    print '   --jobs=N, -j N'
+    print '          parse the *.spark files with N processes (default: number of cores)'
+    print '   --no-cache'
+    print '          neither read nor write the cache'
 
-        Not perfect, either. When a generic package is instantiated, then all functions which are not 
-        public are in the ALI file of the instantiating unit, but those with spec are not.
+def main_flaky(argv):
+    table = False
+    jobs = 0
+    use_cache = True
+    ignore_settings = False
+    try:
+        opts, args = getopt.getopt(argv, "htj:", ["help","table","jobs=","no-cache","ignore-settings"])
+    except getopt.GetoptError:
+        print_usage_flaky();
+        sys.exit(2)
 
-        """
-        # def get_gnatinspect_result(filename):
-        #     """
-        #     Query entities of single file. This only works when the project actually contains the file
-        #     without indirections.
-        #     """
-        #     global GNATINSPECT
-        #     cmd = GNATINSPECT + " -P" + prjfile + ' --command="entities ' + filename + '"'
-        #     print "cmd=" + cmd
-        #     success = True
-        #     try:
-        #         ret = subprocess.check_output(cmd, stdin=FNULL, stderr=FNULL, shell=True)
-        #     except subprocess.CalledProcessError as e:
-        #         ret = e.output
-        #         success = False
-            
-        #     print "success=" + str(success) + ", ret=" + str(ret)
-
-        #     # TODO: turn ret into a dict
-        #     d=ret
-        #     return d
-
-        # # first spec file
-        # ents_spec = get_gnatinspect_result(filebase + ".ads")
-        # print "ents in spec of " + unit["filebase"] + "=" + str(ents_spec)
-        
-        # # then body file
-        # ents_body = get_gnatinspect_result(filebase + ".adb")
-
-        def parse_ali_file(filebase):
-            """
-            Pull entities from ALI file
-            """
-            def decode_type(t):
-                """
-                verbose type from ALI symbol. See lib-xref.ads
-                Only handles those with would appear in *.spark files
-                
-                Bodies of functions will not appear in SPARK, only specs.
-                Task types will not appear in SPARK, only objects
-                packages will appear
-                """
-                typ = None
-                if t == 'K':
-                    typ = "package" # used also for generic instances
-                #elif t == 'T':
-                #    typ = "task type"
-                elif t == 't':
-                    typ = "task object"
-                #elif t == 'W':
-                #    typ = "protected type"
-                #elif t == 'w':
-                #    typ = 'protected object'
-                #elif t == ' ':
-                #    typ = "subprogram type"
-                elif t == 'V':
-                    typ = "function"
-                #elif t == 'v':
-                #    typ = "generic function" # becomes a function where used, does not appear in SPARK file
-                elif t == 'U':
-                    typ = 'procedure'
-                #elif t == 'u':
-                #    typ = "generic procedure" # same here
-                elif t == 'y':
-                    typ = "abstract function"
-                elif t == 'x':
-                    typ = "abstract procedure"
-                return typ
-            
-            d=[]
-            notfound = True
-            files = [fld + os.sep + filebase + ".ali" for fld in folders]
-            active = False
-            spec = False
-            body = False
-            for fi in files:
-                try:
-                    with open (fi) as f:                        
-                        for line in f:
-                            match = re.search(r"^X \d+ ([^\s]+)\.(ads|adb)", line)
-                            if match:
-                                active = True if match.group(1) == filebase else False
-                                ext = match.group(2)
-                                spec = True if match.group(2) == "ads" else False
-                                body = True if match.group(2) == "adb" else False
-                                continue
-                            
-                            if active:
-                                # line type col level entity
-                                if spec and not body:
-                                    where = "ads"
-                                elif body and not spec:
-                                    where = "adb"
-                                else:
-                                    where = "unknown"
-                                match = re.search(r"^(\d+)(\w)(\d+).(\w+)", line)
-                                if match:
-                                    ent_line = int (match.group(1))
-                                    ent_type = decode_type (match.group(2))
-                                    ent_col = int (match.group(3))
-                                    ent_id = match.group(4)
-                                    filename = filebase + "." + where
-                                    if ent_type:
-                                        #print ent_id + " @" + str(ent_line) + ", type=" + ent_type
-                                        d.append({'name':ent_id, 'file':filename, 'line':ent_line, 'col':ent_col, 'type': ent_type, 'type_orig':match.group(2)})
-
-                    notfound = False
-                    break                
-                except:
-                    pass
-            if notfound:
-                print "WARNING: " + filebase + ".ali nowhere found"
-                pass
-            return d
-        
-        # parse ALI file
-        ents = parse_ali_file (filebase)
-        return ents
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage_flaky()
+            sys.exit()
+        elif opt in ('-t', '--table'):
+            table = True
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                print "Number of jobs '" + arg + "' invalid"
+        elif opt == '--no-cache':
+            use_cache = False
+        elif opt == '--ignore-settings':
+            ignore_settings = True
+
+    if len(args) < 2:
+        print_usage_flaky();
+        sys.exit(2)
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+
+    runs = []
+    for spec in args:
+        run = load_run(spec, jobs, use_cache)
+        if run is None: return 1
+        if any(len(c) < 8 for rec in run["units"].itervalues() for c in rec["checks"]):
+            print "ERROR: " + spec + " has no fingerprints; write the summary again with --save"
+            return 1
+        run["label"] = spec
+        runs.append(run)
+    flaky = flaky_checks(runs, ignore_settings)
+    if table:
+        print_flaky(flaky)
+    else:
+        print json.dumps(flaky)
+    return 0
+
+#####################
+#  HISTORY
+#####################
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, tag TEXT, timestamp TEXT, revision TEXT, folders TEXT);
+CREATE TABLE IF NOT EXISTS units (run INTEGER NOT NULL REFERENCES runs(id), unit TEXT NOT NULL, %s,
+                                  PRIMARY KEY (run, unit));
+CREATE TABLE IF NOT EXISTS rules (run INTEGER NOT NULL REFERENCES runs(id), unit TEXT NOT NULL, rule TEXT NOT NULL,
+                                  cnt INTEGER, proven INTEGER);
+CREATE INDEX IF NOT EXISTS runs_by_tag ON runs (tag, id);
+CREATE INDEX IF NOT EXISTS units_by_unit ON units (unit, run);
+CREATE INDEX IF NOT EXISTS rules_by_rule ON rules (rule, run, cnt, proven); -- covers the rule queries
+CREATE INDEX IF NOT EXISTS rules_by_run ON rules (run, unit);
+""" % ", ".join(f + " REAL" for f in HISTORY_UNIT_FIELDS)
 
-    json_with_ent = copy.copy(jsondata)
-    for u,uinfo in jsondata.iteritems():
-        json_with_ent[u]["entities"] = get_entities_of_unit (uinfo["filebase"])
-    #pprint.pprint(json_with_ent["helper"])
-    #exit(42)
-    return json_with_ent
+def open_history(dbfile):
+    conn = sqlite3.connect(dbfile)
+    conn.executescript(HISTORY_SCHEMA)
+    return conn
 
-def get_statistics(jsondata, sorting, exclude, include, details):
+def git_revision(path):
     """
-    Turn the JSON data into an abstract summary.
+    revision of the git repository containing path, or None
     """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=path, stderr=FNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
 
-    #################
-    # ABSTRACT DATA
-    #################
-    # we summarize the list of proofs into stats, and then keep only that
-    abstract_units = {}
-    for u,uinfo in jsondata.iteritems():
-        # GET COVERAGE
-        c = 0 # entities covered
-        s = 0 # entities skipped (incl.
-        n_spark = 0 # entities total (including specs
-        n_ent = len(uinfo['entities'])
-        if "spark" in uinfo:
-            for sub in uinfo["spark"]:
-                is_package = True if sub["name"].lower() == u.lower() else False
-                is_covered = True if sub["spark"] == "all" else False
-                is_spec = True if sub["spark"] == "spec" else False
-                if is_covered: c = c + 1
-                if is_spec: s = s + 1 # that is half-way covered
-                n_spark = n_spark + 1
-        if not (n_spark <= n_ent):
-            print "WARNING: Total number of entities in ALI file (" + str(n_ent) + ") is less than number of entities found by GNATprove (" + str(n_spark) + "); please check: " + u
-            #pprint.pprint (uinfo)
-            #exit(42)
-            n_ent = n_spark
-        abstract_units[u]={}
-        abstract_units[u]["ents"] = n_ent
-        abstract_units[u]["spec"] = s
-        abstract_units[u]["body"] = c
-        abstract_units[u]["skip"] = n_ent - c - s
-        abstract_units[u]["coverage"] = (100*float(c) / n_ent) if n_ent > 0 else 0
-        abstract_units[u]["coverage_spec"] = (100*float(c+s) / n_ent) if n_ent > 0 else 0
-
-        # ents: number of entities
-        # spec: number of entities where spec is in SPARK
-        # body: number of entities where body is in SPARK
-        # skip: number of entities where SPARK is off
-        # coverage: number of entities where body in in SPARK divided by number of entities
-        # coverage_spec: number of entities where at least spec in in SPARK divided by number of entities
-        
-        # GET SUCCESS of PROOF
-        rule_stats={}
-        p = 0
-        ig = 0
-        n = 0
-        if "proof" in uinfo:
-            n = len(uinfo["proof"])
-            for proof in uinfo["proof"]:
-                is_suppressed = True if "suppressed" in proof else False
-                is_verified = True if proof["severity"]=="info" else (True if "suppressed" in proof else False)
-                rule = proof["rule"]
-                if is_verified: p = p + 1
-                if is_suppressed : ig = ig + 1
-                if not rule in rule_stats:
-                    rule_stats[rule]={"cnt": 0, "proven":0}
-                rule_stats[rule]["cnt"] += 1
-                rule_stats[rule]["proven"] += 1 if is_verified else 0            
-                if details:
-                    lid = { k:v for k,v in proof.iteritems() if k in ('file','line','col','rule','severity','how_proved','check_tree')}
-                    abstract_units[u].setdefault("details_proofs",[]).append(lid)
-                
-        abstract_units[u]["props"] = n
-        abstract_units[u]["rules"] = rule_stats
-        abstract_units[u]["proven"] = p
-        abstract_units[u]["success"] = (100*float(p) / n) if n > 0 else 100.0
-        abstract_units[u]["suppressed"] = ig
-
-        # GET SUCCESS of FLOW
-        rule_stats={}
-        f = 0
-        ig = 0
-        if "flow" in uinfo:
-            n = len(uinfo["flow"])
-            for flow in uinfo["flow"]:
-                is_suppressed = True if "suppressed" in flow else False
-                is_verified = True if flow["severity"]=="info" else is_suppressed
-                rule = flow["rule"]
-                if is_verified: f = f + 1
-                if is_suppressed : ig = ig + 1
-                if not rule in rule_stats:
-                    rule_stats[rule]={"cnt": 0, "proven":0}
-                rule_stats[rule]["cnt"] += 1
-                rule_stats[rule]["proven"] += 1 if is_verified else 0
-                if details:
-                    lid = { k:v for k,v in flow.iteritems() if k in ('file','line','col','rule','severity')}
-                    abstract_units[u].setdefault("details_flows",[]).append(lid)
-
-        abstract_units[u]["flows"] = n
-        abstract_units[u]["flows_proven"] = f
-        abstract_units[u]["flows_suppressed"] = ig
-        abstract_units[u]["flows_success"] = (100*float(f) / n) if n > 0 else 100.0
-
-        # carry over entities
-        if details:
-            abstract_units[u]["entities"] = uinfo["entities"]
-        
-        # merge rules
-        for r,s in rule_stats.iteritems():
-            if not r in abstract_units[u]["rules"]:
-                abstract_units[u]["rules"][r] = s
-            else:
-                # merge
-                for k,v in s.iteritems():
-                    if not k in abstract_units[u]["rules"][r]:
-                        abstract_units[u]["rules"][k]=v
-                    else:
-                        abstract_units[u]["rules"][k]+=v
-                        
-        ###########
-        # SORTING
-        ###########        
-        if "details_proofs" in abstract_units[u]:
-            abstract_units[u]["details_proofs"].sort(key=operator.itemgetter('file','line','col','rule'))
-        if "details_flows" in abstract_units[u]:
-            abstract_units[u]["details_flows"].sort(key=operator.itemgetter('file','line','col','rule'))            
-
-
-    ################
-    # FILTER UNITS
-    ################
-    if exclude and not include:
-		# filter away partial matches
-        tmp = abstract_units
-        abstract_units = {u: uinfo for u,uinfo in tmp.iteritems() if not any(substring in u for substring in exclude) }
-    elif include and not exclude:
-		# only keep perfect matches
-		tmp = abstract_units
-		abstract_units = {u: uinfo for u,uinfo in tmp.iteritems() if u in include }
-
-        
-    ##########
-    # TOTALS
-    ##########
-    # ent_cov: number of entities with body in spark divided number of entities
-    # ent_cov_spec: number of entities with at least spec in spark divided number of entities
-    # unit_cov: deprecated. unweighted average of individual unit coverages. but unweighted is unfair.
-    totals={}
-    totals["units"] = len(abstract_units)
-    totals["ents"] = sum([v["ents"] for k,v in abstract_units.iteritems()])
-    totals["props"] = sum([v["props"] for k,v in abstract_units.iteritems()])
-    totals["suppressed"] = sum([v["suppressed"] for k,v in abstract_units.iteritems()])
-    totals["proven"] = sum([v["proven"] for k,v in abstract_units.iteritems()])
-    totals["spec"] = sum([v["spec"] for k,v in abstract_units.iteritems()])
-    totals["skip"] = sum([v["skip"] for k,v in abstract_units.iteritems()])
-    #totals["unit_cov"] = (sum([v["coverage"] for k,v in abstract_units.iteritems()]) / totals["units"]) if totals["units"] > 0 else 0
-    totals["ent_cov"] = (100*(float(totals["ents"] - totals["skip"] - totals["spec"])) / totals["ents"]) if totals["ents"] > 0 else 0
-    totals["ent_cov_spec"] = (100*(float(totals["ents"] - totals["skip"])) / totals["ents"]) if totals["ents"] > 0 else 0
-    totals["success"] = (100*(float(totals["proven"]) / totals["props"])) if totals["props"] > 0 else 0
-    totals["flows"] = sum([v["flows"] for k,v in abstract_units.iteritems()])
-    totals["flows_proven"] = sum([v["flows_proven"] for k,v in abstract_units.iteritems()])
-    totals["flows_suppressed"] = sum([v["flows_suppressed"] for k,v in abstract_units.iteritems()])
-    totals["flows_success"] = (100*(float(totals["flows_proven"]) / totals["flows"])) if totals["flows"] > 0 else 0
-    # merge down rules (I know...ugly. But there is no faster and equally readable way)
-    total_rules = {}
-    for u,uinfo in abstract_units.iteritems():
-        for r,stat in uinfo["rules"].iteritems():
-            if not r in total_rules:
-                total_rules[r]=dict(stat) # deep copy of entire rule
-            else:
-                # rule exists. accumulate individual keys
-                for k,v in stat.iteritems():
-                    if not k in total_rules[r]: # k=cnt,proven,...
-                        total_rules[r][k]= v # copy
-                    else:
-                        total_rules[r][k]+=v
-    totals["rules"] = total_rules    
-    
-    #################
-    #  SORT
-    #################
-    tmp = [{k : v} for k,v in abstract_units.iteritems()]
-    def keyfunc(tup):
-        key, d = tup.iteritems().next()
-        tmp = [s for s in sorting if s != "alpha"]
-        order = [d[t] for t in tmp]
-        return order
-    if "alpha" in sorting:
-        sorted_abstract_units = sorted(tmp, key=lambda x: x)
+def record_run(dbfile, abstract_units, tag, revision, folders):
+    """
+    Append the unit and rule statistics of one run to the history database,
+    in one transaction. Returns the id of the run.
+    """
+    conn = open_history(dbfile)
+    try:
+        with conn:
+            cur = conn.execute("INSERT INTO runs (tag, timestamp, revision, folders) VALUES (?,?,?,?)",
+                               (tag, datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), revision,
+                                ",".join(folders)))
+            run = cur.lastrowid
+            conn.executemany("INSERT INTO units (run, unit, %s) VALUES (?,?,%s)" %
+                             (", ".join(HISTORY_UNIT_FIELDS), ",".join("?" * len(HISTORY_UNIT_FIELDS))),
+                             ((run, u) + tuple(getattr(s, f) for f in HISTORY_UNIT_FIELDS)
+                              for u, s in abstract_units.iteritems()))
+            conn.executemany("INSERT INTO rules (run, unit, rule, cnt, proven) VALUES (?,?,?,?,?)",
+                             ((run, u, r.rule, r.cnt, r.proven)
+                              for u, s in abstract_units.iteritems() for r in s.rules))
+    finally:
+        conn.close()
+    return run
+
+def query_history(conn, unit=None, rule=None, tag=None, last=HISTORY_LAST, regressions=False):
+    """
+    Trend over the last runs (optionally only those with the given tag), oldest first:
+     - unit: figures of that unit in each run
+     - rule: number of checks and proven checks of that rule in each run
+     - neither: totals of each run
+    With regressions, only rows are returned where the number of unproven checks
+    of a rule increased w.r.t. the previous run (of all rules, if none is given).
+    Returns (column names, rows).
+    """
+    runs = "SELECT id FROM runs" + (" WHERE tag = ?" if tag is not None else "") + " ORDER BY id DESC LIMIT ?"
+    args = ([tag] if tag is not None else []) + [last]
+    runcols = ["run", "tag", "timestamp", "revision"]
+    select = "SELECT r.id, r.tag, r.timestamp, r.revision, "
+
+    if regressions or rule is not None:
+        cols = ["rule", "cnt", "proven"]
+        sql = select + "x.rule, SUM(x.cnt), SUM(x.proven) FROM rules x JOIN runs r ON r.id = x.run " \
+              "WHERE x.run IN (" + runs + ")"
+        if rule is not None:
+            sql += " AND x.rule = ?"
+            args.append(rule)
+        if unit is not None:
+            sql += " AND x.unit = ?"
+            args.append(unit)
+        rows = conn.execute(sql + " GROUP BY x.run, x.rule ORDER BY x.rule, x.run", args).fetchall()
+        if regressions:
+            unproven = {}
+            regressed = []
+            for row in rows:
+                prev = unproven.get(row[4])
+                unproven[row[4]] = row[5] - row[6]
+                if prev is not None and row[5] - row[6] > prev: regressed.append(row)
+            rows = regressed
+        rows.sort(key=operator.itemgetter(0))
+    elif unit is not None:
+        cols = list(HISTORY_UNIT_FIELDS)
+        sql = select + ", ".join("u." + f for f in cols) + " FROM units u JOIN runs r ON r.id = u.run " \
+              "WHERE u.unit = ? AND u.run IN (" + runs + ") ORDER BY r.id"
+        rows = conn.execute(sql, [unit] + args).fetchall()
     else:
-        sorted_abstract_units = sorted(tmp, key=keyfunc, reverse=True)
+        cols = ["units", "ents", "coverage", "props", "proven", "success"]
+        sql = select + "COUNT(*), SUM(u.ents), 100.0 * SUM(u.body) / SUM(u.ents), SUM(u.props), SUM(u.proven), " \
+              "100.0 * SUM(u.proven) / SUM(u.props) FROM units u JOIN runs r ON r.id = u.run " \
+              "WHERE u.run IN (" + runs + ") GROUP BY r.id ORDER BY r.id"
+        rows = conn.execute(sql, args).fetchall()
+    return runcols + cols, rows
 
-    return totals, sorted_abstract_units
+def print_usage_history():
+    print __file__ + " history [OPTION] <database>"
+    print ''
+    print 'Queries the history database written with --history=<database>.'
+    print 'Without --unit/--rule, prints the totals of each run.'
+    print ''
+    print 'OPTIONS:'
+    print '   --unit=U'
+    print '          figures of unit U in each run'
+    print '   --rule=R'
+    print '          number of checks and proven checks of rule R in each run (of unit U, if given)'
+    print '   --regressions'
+    print '          only runs where the number of unproven checks of a rule (of R, if given) increased'
+    print '   --tag=T'
+    print '          only runs with tag T'
+    print '   --last=N'
+    print '          only the last N runs (default ' + str(HISTORY_LAST) + ')'
+    print '   --table, -t'
+    print '          print as human-readable table instead of JSON'
 
-def print_table(units,filtercols):
+def main_history(argv):
+    table = False
+    unit = None
+    rule = None
+    tag = None
+    last = HISTORY_LAST
+    regressions = False
+    try:
+        opts, args = getopt.getopt(argv, "ht", ["help","table","unit=","rule=","tag=","last=","regressions"])
+    except getopt.GetoptError:
+        print_usage_history();
+        sys.exit(2)
+
+    for opt, arg in opts:
+        if opt in ('-h', "--help"):
+            print_usage_history()
+            sys.exit()
+        elif opt in ('-t', '--table'):
+            table = True
+        elif opt == '--unit':
+            unit = arg
+        elif opt == '--rule':
+            rule = arg
+        elif opt == '--tag':
+            tag = arg
+        elif opt == '--regressions':
+            regressions = True
+        elif opt == '--last':
+            try:
+                last = int(arg)
+            except ValueError:
+                print "Number of runs '" + arg + "' invalid"
+
+    if len(args) != 1:
+        print_usage_history();
+        sys.exit(2)
+    if not os.path.isfile(args[0]):
+        print "ERROR: no such database: " + args[0]
+        return 1
+
+    conn = open_history(args[0])
+    try:
+        cols, rows = query_history(conn, unit=unit, rule=rule, tag=tag, last=last, regressions=regressions)
+    finally:
+        conn.close()
+    if table:
+        tab = texttable.Texttable()
+        tab.set_deco(texttable.Texttable.HEADER)
+        tab.set_precision(1)
+        def width(v):
+            return len("%.1f" % v) if isinstance(v, float) else len(unicode(v))
+        tab.set_cols_dtype(['i', 't', 't', 't'] + ['a'] * (len(cols) - 4))
+        tab.set_cols_width([max([len(c)] + [width(r[i]) for r in rows]) for i, c in enumerate(cols)])
+        tab.add_rows([cols] + [list(r) for r in rows])
+        print tab.draw()
+    else:
+        print json.dumps([dict(zip(cols, r)) for r in rows])
+    return 0
+
+#####################
+#  CHECK INDEX
+#####################
+
+INDEX_SCHEMA = """
+CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE units (unit TEXT PRIMARY KEY, spark TEXT, size INTEGER, mtime REAL);
+CREATE TABLE checks (unit TEXT NOT NULL, kind TEXT, rule TEXT NOT NULL, severity TEXT NOT NULL, status TEXT NOT NULL,
+                     file TEXT, line INTEGER, col INTEGER,
+                     ordinal INTEGER); -- position of the entry in the "proof"/"flow" list of the *.spark file
+"""
+INDEX_INDEXES = """
+CREATE INDEX checks_by_rule ON checks (rule, severity, unit);
+CREATE INDEX checks_by_severity ON checks (severity, unit);
+CREATE INDEX checks_by_unit ON checks (unit);
+"""
+
+def write_index(dbfile, abstract_units, folders):
     """
-    Makes a nice ascii table from the units dict, only using keys=filtercols
+    Write all check records of a run into a fresh SQLite database, indexed by
+    rule, severity and unit, for query. The units must have been read with the
+    "checks" extra. The old index is replaced atomically.
+
+    Only the location of the full entries is kept: the *.spark file of each unit
+    with its signature, and the ordinal of each check within its section.
     """
-    if len (units) == 0: return
-    tab = texttable.Texttable()
-    tab.set_deco(texttable.Texttable.HEADER)
-    tab.set_precision(1)
+    sparkfiles = {}
+    for fi in get_spark_files(folders):
+        sparkfiles[file2unit(file_base(fi))] = os.path.abspath(fi)
+    def unit_rows():
+        for u in abstract_units:
+            try:
+                yield (u, sparkfiles[u]) + file_signature(sparkfiles[u])
+            except (KeyError, OSError):
+                pass
+    def check_rows():
+        for u, s in abstract_units.iteritems():
+            ordinals = {}
+            for kind, rule, fi, line, col, status, severity in (c[:7] for c in s.checks):
+                n = ordinals.get(kind, 0)
+                ordinals[kind] = n + 1
+                yield (u, kind, rule, severity, status, fi, line, col, n)
+    tmpfile = dbfile + ".tmp"
+    if os.path.exists(tmpfile): os.remove(tmpfile)
+    conn = sqlite3.connect(tmpfile)
+    try:
+        with conn:
+            conn.executescript(INDEX_SCHEMA)
+            conn.executemany("INSERT INTO info (key, value) VALUES (?,?)",
+                             [("timestamp", datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+                              ("folders", ",".join(folders))])
+            conn.executemany("INSERT INTO units (unit, spark, size, mtime) VALUES (?,?,?,?)", unit_rows())
+            conn.executemany("INSERT INTO checks (%s) VALUES (%s)" %
+                             (", ".join(INDEX_COLUMNS), ",".join("?" * len(INDEX_COLUMNS))), check_rows())
+            # cheaper to build once all rows are in
+            conn.executescript(INDEX_INDEXES)
+    finally:
+        conn.close()
+    os.rename(tmpfile, dbfile)
 
-    # first row is header
-    firstrowvalue = units[0].itervalues().next()
-    header = ["unit"] + [k for k in firstrowvalue.iterkeys() if k in filtercols]
+def query_index(conn, rules=(), severities=(), units=(), statuses=()):
+    """
+    check records matching all of the given criteria; each criterion is a list
+    of alternatives, empty for any. units are glob patterns (*, ?, [...]).
+    Returns (column names, rows), ordered by unit and location.
+    """
+    where = []
+    args = []
+    for col, values in (("rule", rules), ("severity", severities), ("status", statuses)):
+        if values:
+            where.append(col + " IN (" + ",".join("?" * len(values)) + ")")
+            args.extend(values)
+    if units:
+        where.append("(" + " OR ".join(["unit GLOB ?"] * len(units)) + ")")
+        args.extend(units)
+    sql = "SELECT " + ", ".join(INDEX_COLUMNS) + " FROM checks" + \
+          (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY unit, file, line, col, rule"
+    return list(INDEX_COLUMNS), conn.execute(sql, args).fetchall()
 
-    num_datacols = (len(header)-1)
-    alignment = ["l"] + ["r"] * num_datacols
-    tab.set_cols_align(alignment);
+def load_entries(sparkfile, wanted):
+    """
+    the proof/flow entries at the positions (kind, ordinal) in wanted, as they
+    are in the *.spark file (without the assumptions)
+    """
+    def drop_claims(obj):
+        return None if "claim" in obj else obj
+    with open_file(sparkfile) as f:
+        contents = json.load(f, object_hook=drop_claims)
+    return {(kind, n): contents[kind][n] for kind, n in wanted}
 
-    data = [header]
-    maxlen = 0
-    for u in units:
-        u,uinfo = u.iteritems().next()
-        if len(u) > maxlen: maxlen = len(u)
-        fields = [v for k,v in uinfo.iteritems() if k in filtercols]
-        data.append([u] + fields)
-    tab.add_rows(data)
-    tab.set_cols_width([maxlen] + [8]*num_datacols)
+def index_details(conn, cols, rows):
+    """
+    Full proof/flow entries of the rows returned by query_index, in the same
+    order. Each *.spark file is parsed once. None for entries whose file has
+    changed since the index was written.
+    """
+    pos = dict((c, i) for i, c in enumerate(cols))
+    wanted = {}
+    for r in rows:
+        wanted.setdefault(r[pos["unit"]], set()).add((r[pos["kind"]], r[pos["ordinal"]]))
+    entries = {}
+    for u, (sparkfile, size, mtime) in \
+            ((u, conn.execute("SELECT spark, size, mtime FROM units WHERE unit = ?", (u,)).fetchone() or (None, 0, 0))
+             for u in sorted(wanted)):
+        try:
+            if not sparkfile or file_signature(sparkfile) != (size, mtime):
+                raise ValueError("changed since the index was written")
+            for key, e in load_entries(sparkfile, wanted[u]).iteritems():
+                entries[(u,) + key] = e
+        except (OSError, IOError, ValueError, KeyError, IndexError) as e:
+            print "WARNING: no details for unit " + u + " from " + str(sparkfile) + ": " + str(e)
+    return [entries.get((r[pos["unit"]], r[pos["kind"]], r[pos["ordinal"]])) for r in rows]
 
-    print tab.draw()
+def print_usage_query():
+    print __file__ + " query [OPTION] <index>"
+    print ''
+    print 'Finds checks in the index written with --index=<index>, without reading the'
+    print '*.spark files again. Each option takes a comma-separated list of alternatives.'
+    print ''
+    print 'OPTIONS:'
+    print '   --rule=R[,R]*'
+    print '          only checks of these rules, e.g., VC_OVERFLOW_CHECK,VC_RANGE_CHECK'
+    print '   --severity=S[,S]*'
+    print '          only checks with these severities (info, low, medium, high, ...)'
+    print '   --unit=U[,U]*'
+    print '          only checks of units matching these glob patterns, e.g., \'units.navigation\' or \'estimator.*\''
+    print '   --status=S[,S]*'
+    print '          only checks with this status (' + ",".join(CHECK_STATUS) + ', or all; default failed)'
+    print '   --details, -d'
+    print '          also print the full proof/flow entry of each check (JSON only), read from the'
+    print '          *.spark file of its unit on demand'
+    print '   --table, -t'
+    print '          print as human-readable table instead of JSON'
+
+def main_query(argv):
+    table = False
+    details = False
+    rules = []
+    severities = []
+    units = []
+    statuses = ["failed"]
+    try:
+        opts, args = getopt.getopt(argv, "htd", ["help","table","details","rule=","severity=","unit=","status="])
+    except getopt.GetoptError:
+        print_usage_query();
+        sys.exit(2)
+
+    for opt, arg in opts:
+        values = [v.strip() for v in arg.split(",") if v.strip()]
+        if opt in ('-h', "--help"):
+            print_usage_query()
+            sys.exit()
+        elif opt in ('-t', '--table'):
+            table = True
+        elif opt in ('-d', '--details'):
+            details = True
+        elif opt == '--rule':
+            rules.extend(v.upper() for v in values)
+        elif opt == '--severity':
+            severities.extend(v.lower() for v in values)
+        elif opt == '--unit':
+            units.extend(v.lower().replace("-", ".") for v in values) # unit names or file bases, no extension
+        elif opt == '--status':
+            statuses = [] if "all" in values else values
+            for v in statuses:
+                if v not in CHECK_STATUS:
+                    print "Status '" + v + "' unknown"
+
+    if len(args) != 1:
+        print_usage_query();
+        sys.exit(2)
+    if not os.path.isfile(args[0]):
+        print "ERROR: no such index: " + args[0]
+        return 1
+
+    conn = sqlite3.connect(args[0])
+    try:
+        cols, rows = query_index(conn, rules, severities, units, statuses)
+        entries = index_details(conn, cols, rows) if details and not table else None
+    except sqlite3.DatabaseError as e:
+        print "ERROR: cannot read index " + args[0] + ": " + str(e)
+        return 1
+    finally:
+        conn.close()
+    if entries is not None:
+        print json.dumps([dict(zip(cols, r) + [("details", e)]) for r, e in itertools.izip(rows, entries)])
+    elif table:
+        tab = texttable.Texttable()
+        tab.set_deco(texttable.Texttable.HEADER)
+        tab.set_cols_dtype(['t'] * len(cols))
+        tab.set_cols_width([max([len(c)] + [len(unicode(r[i])) for r in rows]) for i, c in enumerate(cols)])
+        tab.add_rows([cols] + [list(r) for r in rows])
+        print tab.draw()
+        print str(len(rows)) + " checks"
+    else:
+        print json.dumps([dict(zip(cols, r)) for r in rows])
+    return 0
+
+#####################
+#  MAIN
+#####################
+
+COMMANDS = {"diff": main_diff, "history": main_history, "budget": main_budget, "query": main_query,
+            "merge": main_merge, "flaky": main_flaky} # first argument -> main function of the command
 
 def print_usage():
     print __file__ + " -P<gprfile>  [OPTION] (<gnatprove folder>)+"
+    print __file__ + " <command> [OPTION] ..."
     print ''
     print 'OPTIONS:'
     print '   --sort=s[,s]*'
@@ -455,10 +2740,70 @@ def print_usage():
     print '          exclude units which contain any of the given strings'
     print '   --include=s[,s]*'
     print '          only include units which match exactly any of given strings'    
+    print '          for --exclude and --include, s=re:<regex> is a regular expression'
     print '   --details, -d'
-    print '          keep detailed proof/flow information for each unit'
+    print '          keep detailed proof/flow information for each unit (for large projects, rather'
+    print '          write an --index and load the details of single checks with query --details)'
+    print '   --top=N'
+    print '          only print the N worst units w.r.t. the sort criteria, worst first'
+    print '          (lowest coverage/success, highest skip/props/ents). Totals include all units.'
+    print '   --jobs=N, -j N'
+    print '          parse the *.spark files with N processes (default: number of cores, 0=auto)'
+    print ''
+    print '   A gnatprove folder can also be a tar archive of it (' + ",".join(ARCHIVE_SUFFIXES) + '), which is'
+    print '   read as a stream without extracting it, and files in the folders can be compressed'
+    print '   (' + ",".join(COMPRESSED_SUFFIXES) + '; *.xz needs the lzma module). Archives are not cached.'
+    print '   --no-cache'
+    print '          neither read nor write the cache (.<gnatprove folder>' + CACHE_SUFFIX + ')'
+    print '   --rebuild-cache'
+    print '          ignore the cache contents, parse everything and write a fresh cache'
+    print '   --prover-stats'
+    print '          also print time and steps of the proof attempts per prover and rule'
+    print '          (percentiles ' + ",".join(str(q) for q in PERCENTILES) + ' and max), and the slowest VCs'
+    print '   --slowest=N'
+    print '          with --prover-stats: number of slowest VCs (default ' + str(SLOWEST) + ')'
+    print '   --prover-contribution'
+    print '          also print which VCs each prover discharges alone, which ones would be lost'
+    print '          without it, and how much of its time went into VCs that others discharge too'
+    print '   --watch'
+    print '          follow a running gnatprove: poll the folders, parse new and changed *.spark'
+    print '          files and print progress and ETA, until all units are done or Ctrl-C'
+    print '   --interval=S'
+    print '          with --watch: poll every S seconds (default ' + str(WATCH_INTERVAL) + ')'
+    print '   --units-file=FILE'
+    print '          with --watch: units which are going to be analyzed, one per line (e.g., the'
+    print '          _units file of prove_all.sh). Default: all units with an ALI file'
+    print '   --time-log=FILE'
+    print '          add the resource usage (' + ",".join(RESOURCE_FIELDS) + ')'
+    print '          of the units from the /usr/bin/time -v output in the build log FILE (the'
+    print '          analysis.log of prove_all.sh). Only units analyzed on their own (INDIVIDUAL'
+    print '          mode, -u <unit>) get it; those columns can be sorted by (s=' + ",".join(RESOURCE_SORT_CRITERIA) + ')'
+    print '   --save=FILE'
+    print '          also write a summary of this run with all checks to FILE (JSON), e.g., for diff'
+    print '   --partial=FILE'
+    print '          also write the partial summary of this shard to FILE (counters, rule statistics'
+    print '          and unit names only), to be combined with those of other shards by merge'
+    print '   --history=DB'
+    print '          append the unit and rule statistics of this run to the SQLite database DB'
+    print '   --index=FILE'
+    print '          also write all checks of this run to the SQLite database FILE, indexed by rule,'
+    print '          severity and unit (see query)'
+    print '   --tag=T, --revision=REV'
+    print '          with --history: tag of the run (e.g., the prefix of prove_all.sh), and'
+    print '          its git revision (default: HEAD of the repository containing the first folder)'
+    print ''
+    print 'COMMANDS:'
+    print '   diff     compare two runs check by check (see diff --help)'
+    print '   flaky    nondeterministic proofs over several runs (see flaky --help)'
+    print '   history  trends and regressions from the history database (see history --help)'
+    print '   budget   simulate other timeout/steps/prover settings (see budget --help)'
+    print '   merge    totals of several shards from their partial summaries (see merge --help)'
+    print '   query    find checks by rule, severity and unit in an index (see query --help)'
 
 def main(argv):
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
     gfolders = []
     sorting = []
     exclude = []
@@ -466,9 +2811,26 @@ def main(argv):
     table = False
     details = False
     prjfile = None
+    jobs = 0
+    use_cache = True
+    top = None
+    rebuild_cache = False
+    savefile = None
+    partialfile = None
+    historyfile = None
+    indexfile = None
+    watching = False
+    proverstats = False
+    contribution = False
+    slowest = SLOWEST
+    interval = WATCH_INTERVAL
+    unitsfile = None
+    tag = None
+    revision = None
+    timelog = None
 
     try:
-        opts, args = getopt.getopt(argv, "hs:te:i:dP:", ["help","sort=","table","exclude=","include=","details","project"])
+        opts, args = getopt.getopt(argv, "hs:te:i:dP:j:", ["help","sort=","table","exclude=","include=","details","project","jobs=","no-cache","rebuild-cache","top=","save=","partial=","history=","index=","tag=","revision=","watch","interval=","units-file=","prover-stats","slowest=","prover-contribution","time-log="])
     except getopt.GetoptError:
         print_usage();
         sys.exit(2)
@@ -489,7 +2851,7 @@ def main(argv):
             cands = arg.split(",")
             for c in cands:
                 s = c.strip()
-                if s in KNOWN_SORT_CRITERIA:
+                if s in KNOWN_SORT_CRITERIA or s in RESOURCE_SORT_CRITERIA:
                     sorting.append(s)
                 else:
                     print "Sort criteria '" + s + "' unknown"
@@ -512,6 +2874,69 @@ def main(argv):
         elif opt in ('-d', '--details'):
             details = True
 
+        elif opt in ('-j', '--jobs'):
+            try:
+                jobs = int(arg)
+            except ValueError:
+                print "Number of jobs '" + arg + "' invalid"
+
+        elif opt == '--no-cache':
+            use_cache = False
+
+        elif opt == '--rebuild-cache':
+            rebuild_cache = True
+
+        elif opt == '--save':
+            savefile = arg
+
+        elif opt == '--partial':
+            partialfile = arg
+
+        elif opt == '--history':
+            historyfile = arg
+
+        elif opt == '--index':
+            indexfile = arg
+
+        elif opt == '--watch':
+            watching = True
+
+        elif opt == '--prover-stats':
+            proverstats = True
+
+        elif opt == '--prover-contribution':
+            contribution = True
+
+        elif opt == '--slowest':
+            try:
+                slowest = int(arg)
+            except ValueError:
+                print "Number of VCs '" + arg + "' invalid"
+
+        elif opt == '--interval':
+            try:
+                interval = float(arg)
+            except ValueError:
+                print "Interval '" + arg + "' invalid"
+
+        elif opt == '--units-file':
+            unitsfile = arg
+
+        elif opt == '--tag':
+            tag = arg
+
+        elif opt == '--revision':
+            revision = arg
+
+        elif opt == '--time-log':
+            timelog = arg
+
+        elif opt == '--top':
+            try:
+                top = int(arg)
+            except ValueError:
+                print "Number of units '" + arg + "' invalid"
+
     # not required at the moment
     # if not prjfile:
     #     print "ERROR: project file must be specified with flag -P"
@@ -523,6 +2948,8 @@ def main(argv):
             
     if not sorting:
         sorting = KNOWN_SORT_CRITERIA
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
     print "sorting: " + ",".join(sorting)
     print "exclude: " + ",".join(exclude)
     print "include: " + ",".join(include)
@@ -530,23 +2957,60 @@ def main(argv):
     gfolders = args
 
     print "Using folders: " + str(gfolders)
-    jsondata = get_json_data (gfolders)    
-    if not jsondata: return 1
+    cache = UnitCache(gfolders, rebuild=rebuild_cache) if use_cache else None
+    unitfilter = UnitFilter(include, exclude) if include or exclude else None
+    if watching:
+        expected = None
+        if unitsfile:
+            with open(unitsfile) as f:
+                expected = set(file2unit(l.strip()) for l in f if l.strip())
+            if unitfilter: expected = set(u for u in expected if unitfilter.match(u))
+        watcher = watch(gfolders, unitfilter, expected, interval)
+        print "TOTALS:"
+        if table:
+            pprint.pprint(watcher.totals())
+        else:
+            print json.dumps(watcher.totals())
+        return 0
 
-    jsondata = add_unitentities(jsondata, prjfile, gfolders)
-    if not jsondata: return 1
+    extras = set()
+    if savefile or indexfile: extras.add("checks")
+    if proverstats or contribution: extras.add("vcs")
+    extras = frozenset(extras)
+    unitdata = get_unit_data (gfolders, details=details, jobs=jobs, cache=cache, unitfilter=unitfilter,
+                              extras=extras)
+    if not unitdata: return 1
+    if savefile:
+        save_summary(make_summary(unitdata, gfolders), savefile)
+    if partialfile:
+        save_partial(make_partial(unitdata, gfolders), partialfile)
+    if historyfile:
+        if revision is None: revision = git_revision(os.path.abspath(gfolders[0]))
+        record_run(historyfile, unitdata, tag, revision, gfolders)
+    if indexfile:
+        write_index(indexfile, unitdata, gfolders)
+    if timelog and not os.path.isfile(timelog):
+        print "WARNING: no such time log: " + timelog
+        timelog = None
+    if timelog:
+        timedunits, timeblocks = parse_time_log(timelog)
+        untimed = add_resources(unitdata, timedunits)
+        if untimed:
+            print "time log: " + str(len(untimed)) + " timed units without statistics: " + ",".join(untimed)
 
-    
-    totals,abstract_units = get_statistics (jsondata, sorting=sorting, exclude=exclude, include=include, details=details)
+    totals,abstract_units = get_statistics (unitdata, sorting=sorting, top=top)
     if not totals or not abstract_units: return 2
+    if timelog:
+        totals["resources"] = resource_totals(timeblocks)
     #print abstract_units # all correct
 
     # print per unit
     if table:
         tablecols = ["unit","ents","success","coverage","coverage_spec","proven","props","flows","flows_success"]
+        if timelog: tablecols += ["wall_s","max_rss_mb"]
         print_table (abstract_units, tablecols)        
     else:
-        print json.dumps(abstract_units)
+        print json.dumps([{u : s.to_dict()} for u,s in abstract_units])
 
     # print totals
     print "TOTALS:"
@@ -555,7 +3019,29 @@ def main(argv):
     else:
         print json.dumps (totals)
 
+    if proverstats:
+        pstats = prover_statistics(unitdata, slowest)
+        print "PROVERS:"
+        if table:
+            print_prover_statistics(pstats)
+        else:
+            print json.dumps(pstats)
+
+    if contribution:
+        contrib = prover_contribution(unitdata)
+        print "CONTRIBUTION:"
+        if table:
+            print_prover_contribution(contrib)
+        else:
+            print json.dumps(contrib)
+
+    if cache:
+        print "cache: " + str(cache.hits) + " hits, " + str(cache.misses) + " misses"
     return 0
 
 if __name__ == "__main__":
-    main(sys.argv[1:])
+    # run the module under its own name, so that the pickled summaries (cache,
+    # worker results) refer to gnatprove_unitstats and not to __main__. Thus
+    # scripts importing this module share the cache with it.
+    import gnatprove_unitstats
+    gnatprove_unitstats.main(sys.argv[1:])